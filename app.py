@@ -1,23 +1,36 @@
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import re
+import json
+import time
+import random
+import bisect
+import hashlib
+import hmac
+import base64
+import binascii
+import uuid
+import queue
+import atexit
+from collections import Counter, OrderedDict, deque
+from functools import lru_cache, partial
+import click
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 import smtplib
 from email.message import EmailMessage
+from email.utils import formataddr
 from sqlalchemy.schema import UniqueConstraint
-from flask_migrate import Migrate
-import stripe
+from sqlalchemy import or_, and_, tuple_, event as db_event
+from sqlalchemy.exc import IntegrityError
 from flask  import abort
 from flask_login import current_user
-from langdetect import detect
 
 
 from dotenv import load_dotenv
 from flask import (
     Flask, render_template, request, jsonify,
-    session, redirect, url_for, flash
+    session, redirect, url_for, flash, g, has_request_context
 )
-from groq import Groq
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import (
     LoginManager, UserMixin,
@@ -25,11 +38,7 @@ from flask_login import (
     login_required, current_user
 )
 from werkzeug.security import generate_password_hash, check_password_hash
-from authlib.integrations.flask_client import OAuth
-from flask_mail import Mail
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadSignature
-from flask_mail import Message
-from libretranslatepy import LibreTranslateAPI
 import tempfile
 #import whisper 
 #from pydub import AudioSegment
@@ -39,16 +48,14 @@ import tempfile
 #DEBUGGING
 
 import logging
+from logging.handlers import QueueHandler, QueueListener
 import sys
 import shutil
-
-
-# Force logs to show up immediately in terminal
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
+import threading
+try:
+    import fcntl
+except ImportError:   # Windows: password hashing slots fall back to a per-process cap
+    fcntl = None
 
 
 #load_dotenv()
@@ -91,26 +98,203 @@ IS_DEV = (
     or os.getenv("PYTHON_ENV", "").lower() in ("dev", "development")
 )
 
+# ========================================================================
+# LOGGING
+# ========================================================================
+# Request threads only put records on a queue; a listener thread formats them
+# (one JSON object per line by default) and writes stdout. Records carry the
+# request's trace id as a correlation id. User/therapy text goes in
+# extra={"content": ...} and is redacted unless LOG_CONTENT=1; API secrets in
+# messages are always masked. DEBUG lines are sampled at LOG_DEBUG_SAMPLE.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text" if IS_DEV else "json")
+LOG_CONTENT = os.getenv("LOG_CONTENT", "0") == "1"
+LOG_DEBUG_SAMPLE = float(os.getenv("LOG_DEBUG_SAMPLE", "0.01"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+SECRET_RE = re.compile(r"\b(?:sk|rk|pk)_(?:live|test)_[A-Za-z0-9]+|\bwhsec_[A-Za-z0-9]+|\bgsk_[A-Za-z0-9]+")
+
+
+def redact(text):
+    return SECRET_RE.sub("[secret]", text)
+
+
+class LogContextFilter(logging.Filter):
+    """Runs in the calling thread: attaches the correlation id and samples DEBUG."""
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG and random.random() >= LOG_DEBUG_SAMPLE:
+            return False
+        record.trace_id = g.get("trace_id") if has_request_context() else None
+        return True
+
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat(timespec="milliseconds") + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": redact(record.getMessage()),
+            "pid": record.process,
+        }
+        if getattr(record, "trace_id", None):
+            entry["trace_id"] = record.trace_id
+        content = getattr(record, "content", None)
+        if content is not None:
+            entry["content"] = content if LOG_CONTENT else f"[redacted {len(str(content))} chars]"
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextLogFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s [%(levelname)s] %(message)s")
+
+    def format(self, record):
+        line = redact(super().format(record))
+        if getattr(record, "trace_id", None):
+            line += f" trace={record.trace_id}"
+        content = getattr(record, "content", None)
+        if content is not None:
+            line += f" | {content}" if LOG_CONTENT else f" | [redacted {len(str(content))} chars]"
+        return line
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: when the listener falls behind, records are dropped and counted."""
+
+    dropped = 0
+
+    def prepare(self, record):
+        return record  # formatting happens on the listener thread
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+_log_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+_log_handler.addFilter(LogContextFilter())
+_log_listener = None
+
+
+def start_log_listener():
+    """(Re)start the writer thread. Threads don't survive fork, so children start their own."""
+    global _log_listener
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonLogFormatter() if LOG_FORMAT == "json" else TextLogFormatter())
+    _log_handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _log_listener = QueueListener(_log_handler.queue, stream)
+    _log_listener.start()
+
+
+def stop_log_listener():
+    if _log_listener is not None and _log_listener._thread is not None:
+        _log_listener.stop()  # drains what's queued
+
+
+logging.basicConfig(level=LOG_LEVEL, handlers=[_log_handler], force=True)
+start_log_listener()
+atexit.register(stop_log_listener)
+os.register_at_fork(after_in_child=start_log_listener)
+
+
+# ========================================================================
+# LAZY SERVICE CLIENTS
+# ========================================================================
+# groq, stripe, authlib and libretranslatepy are slow to import and their
+# clients hold connection pools. Nothing is imported or built at module import:
+# each client is created on first use, i.e. inside the worker after a
+# `gunicorn --preload` fork, so pools are never shared between processes.
+class LazyProxy:
+    """Stands in for an object built by `factory()` on first attribute access."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._obj = None
+        self._lock = threading.Lock()
+
+    def _resolve(self):
+        if self._obj is None:
+            with self._lock:
+                if self._obj is None:
+                    self._obj = self._factory()
+        return self._obj
+
+    @property
+    def loaded(self):
+        return self._obj is not None
+
+    def reset(self):
+        """Drop the built object (e.g. in a freshly forked worker)."""
+        self._obj = None
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name, value):
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._resolve(), name, value)
+
+
+def _build_groq():
+    import httpx
+    from groq import Groq, DefaultHttpxClient
+    from groq._constants import DEFAULT_CONNECTION_LIMITS
+
+    class TimedTransport(httpx.HTTPTransport):
+        def handle_request(self, request):
+            with track_upstream("groq", upstream_op(request.url.path)) as t:
+                response = super().handle_request(request)
+                if response.status_code >= 429:
+                    inc("upstream_errors_total", **t.labels)
+                return response
+
+    transport = TimedTransport(limits=DEFAULT_CONNECTION_LIMITS)
+    return Groq(api_key=os.getenv("GROQ_API_KEY"), http_client=DefaultHttpxClient(transport=transport))
+
+
 # Groq client
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+client = LazyProxy(_build_groq)
 TRANSCRIBE_MODEL = os.getenv("GROQ_TRANSCRIBE_MODEL", "whisper-large-v3")
 
-# Dev-only Whisper (avoid importing in production)
-whisper_model = None
-if IS_DEV:
-    try:
-        import whisper  # heavy dependency → keep in dev only
-        whisper_model = whisper.load_model(os.getenv("WHISPER_MODEL", "base"))
-        logger.info("Loaded local Whisper model for DEV.")
-    except Exception as e:
-        logger.warning("Whisper not available in dev: %s", e)
+# Dev-only Whisper (avoid importing in production); loaded on the first transcription
+_whisper_model = None
+
+
+def get_whisper_model():
+    global _whisper_model
+    if not IS_DEV:
+        return None
+    if _whisper_model is None:
+        try:
+            import whisper  # heavy dependency → keep in dev only
+            _whisper_model = whisper.load_model(os.getenv("WHISPER_MODEL", "base"))
+            logger.info("Loaded local Whisper model for DEV.")
+        except Exception as e:
+            logger.warning("Whisper not available in dev: %s", e)
+            _whisper_model = False
+    return _whisper_model or None
+
 
 logger.info("App mode: %s", "DEV" if IS_DEV else "PROD")
 
 MODEL = "llama-3.3-70b-versatile"   # or "llama-3.1-70b-versatile" if you want stronger model
 user_sessions = {}
 
-lt = LibreTranslateAPI("https://translate.argosopentech.com/")  # free public server
+
+def _build_translator():
+    from libretranslatepy import LibreTranslateAPI
+    # Free public server by default; LIBRETRANSLATE_URL points at a self-hosted one (or the load-test fake)
+    return LibreTranslateAPI(os.getenv("LIBRETRANSLATE_URL", "https://translate.argosopentech.com/"))
+
+
+lt = LazyProxy(_build_translator)
 
 # translation Helper
 
@@ -118,14 +302,15 @@ def translate_text(text, target_lang):
     if not text.strip():
         return text
     try:
-        return lt.translate(text, target_lang)
+        with track_upstream("libretranslate", "translate"):
+            return lt.translate(text, target_lang)
     except Exception as e:
-        print("Translation error:", e)
+        logger.warning("Translation error: %s", e)
         return text
 
 def therapist_reply(user_id, session_id, user_message, user_lang="en"):
-    print(f"[DEBUG] Detected language: {user_lang}")
-    print(f"[DEBUG] Original message: {user_message}")
+    logger.debug("Detected language: %s", user_lang)
+    logger.debug("Original message", extra={"content": user_message})
 
     if user_id not in user_sessions:
         user_sessions[user_id] = {}
@@ -152,7 +337,7 @@ def therapist_reply(user_id, session_id, user_message, user_lang="en"):
         )
         reply_en = response.choices[0].message.content.strip()
     except Exception as e:
-        print("[ERROR] Chat API error:", e)
+        logger.error("Chat API error: %s", e)
         reply_en = "Sorry, something went wrong."
 
     # 3. Safeguard: avoid repetition
@@ -211,11 +396,9 @@ app.secret_key = os.getenv(
     "2a62ca2fbe9226e0f0892d5762315c4e3490c1f096b968e9fc6d69cfd2533cf3"
 )
 
-used_reset_tokens = set()
-
-
-# Configure Flask-Mail
-app.config['MAIL_SERVER'] = os.getenv("MAIL_SERVER", "smtp.hostinger.com")
+# Mail settings (SMTPConnection in the email outbox reads these)
+DEFAULT_MAIL_SERVER = "smtp.hostinger.com"   # needs MAIL_USERNAME/MAIL_PASSWORD
+app.config['MAIL_SERVER'] = os.getenv("MAIL_SERVER", DEFAULT_MAIL_SERVER)
 app.config['MAIL_PORT'] = int(os.getenv("MAIL_PORT", 465))
 app.config['MAIL_USE_SSL'] = os.getenv("MAIL_USE_SSL", "true").lower() == "true"
 app.config['MAIL_USE_TLS'] = os.getenv("MAIL_USE_TLS", "false").lower() == "true"
@@ -226,51 +409,1003 @@ app.config['MAIL_DEFAULT_SENDER'] = (
     os.getenv("MAIL_DEFAULT_SENDER", "support@theralinkapp.com")
 )
 
-# Initialize Flask-Mail
-mail = Mail(app)
 
+def mail_configured():
+    """A server of our own (relays may not need auth), or the default host with credentials."""
+    server = app.config.get("MAIL_SERVER")
+    if not server:
+        return False
+    return server != DEFAULT_MAIL_SERVER or bool(app.config.get("MAIL_USERNAME") and app.config.get("MAIL_PASSWORD"))
 
 
 # Stripe setup
-stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+STRIPE_TIMEOUT = int(os.getenv("STRIPE_TIMEOUT", "10"))
+
+
+def _load_stripe():
+    import stripe
+    import requests
+    stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+    if os.getenv("STRIPE_API_BASE"):
+        stripe.api_base = os.getenv("STRIPE_API_BASE")   # e.g. http://localhost:12111 for stripe-mock
+
+    class TimedRequestsClient(stripe.RequestsClient):
+        def request(self, method, url, headers, post_data=None):
+            from urllib.parse import urlsplit
+            with track_upstream("stripe", upstream_op(urlsplit(url).path)) as t:
+                body, status, response_headers = super().request(method, url, headers, post_data)
+                if status >= 429:
+                    inc("upstream_errors_total", **t.labels)
+                return body, status, response_headers
+
+    # Keep-alive session (pooled connections) with a short timeout so a slow
+    # Stripe doesn't pin a gunicorn worker for the default 80s
+    stripe.default_http_client = TimedRequestsClient(timeout=STRIPE_TIMEOUT, session=requests.Session())
+    stripe.max_network_retries = int(os.getenv("STRIPE_MAX_RETRIES", "1"))
+    return stripe
+
+
+stripe = LazyProxy(_load_stripe)
 PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY")
 
 # Token serializer (for password setup links)
 serializer = URLSafeTimedSerializer(app.secret_key)
+LINK_TOKEN_MAX_AGE = 3600   # setup/reset links are valid for 1 hour, and once (see token_used)
 
 def generate_setup_token(email):
     return serializer.dumps(email, salt="setup-password")
 
-def verify_setup_token(token, max_age=3600):  # token valid for 1 hour
+def verify_setup_token(token, max_age=LINK_TOKEN_MAX_AGE):
     try:
         email = serializer.loads(token, salt="setup-password", max_age=max_age)
     except (SignatureExpired, BadSignature):
         return None
-    return email
+    return None if token_used(token) else email
+
 
 
+# ========================================================================
+# STATIC ASSETS + CACHE POLICY
+# ========================================================================
+# `flask build-assets` copies static files to static/build/ under content-hashed
+# names (call.3f9a1c2b7d4e.js) with .gz/.br siblings and writes a manifest.
+# url_for('static', ...) then points at the fingerprinted copy, which is
+# cached forever; everything else that is dynamic stays no-store.
+ASSET_BUILD_DIR = "build"
+ASSET_COMPRESSIBLE = {".js", ".css", ".json", ".svg", ".html", ".xml", ".txt", ".map"}
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+NO_STORE_CACHE = (
+    "no-store, no-cache, must-revalidate, max-age=0, private, "
+    "proxy-revalidate, s-maxage=0"
+)
+
+
+def load_asset_manifest():
+    path = os.path.join(app.static_folder, ASSET_BUILD_DIR, "manifest.json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+ASSET_MANIFEST = load_asset_manifest()
+# Changes whenever any static file changes; used to key caches on deploy
+ASSET_VERSION = ASSET_MANIFEST.get("__version__", "dev")
+
+
+# Per-page script bundles: shared modules first, then the page entry. Pages
+# only pull the shared modules they use. Without a build (dev) the files are
+# emitted as separate <script defer> tags in the same order.
+JS_BUNDLES = {
+    "call.js": ["shared/tts.js", "shared/recorder.js", "shared/session_sync.js", "shared/call_i18n.js",
+                "shared/session_search.js", "call.js"],
+    "trial.js": ["shared/tts.js", "shared/recorder.js", "shared/session_sync.js", "shared/call_i18n.js", "trial.js"],
+    "chat.js": ["shared/chat_sessions.js", "shared/session_search.js", "chat.js"],
+    "trial_chat.js": ["shared/chat_sessions.js", "trial_chat.js"],
+}
+
+
+def bundle_urls(name):
+    if f"bundles/{name}" in ASSET_MANIFEST:
+        return [url_for("static", filename=f"bundles/{name}")]
+    return [url_for("static", filename=f) for f in JS_BUNDLES[name]]
+
+
+@app.template_global()
+def script_bundle(name):
+    from markupsafe import Markup
+    return Markup("\n".join(f'<script defer src="{u}"></script>' for u in bundle_urls(name)))
+
+
+@app.template_global()
+def preload_bundle(name):
+    from markupsafe import Markup
+    return Markup("\n".join(f'<link rel="preload" as="script" href="{u}">' for u in bundle_urls(name)))
+
+
+def build_js_bundle(name):
+    """Concatenate a bundle's sources and minify them when rjsmin is available."""
+    sources = []
+    for rel in JS_BUNDLES[name]:
+        with open(os.path.join(app.static_folder, rel), encoding="utf-8") as f:
+            sources.append(f.read())
+    code = "\n;\n".join(sources)
+    try:
+        import rjsmin
+        code = rjsmin.jsmin(code)
+    except ImportError:
+        pass
+    return code.encode("utf-8")
+
+
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+    if endpoint == "static":
+        hashed = ASSET_MANIFEST.get(values.get("filename"))
+        if hashed:
+            values["filename"] = f"{ASSET_BUILD_DIR}/{hashed}"
+
+
+def serve_static(filename):
+    """Static handler: serves .br/.gz variants when accepted; ETag, 304 and Range come from send_file."""
+    from werkzeug.security import safe_join
+    from flask import send_file
+    import mimetypes
+
+    path = safe_join(app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    accepted = request.accept_encodings
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if accepted[encoding] and os.path.isfile(path + suffix):
+            mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            response = send_file(path + suffix, mimetype=mimetype, conditional=True, etag=True)
+            response.headers["Content-Encoding"] = encoding
+            break
+    else:
+        response = send_file(path, conditional=True, etag=True)
+
+    if os.path.splitext(path)[1] in ASSET_COMPRESSIBLE:
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+app.view_functions["static"] = serve_static
+
 
-# Prevent caching everywhere (safe + simple); avoids back/forward reopening pages
 @app.after_request
 def add_header(response):
+    if request.endpoint == "static":
+        if (request.view_args or {}).get("filename", "").startswith(ASSET_BUILD_DIR + "/"):
+            # Fingerprinted: the URL changes whenever the content does
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE
+        else:
+            # Plain /static/... path: cache, but revalidate with the ETag every time
+            response.headers["Cache-Control"] = "public, no-cache"
+        return response
+    if request.endpoint == "i18n_bundle":
+        return response  # sets its own public caching
+    if g.get("page_cache_control"):
+        response.headers["Cache-Control"] = g.page_cache_control
+        return response
+
     # Strict cache rules to prevent back/forward button login bypass
-    response.headers["Cache-Control"] = (
-        "no-store, no-cache, must-revalidate, max-age=0, private, "
-        "proxy-revalidate, s-maxage=0"
-    )
+    response.headers["Cache-Control"] = NO_STORE_CACHE
     response.headers["Pragma"] = "no-cache"   # Legacy
     response.headers["Expires"] = "0"         # Expired immediately
     return response
 
 
+@app.cli.command("asset-report")
+def asset_report_command():
+    """Bytes shipped per page bundle (raw / minified / gzip) and V8 compile time via node."""
+    import gzip
+    import subprocess
+    node = shutil.which("node")
+    click.echo(f"{'bundle':<16}{'files':>6}{'raw':>10}{'min':>10}{'gzip':>10}{'compile ms':>12}")
+    for name, files in JS_BUNDLES.items():
+        raw = sum(os.path.getsize(os.path.join(app.static_folder, f)) for f in files)
+        code = build_js_bundle(name)
+        gz = len(gzip.compress(code, compresslevel=9))
+        compile_ms = "-"
+        if node:
+            probe = ("const vm=require('vm');const s=require('fs').readFileSync(0,'utf8');"
+                     "let t=process.hrtime.bigint();for(let i=0;i<20;i++)new vm.Script(s+'//'+i);"
+                     "console.log((Number(process.hrtime.bigint()-t)/20e6).toFixed(2))")
+            result = subprocess.run([node, "-e", probe], input=code, capture_output=True)
+            compile_ms = result.stdout.decode().strip() or "-"
+        click.echo(f"{name:<16}{len(files):>6}{raw:>10}{len(code):>10}{gz:>10}{compile_ms:>12}")
+
+
+@app.cli.command("build-assets")
+def build_assets_command():
+    """Fingerprint and precompress static files into static/build/."""
+    import gzip
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        click.echo("brotli not installed; writing gzip only")
+
+    build_dir = os.path.join(app.static_folder, ASSET_BUILD_DIR)
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.makedirs(build_dir)
+
+    def static_files():
+        for root, dirs, files in os.walk(app.static_folder):
+            dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != build_dir)
+            for name in sorted(files):
+                src = os.path.join(root, name)
+                with open(src, "rb") as f:
+                    yield os.path.relpath(src, app.static_folder).replace(os.sep, "/"), f.read()
+        for name in sorted(JS_BUNDLES):
+            yield f"bundles/{name}", build_js_bundle(name)
+
+    manifest = {}
+    version = hashlib.sha256()
+    raw_bytes = gz_bytes = 0
+    for rel, data in static_files():
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        base, ext = os.path.splitext(rel)
+        hashed = f"{base}.{digest}{ext}"
+        manifest[rel] = hashed
+        version.update(f"{rel}:{digest}".encode())
+
+        dest = os.path.join(build_dir, hashed)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(dest, "wb") as f:
+            f.write(data)
+
+        if ext.lower() in ASSET_COMPRESSIBLE:
+            gz = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(gz) < len(data):
+                with open(dest + ".gz", "wb") as f:
+                    f.write(gz)
+                raw_bytes += len(data)
+                gz_bytes += len(gz)
+            if brotli:
+                br = brotli.compress(data, quality=11)
+                if len(br) < len(data):
+                    with open(dest + ".br", "wb") as f:
+                        f.write(br)
+
+    manifest["__version__"] = version.hexdigest()[:12]
+    with open(os.path.join(build_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    click.echo(f"Built {len(manifest) - 1} assets (version {manifest['__version__']}); "
+               f"text assets {raw_bytes} -> {gz_bytes} bytes gzipped")
+
+
+# ========================================================================
+# I18N (server-side rendering of the language packs)
+# ========================================================================
+# static/lang/*.json are compiled once at startup. Pages are rendered in the
+# visitor's language (?lang= or the `lang` cookie the client sets), so the first
+# paint is already translated; the client gets the active pack inline and only
+# fetches /i18n/<version>/<lang>.json (cached forever) when switching language.
+I18N_DEFAULT = "en"
+I18N_COOKIE = "lang"
+I18N_TEXT_RE = re.compile(
+    r'(<(?P<tag>[a-zA-Z][a-zA-Z0-9]*)\b[^>]*?\sdata-i18n="(?P<key>[^"]+)"[^>]*>)[^<]*(</(?P=tag)>)'
+)
+I18N_PLACEHOLDER_RE = re.compile(
+    r'<[a-zA-Z][a-zA-Z0-9]*\b[^>]*?\sdata-i18n-placeholder="(?P<key>[^"]+)"[^>]*>'
+)
+I18N_PLACEHOLDER_ATTR_RE = re.compile(r'\splaceholder="[^"]*"')
+
+
+def load_translations():
+    packs, payloads = {}, {}
+    digest = hashlib.sha256()
+    lang_dir = os.path.join(app.static_folder, "lang")
+    for name in sorted(os.listdir(lang_dir)):
+        code, ext = os.path.splitext(name)
+        if ext != ".json":
+            continue
+        with open(os.path.join(lang_dir, name), "rb") as f:
+            raw = f.read()
+        packs[code] = json.loads(raw)
+        payloads[code] = json.dumps(packs[code], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        digest.update(code.encode() + b":" + payloads[code])
+    return packs, payloads, digest.hexdigest()[:12]
+
+
+TRANSLATIONS, I18N_PAYLOADS, I18N_VERSION = load_translations()
+
+
+def current_lang():
+    """?lang= wins, then the cookie the client sets when a language is picked."""
+    for lang in (request.args.get("lang"), request.cookies.get(I18N_COOKIE)):
+        if lang in TRANSLATIONS:
+            return lang
+    return I18N_DEFAULT
+
+
+@app.context_processor
+def inject_i18n():
+    lang = current_lang()
+    return {"lang": lang, "translations": TRANSLATIONS[lang]}
+
+
+@app.template_global()
+def t(key, default=None):
+    """Translate a key in templates: {{ t('chat_title', 'Chat') }}."""
+    return TRANSLATIONS[current_lang()].get(key, default if default is not None else key)
+
+
+@app.template_global()
+def i18n_boot():
+    """Inline head script: the active pack plus fetchI18n(lang) for the page loaders.
+
+    fetchI18n resolves to a Response so callers keep their `res.ok` / `res.json()`
+    handling; it also remembers the choice in a cookie for the next server render.
+    """
+    from markupsafe import Markup
+    from jinja2.utils import htmlsafe_json_dumps
+    lang = current_lang()
+    config = htmlsafe_json_dumps({
+        "lang": lang,
+        "url": url_for("i18n_bundle", version=I18N_VERSION, lang="__LANG__"),
+        "dict": TRANSLATIONS[lang],
+    })
+    return Markup(
+        "<script>window.__I18N__=" + config + ";"
+        "window.fetchI18n=function(lang){var c=window.__I18N__;"
+        f'document.cookie="{I18N_COOKIE}="+encodeURIComponent(lang)+";path=/;max-age=31536000;SameSite=Lax";'
+        "if(lang===c.lang)return Promise.resolve(new Response(JSON.stringify(c.dict),"
+        '{headers:{"Content-Type":"application/json"}}));'
+        'return fetch(c.url.replace("__LANG__",encodeURIComponent(lang)));};</script>'
+    )
+
+
+def localize_html(html, lang):
+    """Apply data-i18n / data-i18n-placeholder the way the client loaders do (textContent / placeholder)."""
+    from markupsafe import escape
+    pack = TRANSLATIONS[lang]
+
+    def text(match):
+        value = pack.get(match.group("key"))
+        if value is None:
+            return match.group(0)
+        return f"{match.group(1)}{escape(value)}{match.group(4)}"
+
+    def placeholder(match):
+        value = pack.get(match.group("key"))
+        if value is None:
+            return match.group(0)
+        attr = f'data-i18n-placeholder="{match.group("key")}"'
+        tag = I18N_PLACEHOLDER_ATTR_RE.sub("", match.group(0))
+        return tag.replace(attr, f'{attr} placeholder="{escape(value)}"', 1)
+
+    html = I18N_TEXT_RE.sub(text, html)
+    html = I18N_PLACEHOLDER_RE.sub(placeholder, html)
+    if lang == "ar":
+        html = html.replace("<body>", '<body dir="rtl">', 1)
+    return html
+
+
+@app.after_request
+def localize_response(response):
+    if (
+        response.status_code == 200
+        and not g.get("i18n_localized")
+        and response.mimetype == "text/html"
+        and not response.direct_passthrough
+        and b"__I18N__" in response.get_data()
+    ):
+        response.set_data(localize_html(response.get_data(as_text=True), current_lang()))
+    return response
+
+
+@app.route("/i18n/<version>/<lang>.json")
+def i18n_bundle(version, lang):
+    if lang not in I18N_PAYLOADS:
+        abort(404)
+    response = app.response_class(I18N_PAYLOADS[lang], mimetype="application/json")
+    response.set_etag(f"{I18N_VERSION}-{lang}")
+    if version == I18N_VERSION:
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE
+    else:
+        # Stale version from an old page: serve the current pack, but don't pin it
+        response.headers["Cache-Control"] = "public, no-cache"
+    return response.make_conditional(request)
+
+
+# ========================================================================
+# PAGE CACHE (public, per-language pages)
+# ========================================================================
+# Landing, legal and trial pages render the same HTML for every anonymous
+# visitor in a given language, so the localized body is rendered once per
+# (template, lang, asset version, i18n version) and served with a strong ETag.
+# A deploy changes the versions (and restarts the process), which invalidates it.
+PAGE_CACHE = {}
+PAGE_CACHE_CONTROL = "private, no-cache"  # revalidate every time; 304 when unchanged
+
+
+def render_cached(template, **context):
+    """render_template() for pages with no per-user state; answers If-None-Match with 304."""
+    lang = current_lang()
+    if session.get("_flashes") or app.debug:
+        # Pending flash messages belong to one visitor; in debug, templates reload
+        return render_template(template, **context)
+
+    key = (template, lang, ASSET_VERSION, I18N_VERSION, tuple(sorted(context.items())))
+    entry = PAGE_CACHE.get(key)
+    status = "hit"
+    if entry is None:
+        body = localize_html(render_template(template, **context), lang).encode("utf-8")
+        entry = PAGE_CACHE[key] = (body, hashlib.sha256(body).hexdigest()[:20])
+        status = "miss"
+
+    body, etag = entry
+    g.page_cache_control = PAGE_CACHE_CONTROL
+    g.i18n_localized = True
+    response = app.response_class(body, mimetype="text/html")
+    response.set_etag(etag)
+    response.vary.add("Cookie")  # lang cookie picks the variant
+    response.headers["X-Page-Cache"] = status
+    return response.make_conditional(request)
+
+
+# ========================================================================
+# METRICS (Prometheus text format at /metrics)
+# ========================================================================
+# In-process counters and histograms: a request costs two perf_counter() calls,
+# a bisect and a few dict updates. Each gunicorn worker writes a snapshot to
+# METRICS_DIR at most every METRICS_FLUSH_SECONDS; /metrics merges every
+# worker's snapshot, so a scrape sees all processes (others lag by up to the
+# flush interval). Queue depths are read from the DB at scrape time.
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "theralink-metrics"))
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # bearer token for /metrics; without one it is 404 outside dev
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+METRIC_DEFS = {
+    "http_request_duration_seconds": ("histogram", "Request latency by endpoint", LATENCY_BUCKETS),
+    "http_requests_total": ("counter", "Requests by endpoint and status", None),
+    "upstream_request_duration_seconds": ("histogram", "Groq/Stripe/LibreTranslate/SMTP call latency", LATENCY_BUCKETS),
+    "upstream_errors_total": ("counter", "Failed upstream calls", None),
+    "transcribe_stage_seconds": ("histogram", "Time per /transcribe stage", LATENCY_BUCKETS),
+    "session_payload_bytes": ("histogram", "Size of saved UserSession payloads", SIZE_BUCKETS),
+    "session_messages": ("histogram", "Messages per saved UserSession", COUNT_BUCKETS),
+    "password_hash_seconds": ("histogram", "Time spent hashing/verifying a password", LATENCY_BUCKETS),
+    "password_hash_wait_seconds": ("histogram", "Wait for a password hashing slot", LATENCY_BUCKETS),
+    "password_hash_rejected_total": ("counter", "Hashes refused after PASSWORD_HASH_QUEUE_TIMEOUT", None),
+}
+_metrics = {name: {} for name in METRIC_DEFS}  # name -> {label tuple: value or [buckets..., sum, count]}
+_metrics_lock = threading.Lock()
+_metrics_flushed_at = 0.0
+
+
+def observe(name, value, **labels):
+    buckets = METRIC_DEFS[name][2]
+    key = tuple(labels.items())
+    with _metrics_lock:
+        series = _metrics[name].get(key)
+        if series is None:
+            series = _metrics[name][key] = [0] * (len(buckets) + 3)
+        series[bisect.bisect_left(buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+
+def inc(name, amount=1, **labels):
+    key = tuple(labels.items())
+    with _metrics_lock:
+        _metrics[name][key] = _metrics[name].get(key, 0) + amount
+
+
+class track_upstream:
+    """with track_upstream("smtp", "send"): ...  — latency plus an error count on exceptions."""
+
+    def __init__(self, service, op):
+        self.labels = {"service": service, "op": op}
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        observe("upstream_request_duration_seconds", elapsed, **self.labels)
+        record_span(self.labels["service"], elapsed)
+        if exc_type is not None:
+            inc("upstream_errors_total", **self.labels)
+        return False
+
+
+def upstream_op(path):
+    """/openai/v1/chat/completions -> chat/completions; /v1/customers/cus_123 -> customers (ids dropped)."""
+    parts = [p for p in path.strip("/").split("/") if p and p.islower() and not any(c.isdigit() for c in p)]
+    parts = [p for p in parts if p not in ("openai", "v1", "v2")]
+    return "/".join(parts[:2]) or "root"
+
+
+def _metrics_snapshot_path(pid=None):
+    return os.path.join(METRICS_DIR, f"metrics-{pid or os.getpid()}.json")
+
+
+def flush_metrics(force=False):
+    """Write this process's snapshot for other workers' /metrics to merge."""
+    global _metrics_flushed_at
+    now = time.monotonic()
+    if not force and now - _metrics_flushed_at < METRICS_FLUSH_SECONDS:
+        return
+    _metrics_flushed_at = now
+    with _metrics_lock:
+        snapshot = {name: [[list(k), v] for k, v in series.items()] for name, series in _metrics.items()}
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    tmp = _metrics_snapshot_path() + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, _metrics_snapshot_path())
+
+
+def collect_metrics():
+    """Merge every process's snapshot (this one is flushed first)."""
+    flush_metrics(force=True)
+    merged = {name: {} for name in METRIC_DEFS}
+    for fname in os.listdir(METRICS_DIR):
+        if not (fname.startswith("metrics-") and fname.endswith(".json")):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, fname)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, series in snapshot.items():
+            if name not in merged:
+                continue
+            for labels, value in series:
+                key = tuple(tuple(pair) for pair in labels)
+                if isinstance(value, list):
+                    acc = merged[name].setdefault(key, [0] * len(value))
+                    merged[name][key] = [a + b for a, b in zip(acc, value)]
+                else:
+                    merged[name][key] = merged[name].get(key, 0) + value
+    return merged
+
+
+def _prom_labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def render_metrics(merged, gauges):
+    lines = []
+    for name, (kind, help_text, buckets) in METRIC_DEFS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for key, value in sorted(merged[name].items()):
+            if kind == "counter":
+                lines.append(f"{name}{_prom_labels(key)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ["+Inf"], value[:-2]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_prom_labels(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_prom_labels(key)} {value[-2]:.6f}")
+            lines.append(f"{name}_count{_prom_labels(key)} {value[-1]}")
+    for name, (help_text, series) in gauges.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for key, value in series:
+            lines.append(f"{name}{_prom_labels(key)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def queue_gauges():
+    jobs = db.session.query(Job.kind, Job.status, db.func.count()).group_by(Job.kind, Job.status).all()
+    outbox = db.session.query(EmailOutbox.status, db.func.count()).group_by(EmailOutbox.status).all()
+    events = db.session.query(StripeEvent.status, db.func.count()).group_by(StripeEvent.status).all()
+    return {
+        "job_queue_depth": ("Jobs by kind and status", [((("kind", k), ("status", s)), n) for k, s, n in jobs]),
+        "email_outbox_depth": ("Outbox rows by status", [((("status", s),), n) for s, n in outbox]),
+        "stripe_event_depth": ("Stripe ledger rows by status", [((("status", s),), n) for s, n in events]),
+    }
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        endpoint = request.endpoint or "unmatched"
+        observe("http_request_duration_seconds", time.perf_counter() - started,
+                endpoint=endpoint, method=request.method)
+        inc("http_requests_total", endpoint=endpoint, status=response.status_code)
+        flush_metrics()
+    return response
+
+
+@app.route("/metrics")
+def metrics():
+    if not METRICS_TOKEN:
+        if not IS_DEV:
+            abort(404)   # fail closed: per-route traffic and internals stay private
+    elif not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        abort(401)
+    try:
+        gauges = queue_gauges()
+    except Exception:
+        app.logger.exception("Could not read queue depths for /metrics")
+        gauges = {}
+    body = render_metrics(collect_metrics(), gauges)
+    return app.response_class(body, mimetype="text/plain; version=0.0.4")
+
+
+# ========================================================================
+# TRACING + SAMPLING PROFILER
+# ========================================================================
+# Every response carries an X-Trace-Id (the incoming X-Request-ID when there is
+# one). Spans around DB queries, upstream calls (track_upstream) and ffmpeg are
+# collected per request in g.spans; while an admin profile or TRACE_SERVER_TIMING
+# is on they are summarized in a Server-Timing header and kept in RECENT_TRACES.
+# The stack sampler only runs for the profiled endpoint, so when profiling is
+# off the cost is one timestamp comparison per request.
+TRACE_SERVER_TIMING = os.getenv("TRACE_SERVER_TIMING", "0") == "1"
+PROFILE_MAX_SECONDS = 300
+RECENT_TRACES = deque(maxlen=200)
+# Per process: under gunicorn each worker profiles the share of traffic it receives
+PROFILE = {"endpoint": None, "until": 0.0, "interval": 0.005, "requests": 0, "stacks": Counter()}
+_profile_lock = threading.Lock()
+
+
+def record_span(name, duration):
+    if has_request_context():
+        spans = g.get("spans")
+        if spans is not None:
+            spans.append((name, duration))
+
+
+class span:
+    """with span("ffmpeg"): ...  — adds a timed span to the current request trace."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record_span(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def _db_span_start(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and g.get("spans") is not None:
+        conn.info.setdefault("span_started", []).append(time.perf_counter())
+
+
+def _db_span_end(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("span_started")
+    if started:
+        record_span("db", time.perf_counter() - started.pop())
+
+
+def _db_span_error(exception_context):
+    # after_cursor_execute never fires for a failed statement
+    if exception_context.connection is not None:
+        exception_context.connection.info.pop("span_started", None)
+
+
+def trace_db_queries(engine):
+    """Time the app engine's queries as "db" spans of the current request (workers and CLI record nothing)."""
+    db_event.listen(engine, "before_cursor_execute", _db_span_start)
+    db_event.listen(engine, "after_cursor_execute", _db_span_end)
+    db_event.listen(engine, "handle_error", _db_span_error)
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack every `interval` seconds into folded-stack counts."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            with _profile_lock:
+                PROFILE["stacks"][";".join(reversed(frames))] += 1
+
+
+def start_profile(endpoint, seconds, interval):
+    with _profile_lock:
+        PROFILE.update(endpoint=endpoint, until=time.time() + seconds, interval=interval,
+                       requests=0, stacks=Counter())
+
+
+def folded_stacks():
+    """Brendan Gregg's collapsed format: `frame;frame;frame count` (flamegraph.pl, speedscope)."""
+    with _profile_lock:
+        return "".join(f"{stack} {count}\n" for stack, count in PROFILE["stacks"].most_common())
+
+
+@app.before_request
+def start_trace():
+    g.trace_id = (request.headers.get("X-Request-ID") or uuid.uuid4().hex)[:64]
+    g.spans = []
+    if PROFILE["until"] > time.time() and request.endpoint == PROFILE["endpoint"]:
+        g.sampler = StackSampler(threading.get_ident(), PROFILE["interval"])
+        g.sampler.start()
+        with _profile_lock:
+            PROFILE["requests"] += 1
+
+
+@app.after_request
+def finish_trace(response):
+    trace_id = g.get("trace_id")
+    if trace_id is None:
+        return response
+    response.headers["X-Trace-Id"] = trace_id
+    sampler = g.pop("sampler", None)
+    if sampler is not None:
+        sampler.stopped.set()
+    if sampler is not None or TRACE_SERVER_TIMING:
+        totals = {}
+        for name, duration in g.spans:
+            count, total = totals.get(name, (0, 0.0))
+            totals[name] = (count + 1, total + duration)
+        started = g.get("request_started")
+        elapsed = time.perf_counter() - started if started else 0.0
+        response.headers["Server-Timing"] = ", ".join(
+            [f'{name};dur={total * 1000:.1f};desc="{count}x"' for name, (count, total) in totals.items()]
+            + [f"total;dur={elapsed * 1000:.1f}"]
+        )
+        RECENT_TRACES.append({
+            "trace_id": trace_id,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "ms": round(elapsed * 1000, 1),
+            "spans": {name: {"count": c, "ms": round(t * 1000, 1)} for name, (c, t) in totals.items()},
+            "at": datetime.utcnow().isoformat(),
+        })
+    return response
+
+
+@app.cli.command("bench-logging")
+@click.option("--records", default=20000, show_default=True)
+def bench_logging_command(records):
+    """Cost a log call adds to the request thread: queue handler vs. synchronous JSON to a file."""
+    bench_logger = logging.getLogger("bench-logging")
+    bench_logger.propagate = False
+    bench_logger.setLevel(logging.INFO)
+
+    def caller_us(handler):
+        bench_logger.handlers = [handler]
+        with app.test_request_context("/bench"):
+            g.trace_id = uuid.uuid4().hex
+            started = time.perf_counter()
+            for i in range(records):
+                bench_logger.info("🎙️ Transcribing file: %s, size=%d bytes", "/tmp/upload.wav", i,
+                                  extra={"content": "I have been feeling anxious lately"})
+            return (time.perf_counter() - started) / records * 1e6
+
+    with open(os.devnull, "w") as devnull:
+        sync = logging.StreamHandler(devnull)
+        sync.setFormatter(JsonLogFormatter())
+        sync.addFilter(LogContextFilter())
+        sync_us = caller_us(sync)
+
+    queued = DroppingQueueHandler(queue.Queue(records + 1))
+    queued.addFilter(LogContextFilter())
+    queue_us = caller_us(queued)
+
+    formatter = JsonLogFormatter()
+    started = time.perf_counter()
+    drained = 0
+    while not queued.queue.empty():
+        formatter.format(queued.queue.get_nowait())
+        drained += 1
+    listener_us = (time.perf_counter() - started) / max(drained, 1) * 1e6
+    bench_logger.handlers = []
+
+    click.echo(f"synchronous JSON (to /dev/null): {sync_us:.1f} µs/record in the request thread")
+    click.echo(f"queue handler:                   {queue_us:.1f} µs/record in the request thread")
+    click.echo(f"listener thread formatting:      {listener_us:.1f} µs/record (off the request path)")
+    click.echo(f"per request at ~4 lines (e.g. /transcribe): {4 * queue_us:.0f} µs vs {4 * sync_us:.0f} µs synchronous; "
+               f"a real stdout pipe can also block the synchronous path when the log reader lags")
+
+
+# ========================================================================
+# DATABASE
+# ========================================================================
+# DATABASE_URL picks the backend (default: SQLite in instance/therapy.db).
+# SQLite gets WAL + synchronous=NORMAL + a busy timeout + mmap on every
+# connection, so several gunicorn workers can commit per message without
+# "database is locked". Postgres gets a bounded, pre-pinged pool and a
+# server-side statement timeout. `flask bench-db` measures write throughput.
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_MMAP_BYTES = int(os.getenv("DB_MMAP_BYTES", str(256 * 1024 * 1024)))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+
+
+def database_url():
+    url = os.getenv("DATABASE_URL", "sqlite:///therapy.db")
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]  # Render/Heroku style URLs
+    return url
+
+
+def database_engine_options(url):
+    if url.startswith("sqlite"):
+        return {"connect_args": {"timeout": DB_BUSY_TIMEOUT_MS / 1000}}
+    if url.startswith("postgresql"):
+        return {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": 10,
+            "pool_pre_ping": True,
+            "pool_recycle": 1800,
+            "connect_args": {
+                "connect_timeout": 5,
+                "options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS} "
+                           f"-c idle_in_transaction_session_timeout={DB_STATEMENT_TIMEOUT_MS * 6}",
+            },
+        }
+    return {"pool_pre_ping": True}
 
 
+def apply_sqlite_pragmas(dbapi_conn, connection_record):
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={DB_MMAP_BYTES}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
 
-# Database
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///therapy.db"
+
+def tune_engine(engine):
+    if engine.dialect.name == "sqlite":
+        db_event.listen(engine, "connect", apply_sqlite_pragmas)
+    return engine
+
+
+app.config["SQLALCHEMY_DATABASE_URI"] = database_url()
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = database_engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+with app.app_context():
+    tune_engine(db.engine)  # no connection is opened here
+    trace_db_queries(db.engine)
+
+
+def _bench_db_writer(url, tuned, seconds, worker_id, results):
+    """One process running the chat pattern: read a session row, append a message, commit."""
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.exc import OperationalError
+    options = database_engine_options(url) if tuned else {}
+    engine = create_engine(url, **options)
+    if tuned:
+        tune_engine(engine)
+    commits = errors = 0
+    latencies = []
+    deadline = time.time() + seconds
+    with engine.connect() as conn:
+        while time.time() < deadline:
+            key = f"w{worker_id}-{random.randrange(20)}"
+            started = time.perf_counter()
+            try:
+                row = conn.execute(text("SELECT messages FROM bench_db_writes WHERE key = :k"), {"k": key}).first()
+                messages = json.loads(row[0]) if row else []
+                messages = (messages + [{"role": "user", "content": "x" * 200}])[-40:]
+                if row:
+                    conn.execute(text("UPDATE bench_db_writes SET messages = :m WHERE key = :k"),
+                                 {"m": json.dumps(messages), "k": key})
+                else:
+                    conn.execute(text("INSERT INTO bench_db_writes (key, messages) VALUES (:k, :m)"),
+                                 {"k": key, "m": json.dumps(messages)})
+                conn.commit()
+                commits += 1
+                latencies.append(time.perf_counter() - started)
+            except OperationalError:
+                conn.rollback()
+                errors += 1
+    engine.dispose()
+    results.put((commits, errors, latencies))
+
+
+@app.cli.command("bench-db")
+@click.option("--processes", default=4, show_default=True, help="Concurrent writer processes (like gunicorn workers)")
+@click.option("--seconds", default=5.0, show_default=True)
+@click.option("--url", default=None, help="Database to benchmark (default: a temporary SQLite file)")
+def bench_db_command(processes, seconds, url):
+    """Commit-per-message write throughput with several processes; SQLite runs default vs. tuned."""
+    import multiprocessing
+    from sqlalchemy import create_engine, text
+
+    workdir = None
+    if url is None:
+        workdir = tempfile.mkdtemp(prefix="bench-db-")
+    runs = [("tuned", True)]
+    if (url or "sqlite").startswith("sqlite"):
+        runs.insert(0, ("default", False))
+
+    ctx = multiprocessing.get_context("fork")
+    click.echo(f"{'profile':<10}{'commits/s':>11}{'locked':>8}{'p50 ms':>9}{'p99 ms':>9}")
+    for label, tuned in runs:
+        target = url or f"sqlite:///{os.path.join(workdir, label + '.db')}"
+        setup = create_engine(target)
+        with setup.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS bench_db_writes"))
+            conn.execute(text("CREATE TABLE bench_db_writes (key VARCHAR(40) PRIMARY KEY, messages TEXT)"))
+        setup.dispose()
+
+        results = ctx.Queue()
+        procs = [ctx.Process(target=_bench_db_writer, args=(target, tuned, seconds, i, results))
+                 for i in range(processes)]
+        for p in procs:
+            p.start()
+        collected = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+
+        commits = sum(c for c, _, _ in collected)
+        errors = sum(e for _, e, _ in collected)
+        latencies = sorted(l for _, _, ls in collected for l in ls) or [0.0]
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+        click.echo(f"{label:<10}{commits / seconds:>11.0f}{errors:>8}{p50:>9.2f}{p99:>9.2f}")
+
+        if url:
+            cleanup = create_engine(target)
+            with cleanup.begin() as conn:
+                conn.execute(text("DROP TABLE IF EXISTS bench_db_writes"))
+            cleanup.dispose()
+    if workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+SCRATCH_DB_ENV = "SCRATCH_DATABASE"
+
+
+def rerun_in_scratch_database(args, keep=False):
+    """Run `flask <args>` in a fresh interpreter against a throwaway SQLite file; returns its exit code.
+
+    DATABASE_URL is read at import, so commands that seed data (explain-queries,
+    bench-search) call this first and do the real work when SCRATCH_DB_ENV is set.
+    """
+    import subprocess
+    workdir = tempfile.mkdtemp(prefix=f"{args[0]}-")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'scratch.db')}",
+               WARMUP="0", JOBS_INLINE="0")
+    env[SCRATCH_DB_ENV] = "1"
+    try:
+        return subprocess.run([sys.executable, "-m", "flask", "--app", "app", *args],
+                              cwd=app.root_path, env=env).returncode
+    finally:
+        if keep:
+            click.echo(f"scratch database kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if os.environ.get("FLASK_RUN_FROM_CLI"):
+    # Only the `flask db ...` commands need Alembic; web workers skip the import
+    from flask_migrate import Migrate
+    migrate = Migrate(app, db)
 
 # Login manager
 login_manager = LoginManager()
@@ -280,6 +1415,9 @@ login_manager.login_view = "login"
 # Redirect logged-in users away from auth pages (prevents back-button shenanigans)
 @app.before_request
 def check_user_access():
+    if request.endpoint in ("static", "i18n_bundle", "healthz", "readyz", "metrics"):
+        return  # no session/DB work for assets (also keeps them free of Vary: Cookie)
+
     if current_user.is_authenticated:
         # ✅ Allow primary admin full bypass
         if current_user.email == "support@theralinkapp.com":
@@ -324,26 +1462,9 @@ def admin_required(f):
 
 
 # === Grant Free Access ===
-@app.route("/admin/grant_free/<int:user_id>", methods=["POST"])
-@login_required
-@admin_required
-def grant_free_access(user_id):
-    user = User.query.get_or_404(user_id)
-    user.is_subscribed = True
-    user.subscription_type = "free"
-    db.session.commit()
-
-    # Generate setup link
-    token = generate_setup_token(user.email)
-    link = url_for("set_password", token=token, _external=True)
-
-    # Send email
-    msg = Message(
-        "TheraLink Free Access - Set Your Password",
-        sender="support@theralinkapp.com",
-        recipients=[user.email]
-    )
-    msg.body = f"""
+def free_access_email(email, link):
+    subject = "TheraLink Free Access - Set Your Password"
+    body = f"""
     Hello,
 
     You have been granted free access to TheraLink.
@@ -358,11 +1479,11 @@ def grant_free_access(user_id):
     """
 
     # HTML version
-    msg.html = f"""
+    html = f"""
 <html>
   <body style="font-family: Arial, sans-serif; color: #333;">
     <h2 style="color: #0f2b23;">Welcome to <span style="color:#00ff9f;">TheraLink</span>!</h2>
-    <p>Hello {user.email},</p>
+    <p>Hello {email},</p>
     <p>You have been granted <strong>free access</strong> to TheraLink.</p>
     <p>Please click the button below to set your password:</p>
     <p style="text-align: center; margin: 30px 0;">
@@ -376,55 +1497,1249 @@ def grant_free_access(user_id):
   </body>
 </html>
 """
-    mail.send(msg)
+    return subject, body, html
+
+
+@app.route("/admin/grant_free/<int:user_id>", methods=["POST"])
+@login_required
+@admin_required
+def grant_free_access(user_id):
+    user = User.query.get_or_404(user_id)
+    user.is_subscribed = True
+    user.subscription_type = "free"
+    db.session.commit()
+
+    # Generate setup link
+    token = generate_setup_token(user.email)
+    link = url_for("set_password", token=token, _external=True)
+
+    # Queue email (sent by the background worker)
+    subject, body, html = free_access_email(user.email, link)
+    enqueue_email(user.email, subject, body, html=html)
+
+    flash(f"✅ Free access granted to {user.email}. Setup link sent via email.", "success")
+    return redirect(url_for("dashboard"))
+
+
+
+# === Add Group Access ===
+@app.route("/admin/group_subscribe", methods=["POST"])
+@login_required
+@admin_required
+def group_subscribe():
+    try:
+        group_name = request.form.get("group_name", "").strip()
+        emails, invalid = parse_group_emails(request.form.get("emails", ""), request.files.get("csv_file"))
+
+        if not emails or not group_name:
+            flash("Emails and group name are required.", "error")
+            return redirect(url_for("admin_page"))
+
+        link_template = url_for("set_password", token="__TOKEN__", _external=True)
+        skipped = f" ({invalid} invalid entries skipped)" if invalid else ""
+
+        if len(emails) > GROUP_INLINE_LIMIT:
+            run = GroupImport(group_name=group_name, total=len(emails))
+            db.session.add(run)
+            db.session.commit()
+            enqueue("provision_group", {
+                "import_id": run.id,
+                "emails": emails,
+                "link_template": link_template,
+            })
+            flash(f"⏳ Importing {len(emails)} users into '{group_name}'{skipped}. Progress is shown below.", "success")
+            return redirect(url_for("admin_page"))
+
+        created, updated = provision_group(emails, group_name, link_template)
+        flash(f"✅ Group '{group_name}' created with {len(emails)} users "
+              f"({created} new, {updated} existing){skipped}. Setup links sent.", "success")
+        return redirect(url_for("admin_page"))
+
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception("Error creating group subscription")
+        flash("⚠️ Something went wrong while adding group subscriptions.", "error")
+        return redirect(url_for("admin_page"))
+
+
+@app.route("/admin/group_imports/<int:import_id>")
+@login_required
+@admin_required
+def group_import_status(import_id):
+    run = GroupImport.query.get_or_404(import_id)
+    return jsonify({
+        "id": run.id,
+        "group_name": run.group_name,
+        "status": run.status,
+        "total": run.total,
+        "processed": run.processed,
+        "created": run.created,
+        "updated": run.updated,
+        "error": run.error,
+    })
+
+
+@app.route("/admin/profile", methods=["GET", "POST"])
+@login_required
+@admin_required
+def admin_profile():
+    """POST {endpoint, seconds, interval_ms} starts sampling; GET reports progress and hot frames."""
+    if request.method == "POST":
+        data = request.get_json(silent=True) or request.form
+        endpoint = data.get("endpoint")
+        if endpoint not in app.view_functions:
+            return jsonify({"error": f"Unknown endpoint: {endpoint}"}), 400
+        seconds = min(max(int(data.get("seconds", 30)), 1), PROFILE_MAX_SECONDS)
+        interval = max(float(data.get("interval_ms", 5)), 1) / 1000
+        start_profile(endpoint, seconds, interval)
+        app.logger.info(f"🔬 Profiling {endpoint} for {seconds}s (pid {os.getpid()})")
+
+    with _profile_lock:
+        self_time = Counter()
+        for stack, count in PROFILE["stacks"].items():
+            self_time[stack.rsplit(";", 1)[-1]] += count
+        return jsonify({
+            "pid": os.getpid(),
+            "endpoint": PROFILE["endpoint"],
+            "remaining_seconds": max(0, round(PROFILE["until"] - time.time(), 1)),
+            "interval_ms": PROFILE["interval"] * 1000,
+            "requests": PROFILE["requests"],
+            "samples": sum(PROFILE["stacks"].values()),
+            "top_frames": self_time.most_common(20),
+            "folded_url": url_for("admin_profile_folded"),
+        })
+
+
+@app.route("/admin/profile/folded")
+@login_required
+@admin_required
+def admin_profile_folded():
+    return app.response_class(folded_stacks(), mimetype="text/plain")
+
+
+@app.route("/admin/traces")
+@login_required
+@admin_required
+def admin_traces():
+    """Recent traced requests (while profiling or with TRACE_SERVER_TIMING=1), slowest first."""
+    return jsonify(sorted(RECENT_TRACES, key=lambda t: t["ms"], reverse=True))
+
+
+# =======================================
+
+#Stripe Set up
+
+#===================
+
+STRIPE_PRICE_ID = os.getenv("STRIPE_PRICE_ID", "price_1S3oun9Z2P6yYsthvQydpeEN")  # $10/month
+APP_BASE_URL = os.getenv("APP_BASE_URL", "https://theralinkapp.com")
+CHECKOUT_TTL = 3600            # seconds Stripe keeps our sessions open (minimum is 30 min)
+CHECKOUT_REUSE_MARGIN = 600    # don't hand out a session that expires within 10 min
+
+CHECKOUT_PURPOSES = {
+    "signup": {
+        "success_url": APP_BASE_URL + "/payment_success?session_id={CHECKOUT_SESSION_ID}",
+        "cancel_url": APP_BASE_URL + "/payment_failed",
+    },
+    "reactivate": {
+        "success_url": APP_BASE_URL + "/reactivation_success?session_id={CHECKOUT_SESSION_ID}",
+        "cancel_url": APP_BASE_URL + "/payment_failed",
+    },
+    "checkout": {
+        "success_url": APP_BASE_URL + "/success",
+        "cancel_url": APP_BASE_URL + "/cancel",
+    },
+}
+
+
+def get_checkout_session(email, purpose):
+    """Return a still-open Checkout session for (email, purpose), creating one only if needed."""
+    email = email.strip().lower()
+    now = datetime.utcnow()
+    cached = CheckoutSessionCache.query.filter_by(email=email, purpose=purpose).first()
+    if cached and cached.expires_at - now > timedelta(seconds=CHECKOUT_REUSE_MARGIN):
+        return cached
+
+    urls = CHECKOUT_PURPOSES[purpose]
+    expires_at = int(time.time()) + CHECKOUT_TTL
+    checkout_session = stripe.checkout.Session.create(
+        payment_method_types=["card"],
+        mode="subscription",
+        line_items=[{"price": STRIPE_PRICE_ID, "quantity": 1}],
+        customer_email=email,
+        success_url=urls["success_url"],
+        cancel_url=urls["cancel_url"],
+        expires_at=expires_at,
+    )
+
+    if not cached:
+        cached = CheckoutSessionCache(email=email, purpose=purpose)
+        db.session.add(cached)
+    cached.stripe_session_id = checkout_session.id
+    cached.url = checkout_session.url
+    cached.expires_at = datetime.utcfromtimestamp(expires_at)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker cached one concurrently; ours is still valid to use
+        db.session.rollback()
+        return CheckoutSessionCache(email=email, purpose=purpose, stripe_session_id=checkout_session.id,
+                                    url=checkout_session.url, expires_at=cached.expires_at)
+    return cached
+
+
+def forget_checkout_session(stripe_session_id):
+    if stripe_session_id:
+        CheckoutSessionCache.query.filter_by(stripe_session_id=stripe_session_id).delete()
+        db.session.commit()
+
+
+@app.route("/create-checkout-session", methods=["POST"])
+@login_required  # 👈 require login
+def create_checkout_session():
+    try:
+        checkout_session = get_checkout_session(current_user.email, "checkout")
+        return jsonify({"id": checkout_session.stripe_session_id})
+    except Exception as e:
+        app.logger.error(f"❌ Stripe error: {e}")
+        return jsonify(error=str(e)), 403
+
+
+
+@app.route("/success")
+def success():
+    return "✅ Payment successful!"
+
+@app.route("/cancel")
+def cancel():
+    return "❌ Payment canceled!"
+
+# ========================================================================
+# PASSWORD POLICY + RESET EMAIL
+# ========================================================================
+PASSWORD_REGEX = re.compile(r'^(?=.*[^A-Za-z0-9]).{6,}$')
+
+def password_valid(pw: str) -> bool:
+    return bool(PASSWORD_REGEX.match(pw or ""))
+
+serializer = URLSafeTimedSerializer(app.secret_key)
+
+def generate_reset_token(email: str) -> str:
+    return serializer.dumps(email, salt="password-reset")
+
+def verify_reset_token(token: str, max_age_seconds: int = LINK_TOKEN_MAX_AGE) -> str | None:
+    try:
+        email = serializer.loads(token, salt="password-reset", max_age=max_age_seconds)
+    except (BadSignature, SignatureExpired):
+        return None
+    return None if token_used(token) else email
+
+def send_reset_email(to_email: str, reset_link: str):
+    subject = "Theralink password reset"
+    body = (
+        "Hi,\n\nUse the link below to reset your Theralink password. "
+        "This link expires in 1 hour.\n\n"
+        f"{reset_link}\n\n"
+        "If you didn’t request this, you can ignore this email."
+    )
+
+    if not mail_configured():
+        app.logger.warning("SMTP not configured; reset link:\n%s", reset_link)
+        return
+
+    enqueue_email(to_email, subject, body)
+
+# ========================================================================
+# PASSWORD HASHING
+# ========================================================================
+# scrypt is memory-hard by design (tens of ms and 32 MB per hash with the
+# default parameters), so a burst of logins could take every core from /chat.
+# Every hash and verify first takes one of PASSWORD_HASH_CONCURRENCY slots shared
+# by every process on the machine (gunicorn's sync workers and the job worker).
+# A slot is an flock on a file in PASSWORD_HASH_SLOT_DIR, stamped with the
+# holder's pid; the kernel drops the lock when its holder exits, so a worker
+# killed mid-hash (OOM, graceful_timeout) cannot leak a slot. A request that
+# gets no slot within PASSWORD_HASH_QUEUE_TIMEOUT seconds is sent back to retry
+# (a 503 with Retry-After for JSON clients) instead of queueing without bound.
+# Hashes made with other parameters than PASSWORD_HASH_METHOD are upgraded at
+# the next successful login.
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")   # werkzeug method string
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "3"))
+UNUSABLE_PASSWORD = "!"       # never matches a password; set one via the setup/reset link
+PASSWORD_HASH_SLOT_DIR = os.getenv("PASSWORD_HASH_SLOT_DIR", os.path.join(tempfile.gettempdir(), "theralink-hash-slots"))
+PASSWORD_HASH_SLOT_POLL = 0.01   # seconds between sweeps over busy slots
+_password_slots = threading.BoundedSemaphore(PASSWORD_HASH_CONCURRENCY)   # without fcntl only
+
+
+class PasswordHashBusy(Exception):
+    """No hashing slot came free within PASSWORD_HASH_QUEUE_TIMEOUT."""
+
+
+def acquire_password_slot(timeout):
+    """Take a hashing slot; returns a callable that releases it, or None after `timeout` seconds."""
+    if fcntl is None:
+        return _password_slots.release if _password_slots.acquire(timeout=timeout) else None
+    os.makedirs(PASSWORD_HASH_SLOT_DIR, exist_ok=True)
+    deadline = time.monotonic() + timeout
+    first = random.randrange(PASSWORD_HASH_CONCURRENCY)
+    while True:
+        for i in range(PASSWORD_HASH_CONCURRENCY):
+            path = os.path.join(PASSWORD_HASH_SLOT_DIR, f"slot-{(first + i) % PASSWORD_HASH_CONCURRENCY}")
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, str(os.getpid()).encode(), 0)
+            return partial(os.close, fd)   # closing the file drops the lock
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(PASSWORD_HASH_SLOT_POLL * random.uniform(0.5, 1.5))
+
+
+def _in_password_slot(op, fn, *args):
+    waited = time.perf_counter()
+    release = acquire_password_slot(PASSWORD_HASH_QUEUE_TIMEOUT)
+    if release is None:
+        inc("password_hash_rejected_total", op=op)
+        raise PasswordHashBusy(op)
+    started = time.perf_counter()
+    observe("password_hash_wait_seconds", started - waited, op=op)
+    try:
+        return fn(*args)
+    finally:
+        release()
+        observe("password_hash_seconds", time.perf_counter() - started, op=op)
+
+
+def hash_password(password, method=None):
+    return _in_password_slot("hash", generate_password_hash, password, method or PASSWORD_HASH_METHOD)
+
+
+def verify_password(pwhash, password):
+    if not pwhash or pwhash == UNUSABLE_PASSWORD:
+        return False
+    return _in_password_slot("verify", check_password_hash, pwhash, password)
+
+
+@lru_cache(maxsize=None)
+def password_hash_prefix(method):
+    """The "method$" prefix werkzeug writes for `method` (e.g. "scrypt" -> "scrypt:32768:8:1$")."""
+    return generate_password_hash("", method).split("$", 1)[0] + "$"
+
+
+def upgrade_password_hash(user, password):
+    """Rehash a just-verified password when PASSWORD_HASH_METHOD changed; True when it did (caller commits)."""
+    if user.password_hash.startswith(password_hash_prefix(PASSWORD_HASH_METHOD)):
+        return False
+    user.password_hash = hash_password(password)
+    return True
+
+
+@app.errorhandler(PasswordHashBusy)
+def password_hash_busy(e):
+    message = "We're handling a lot of sign-ins right now. Please try again in a moment."
+    retry_after = str(max(1, round(PASSWORD_HASH_QUEUE_TIMEOUT)))
+    if request.is_json or request.accept_mimetypes.best_match(["text/html", "application/json"]) == "application/json":
+        return jsonify({"success": False, "message": message}), 503, {"Retry-After": retry_after}
+    flash(f"⚠️ {message}", "error")
+    return redirect(request.url)
+
+
+@app.cli.command("bench-password-hash")
+@click.option("--method", "methods", multiple=True, help="Hash parameters to compare (default: PASSWORD_HASH_METHOD)")
+@click.option("--threads", default=0, help="Concurrent logins (default: 2 x PASSWORD_HASH_CONCURRENCY)")
+@click.option("--seconds", default=5.0, show_default=True)
+def bench_password_hash_command(methods, threads, seconds):
+    """Logins/s (verifies through the hashing slots), per core, for each set of hash parameters."""
+    threads = threads or 2 * PASSWORD_HASH_CONCURRENCY
+    cores = min(PASSWORD_HASH_CONCURRENCY, os.cpu_count() or 1)
+    click.echo(f"{PASSWORD_HASH_CONCURRENCY} slots, {threads} threads, {cores} cores hashing")
+    for method in methods or [PASSWORD_HASH_METHOD]:
+        pwhash = generate_password_hash("bench-password!", method)
+        totals = {"ok": 0, "busy": 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def login_loop():
+            ok = busy = 0
+            while time.perf_counter() < deadline:
+                try:
+                    ok += verify_password(pwhash, "bench-password!")
+                except PasswordHashBusy:
+                    busy += 1
+            with lock:
+                totals["ok"] += ok
+                totals["busy"] += busy
+
+        started = time.perf_counter()
+        workers = [threading.Thread(target=login_loop) for _ in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        rate = totals["ok"] / (time.perf_counter() - started)
+        click.echo(f"{password_hash_prefix(method)[:-1]}: {rate:.1f} logins/s, {rate / cores:.1f}/s per core "
+                   f"({1000 * cores / max(rate, 1e-9):.0f} ms each), {totals['busy']} timed out")
+
+
+def _hold_password_slot(held):
+    if acquire_password_slot(5) is not None:
+        held.release()
+        time.sleep(3600)
+
+
+@app.cli.command("check-password-slots")
+def check_password_slots_command():
+    """Fill every hashing slot from other processes and check that logins get a 503, then
+    SIGKILL one holder and check its slot comes back (scratch database)."""
+    global PASSWORD_HASH_SLOT_DIR, PASSWORD_HASH_QUEUE_TIMEOUT
+    if not os.environ.get(SCRATCH_DB_ENV):
+        if rerun_in_scratch_database(["check-password-slots"]):
+            raise click.ClickException("password slot check failed")
+        return
+    import multiprocessing
+    import signal
+
+    db.create_all()
+    db.session.add(User(email="slots@example.test", password_hash=hash_password("slot-check!"), is_subscribed=True))
+    db.session.commit()
+
+    PASSWORD_HASH_SLOT_DIR = tempfile.mkdtemp(prefix="hash-slots-")   # not the live server's slots
+    PASSWORD_HASH_QUEUE_TIMEOUT = 0.3
+    ctx = multiprocessing.get_context("fork")
+    held = ctx.Semaphore(0)
+    holders = [ctx.Process(target=_hold_password_slot, args=(held,), daemon=True)
+               for _ in range(PASSWORD_HASH_CONCURRENCY)]
+    for holder in holders:
+        holder.start()
+    problems = []
+    try:
+        for _ in holders:
+            if not held.acquire(timeout=10):
+                raise click.ClickException("holders could not take every slot")
+        client = app.test_client()
+        form = {"email": "slots@example.test", "password": "slot-check!"}
+        r = client.post("/login", data=form, headers={"Accept": "application/json"})
+        if r.status_code != 503 or not r.headers.get("Retry-After"):
+            problems.append(f"JSON login with every slot taken: {r.status_code}, Retry-After={r.headers.get('Retry-After')}")
+        r = client.post("/login", data=form)
+        if r.status_code != 302 or not r.headers["Location"].endswith("/login"):
+            problems.append(f"form login with every slot taken: {r.status_code} -> {r.headers.get('Location')}")
+
+        os.kill(holders[0].pid, signal.SIGKILL)
+        holders[0].join()
+        r = client.post("/login", data=form)
+        if r.status_code != 302 or not r.headers["Location"].endswith("/dashboard"):
+            problems.append(f"login after a holder was killed: {r.status_code} -> {r.headers.get('Location')}")
+    finally:
+        for holder in holders:
+            holder.kill()
+            holder.join()
+        shutil.rmtree(PASSWORD_HASH_SLOT_DIR, ignore_errors=True)
+
+    for problem in problems:
+        click.echo(f"❌ {problem}")
+    if problems:
+        raise click.ClickException(f"{len(problems)} password slot problem(s)")
+    click.echo(f"✅ {PASSWORD_HASH_CONCURRENCY} slots held elsewhere -> 503; a killed holder's slot was reused")
+
+
+# ========================================================================
+# MODELS
+# ========================================================================
+class User(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password_hash = db.Column(db.String(256), nullable=False)
+    
+    # subscription fields
+    is_subscribed = db.Column(db.Boolean, default=False)
+    stripe_customer_id = db.Column(db.String(120), nullable=True, index=True)
+    subscription_type = db.Column(db.String(50), default="stripe")  
+    # "stripe", "free", "group"
+    group_id = db.Column(db.String(120), nullable=True)  # for batch/university groups
+
+    __table_args__ = (
+        # Admin search filters/sorts by these, with email as the keyset tie-breaker
+        db.Index("ix_user_group_id_email", "group_id", "email"),
+        db.Index("ix_user_subscription_type_email", "subscription_type", "email"),
+    )
+
+    def set_password(self, password: str):
+        self.password_hash = hash_password(password)
+
+    def check_password(self, password: str) -> bool:
+        return verify_password(self.password_hash, password)
+
+class UserSession(db.Model):
+    __tablename__ = "user_session"
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    session_id = db.Column(db.String(120), nullable=False)
+    name = db.Column(db.String(120), default="Session")
+    # Read and write through `messages`: NULL here once the session is archived
+    _messages = db.Column("messages", db.JSON, default=[])
+    kind = db.Column(db.String(20), nullable=False, server_default="chat")
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    archived_at = db.Column(db.DateTime, nullable=True)   # set while the transcript lives in session_archive
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'session_id', 'kind', name='uq_user_session'),
+        # Listings filter by kind; the unique constraint only narrows by user_id
+        db.Index("ix_user_session_user_kind", "user_id", "kind"),
+        # The archive job scans hot sessions by last activity
+        db.Index("ix_user_session_archived_at_updated_at", "archived_at", "updated_at"),
+        # Retention policies expire sessions of a kind by last activity
+        db.Index("ix_user_session_kind_updated_at", "kind", "updated_at"),
+    )
+
+    @property
+    def messages(self):
+        if self.archived_at is None:
+            return self._messages
+        if "_cold_messages" not in self.__dict__:
+            load_archived_messages([self])
+        return self._cold_messages
+
+    @messages.setter
+    def messages(self, value):
+        if self.archived_at is not None:
+            # Written to again: the session moves back to the hot table
+            if self.id is not None:
+                db.session.execute(db.delete(SessionArchive).where(SessionArchive.session_pk == self.id))
+            self.archived_at = None
+            self.__dict__.pop("_cold_messages", None)
+        self._messages = value
+
+class SessionArchive(db.Model):
+    """Compressed transcript of an archived UserSession (the cold tier)."""
+    __tablename__ = "session_archive"
+    session_pk = db.Column(db.Integer, db.ForeignKey("user_session.id", ondelete="CASCADE"), primary_key=True)
+    codec = db.Column(db.String(16), nullable=False)   # "zstd" or "gzip"
+    payload = db.Column(db.LargeBinary, nullable=False)
+    raw_bytes = db.Column(db.Integer, nullable=False)  # size of the JSON it replaced
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class Job(db.Model):
+    __tablename__ = "job"
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.JSON, default=dict)
+    # Only one pending (queued/running) job per key; cleared once the job finishes
+    dedupe_key = db.Column(db.String(255), unique=True, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    # "queued", "running", "done", "dead"
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    locked_by = db.Column(db.String(64), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_job_status_run_at", "status", "run_at"),
+    )
+
+class EmailOutbox(db.Model):
+    __tablename__ = "email_outbox"
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(255), nullable=False)
+    domain = db.Column(db.String(255), nullable=False)
+    sender = db.Column(db.String(255), nullable=True)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=True)
+    html = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default="pending")
+    # "pending", "sending", "sent", "failed"
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    locked_by = db.Column(db.String(64), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_email_outbox_status_id", "status", "id"),
+        db.Index("ix_email_outbox_recipient", "recipient"),
+    )
+
+class GroupImport(db.Model):
+    __tablename__ = "group_import"
+    id = db.Column(db.Integer, primary_key=True)
+    group_name = db.Column(db.String(120), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    # "queued", "running", "done"
+    total = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    created = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+class StripeEvent(db.Model):
+    __tablename__ = "stripe_event"
+    id = db.Column(db.String(255), primary_key=True)   # Stripe event id (evt_...)
+    type = db.Column(db.String(120), nullable=False)
+    customer_key = db.Column(db.String(255), nullable=False, index=True)
+    stripe_created = db.Column(db.Integer, nullable=False, default=0)
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="received")
+    # "received", "processed", "failed"
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+class CheckoutSessionCache(db.Model):
+    __tablename__ = "checkout_session_cache"
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), nullable=False)
+    purpose = db.Column(db.String(20), nullable=False)   # "signup", "reactivate", "checkout"
+    stripe_session_id = db.Column(db.String(255), nullable=False, index=True)
+    url = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('email', 'purpose', name='uq_checkout_email_purpose'),
+    )
+
+class UsedToken(db.Model):
+    __tablename__ = "used_token"
+    digest = db.Column(db.String(64), primary_key=True)    # sha256 of a consumed setup/reset token
+    purpose = db.Column(db.String(20), nullable=False)     # "setup", "reset"
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)   # after this the link is dead anyway
+
+class DailyStat(db.Model):
+    __tablename__ = "daily_stat"
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)            # UTC
+    metric = db.Column(db.String(64), nullable=False)
+    dimension = db.Column(db.String(64), nullable=False, default="")
+    value = db.Column(db.Float, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint('day', 'metric', 'dimension', name='uq_daily_stat'),
+    )
+
+@login_manager.user_loader
+def load_user(user_id):
+    return User.query.get(int(user_id))
+
+
+# ========================================================================
+# BACKGROUND JOBS
+# ========================================================================
+# Slow side effects (SMTP, Stripe, LLM titling, maintenance) are written to the
+# `job` table and executed by `flask --app app worker`. Set JOBS_INLINE=1 to run
+# them synchronously instead (handy in dev when no worker is running).
+JOBS_INLINE = os.getenv("JOBS_INLINE", "0").lower() in ("1", "true")
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", "300"))  # seconds
+JOB_BACKOFF_BASE = int(os.getenv("JOB_BACKOFF_BASE", "10"))                # seconds
+JOB_BACKOFF_MAX = int(os.getenv("JOB_BACKOFF_MAX", "3600"))                # seconds
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+JOB_CLAIM_BATCH = 10
+
+JOB_HANDLERS = {}
+PERIODIC_JOBS = {}   # kind -> interval in seconds
+
+
+def job_handler(kind, every=None):
+    """Register a handler for `kind`; `every` (seconds) also schedules it periodically."""
+    def decorator(f):
+        JOB_HANDLERS[kind] = f
+        if every:
+            PERIODIC_JOBS[kind] = every
+        return f
+    return decorator
+
+
+def enqueue(kind, payload=None, dedupe_key=None, delay=0, max_attempts=5):
+    """Queue a job and return it. If a pending job already holds `dedupe_key`, that job is returned."""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    if JOBS_INLINE:
+        JOB_HANDLERS[kind](payload or {})
+        return None
+
+    job = Job(
+        kind=kind,
+        payload=payload or {},
+        dedupe_key=dedupe_key,
+        max_attempts=max_attempts,
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+    )
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return Job.query.filter_by(dedupe_key=dedupe_key).first()
+    return job
+
+
+def enqueue_email(to_email, subject, body, html=None, sender="support@theralinkapp.com", commit=True):
+    """Add a message to the email outbox. Pass commit=False to batch many rows into one transaction."""
+    to_email = to_email.strip().lower()
+    db.session.add(EmailOutbox(
+        recipient=to_email,
+        domain=to_email.rsplit("@", 1)[-1],
+        sender=sender,
+        subject=subject,
+        body=body,
+        html=html,
+    ))
+    if commit:
+        db.session.commit()
+        kick_outbox()
+
+
+def _claimable(now):
+    return or_(
+        and_(Job.status == "queued", Job.run_at <= now),
+        and_(Job.status == "running", Job.locked_until < now),  # visibility timeout expired
+    )
+
+
+def claim_job(worker_id):
+    """Atomically take the next runnable job, or return None."""
+    now = datetime.utcnow()
+    candidates = db.session.query(Job.id).filter(_claimable(now))\
+        .order_by(Job.run_at, Job.id).limit(JOB_CLAIM_BATCH).all()
+    db.session.rollback()
+
+    for (job_id,) in candidates:
+        # Conditional update: only one worker can win the row
+        claimed = Job.query.filter(Job.id == job_id, _claimable(now)).update({
+            "status": "running",
+            "locked_by": worker_id,
+            "locked_until": now + timedelta(seconds=JOB_VISIBILITY_TIMEOUT),
+            "attempts": Job.attempts + 1,
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+    return None
+
+
+def run_job(job):
+    handler = JOB_HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for {job.kind}")
+        handler(job.payload or {})
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(Job, job.id)
+        job.last_error = f"{type(e).__name__}: {e}"[:2000]
+        job.locked_by = None
+        job.locked_until = None
+        if job.attempts >= job.max_attempts or handler is None:
+            job.status = "dead"
+            job.dedupe_key = None
+            job.finished_at = datetime.utcnow()
+            app.logger.error(f"❌ Job {job.id} ({job.kind}) failed permanently: {e}")
+        else:
+            backoff = min(JOB_BACKOFF_MAX, JOB_BACKOFF_BASE * 2 ** (job.attempts - 1))
+            job.status = "queued"
+            job.run_at = datetime.utcnow() + timedelta(seconds=backoff * random.uniform(0.8, 1.2))
+            app.logger.warning(f"⚠️ Job {job.id} ({job.kind}) failed, retry {job.attempts}/{job.max_attempts}: {e}")
+        db.session.commit()
+        return False
+
+    job.status = "done"
+    job.dedupe_key = None
+    job.locked_by = None
+    job.locked_until = None
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return True
+
+
+def schedule_periodic_jobs(last_run):
+    now = time.time()
+    for kind, every in PERIODIC_JOBS.items():
+        if now - last_run.get(kind, 0) >= every:
+            enqueue(kind, dedupe_key=f"periodic:{kind}")
+            last_run[kind] = now
+
+
+def run_worker(worker_id, poll_interval=1.0, burst=False, schedule=True):
+    app.logger.info(f"👷 Worker {worker_id} started")
+    stopping = []
+    try:
+        import signal
+        signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    except ValueError:
+        pass  # not in main thread
+
+    last_run = {}
+    with app.app_context():
+        while not stopping:
+            if schedule:
+                schedule_periodic_jobs(last_run)
+            job = claim_job(worker_id)
+            if job is None:
+                db.session.remove()
+                if burst:
+                    break
+                time.sleep(poll_interval)
+                continue
+            run_job(job)
+            db.session.remove()
+    app.logger.info(f"👋 Worker {worker_id} stopped")
+
+
+def _worker_process(index, poll_interval, burst):
+    # Forked children must not share the parent's pooled connections
+    with app.app_context():
+        db.engine.dispose()
+    run_worker(f"{os.getpid()}-{index}", poll_interval, burst, schedule=(index == 0))
+
+
+@app.cli.command("worker")
+@click.option("--processes", default=1, show_default=True, help="Number of worker processes.")
+@click.option("--poll-interval", default=1.0, show_default=True, help="Seconds to sleep when the queue is empty.")
+@click.option("--burst", is_flag=True, help="Exit once the queue is drained.")
+def worker_command(processes, poll_interval, burst):
+    """Run background job workers."""
+    if processes <= 1:
+        run_worker(f"{os.getpid()}-0", poll_interval, burst)
+        return
+
+    import multiprocessing
+    procs = [
+        multiprocessing.Process(target=_worker_process, args=(i, poll_interval, burst), daemon=False)
+        for i in range(processes)
+    ]
+    for p in procs:
+        p.start()
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+
+
+@app.cli.command("jobs")
+def jobs_command():
+    """Show job queue counts by kind and status."""
+    rows = db.session.query(Job.kind, Job.status, db.func.count(Job.id))\
+        .group_by(Job.kind, Job.status).order_by(Job.kind).all()
+    for kind, status, count in rows:
+        click.echo(f"{kind:<24} {status:<10} {count}")
+
+
+# ---- Job handlers ----
+@job_handler("title_session")
+def title_session_job(payload):
+    if payload.get("messages") is not None:
+        name = generate_call_title(payload["messages"])
+    else:
+        name = generate_chat_title(payload.get("message", ""), payload.get("language", "en"))
+
+    s = UserSession.query.filter_by(
+        user_id=payload["user_id"],
+        session_id=payload["session_id"],
+        kind=payload["kind"]
+    ).first()
+    if s and name:
+        s.name = name[:120]
+        db.session.commit()
+
+
+@job_handler("prune_jobs", every=6 * 3600)
+def prune_jobs_job(payload):
+    cutoff = datetime.utcnow() - timedelta(days=JOB_RETENTION_DAYS)
+    removed = Job.query.filter(
+        Job.status.in_(["done", "dead"]),
+        Job.finished_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    app.logger.info(f"🧹 Pruned {removed} finished jobs")
+
+
+# ========================================================================
+# SINGLE-USE LINK TOKENS
+# ========================================================================
+# Setup and reset links are signed and expire after LINK_TOKEN_MAX_AGE; the
+# `used_token` ledger makes each one single-use. Consuming a link inserts the
+# SHA-256 of its token as a primary key, so checking is one index probe and two
+# concurrent submits of the same link race on the insert: exactly one commits.
+# A row is only needed until its link would have expired anyway, so an hourly
+# job deletes older rows and the table holds about one max-age of password
+# changes, shared by every worker and node on the same database.
+
+
+def token_digest(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def token_used(token):
+    return db.session.execute(
+        db.select(UsedToken.digest).where(UsedToken.digest == token_digest(token))
+    ).first() is not None
+
+
+def consume_token(token, purpose, max_age=LINK_TOKEN_MAX_AGE):
+    """Record `token` as used in the current transaction (the caller commits).
+
+    Returns False, with the transaction rolled back, when it was used already.
+    The insert takes the SQLite write lock, so do slow work (hashing) first.
+    """
+    db.session.add(UsedToken(digest=token_digest(token), purpose=purpose,
+                             expires_at=datetime.utcnow() + timedelta(seconds=max_age)))
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    return True
+
+
+@job_handler("prune_used_tokens", every=3600)
+def prune_used_tokens_job(payload):
+    removed = UsedToken.query.filter(UsedToken.expires_at < datetime.utcnow()).delete()
+    db.session.commit()
+    if removed:
+        app.logger.info(f"🧹 Pruned {removed} expired link tokens")
+
+
+@app.cli.command("bench-tokens")
+@click.option("--tokens", default=5000, show_default=True, help="Links issued and consumed")
+@click.option("--keep", is_flag=True, help="Keep the scratch database and print its path")
+def bench_tokens_command(tokens, keep):
+    """Time link verification and consumption against the ledger (scratch database)."""
+    if not os.environ.get(SCRATCH_DB_ENV):
+        if rerun_in_scratch_database(["bench-tokens", "--tokens", str(tokens)], keep):
+            raise click.ClickException("token benchmark failed")
+        return
+
+    db.create_all()
+    links = [generate_reset_token(f"bench{i}@example.test") for i in range(tokens)]
+
+    def timed(label, fn):
+        started = time.perf_counter()
+        result = [fn(token) for token in links]
+        elapsed = time.perf_counter() - started
+        click.echo(f"{label}: {tokens / elapsed:,.0f}/s ({elapsed / tokens * 1e6:.0f} µs each)")
+        db.session.rollback()
+        return result
+
+    assert all(timed("verify (unused)", verify_reset_token))
+
+    def consume(token):
+        ok = consume_token(token, "reset")
+        db.session.commit()
+        return ok
+
+    assert all(timed("consume + commit", consume))
+    assert not any(timed("verify (used)", verify_reset_token))
+    assert not any(timed("consume again", consume))
+
+    db.session.execute(db.update(UsedToken).values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+    db.session.commit()
+    started = time.perf_counter()
+    prune_used_tokens_job({})
+    click.echo(f"sweep of {tokens} expired rows: {(time.perf_counter() - started) * 1000:.0f} ms, "
+               f"{UsedToken.query.count()} left")
+
+
+# ========================================================================
+# EMAIL OUTBOX
+# ========================================================================
+# All outgoing mail is written to `email_outbox` and delivered by the
+# `flush_outbox` job over one reused, authenticated SMTP connection.
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "200"))
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_DOMAIN_RATE = float(os.getenv("OUTBOX_DOMAIN_RATE", "5"))        # messages/sec per domain
+SMTP_TIMEOUT = int(os.getenv("SMTP_TIMEOUT", "20"))
+SMTP_MAX_PER_CONNECTION = int(os.getenv("SMTP_MAX_PER_CONNECTION", "100"))
+
+
+class SMTPConnection:
+    """One authenticated SMTP connection reused across messages, reopened when it drops."""
+
+    def __init__(self, config=None):
+        self.config = config or app.config
+        self.conn = None
+        self.sent = 0
+
+    def open(self):
+        cfg = self.config
+        if cfg.get("MAIL_USE_SSL"):
+            self.conn = smtplib.SMTP_SSL(cfg["MAIL_SERVER"], cfg["MAIL_PORT"], timeout=SMTP_TIMEOUT)
+        else:
+            self.conn = smtplib.SMTP(cfg["MAIL_SERVER"], cfg["MAIL_PORT"], timeout=SMTP_TIMEOUT)
+            if cfg.get("MAIL_USE_TLS"):
+                self.conn.starttls()
+        if cfg.get("MAIL_USERNAME") and cfg.get("MAIL_PASSWORD"):
+            self.conn.login(cfg["MAIL_USERNAME"], cfg["MAIL_PASSWORD"])
+        self.sent = 0
+
+    def send(self, msg):
+        if self.conn is None or self.sent >= SMTP_MAX_PER_CONNECTION:
+            self.close()
+            self.open()
+        with track_upstream("smtp", "send"):
+            try:
+                self.conn.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                self.open()
+                self.conn.send_message(msg)
+        self.sent += 1
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.quit()
+            except Exception:
+                pass
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def build_email(row, default_sender):
+    msg = EmailMessage()
+    msg["Subject"] = row.subject
+    msg["From"] = row.sender or default_sender
+    msg["To"] = row.recipient
+    msg.set_content(row.body or "")
+    if row.html:
+        msg.add_alternative(row.html, subtype="html")
+    return msg
+
 
-    flash(f"✅ Free access granted to {user.email}. Setup link sent via email.", "success")
-    return redirect(url_for("dashboard"))
+def kick_outbox(delay=0):
+    enqueue("flush_outbox", dedupe_key="flush_outbox", delay=delay)
 
 
+def claim_outbox(worker_id):
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=JOB_VISIBILITY_TIMEOUT)
+    claimable = or_(
+        EmailOutbox.status == "pending",
+        and_(EmailOutbox.status == "sending", EmailOutbox.locked_at < stale),
+    )
+    ids = [i for (i,) in db.session.query(EmailOutbox.id).filter(claimable)
+           .order_by(EmailOutbox.id).limit(OUTBOX_BATCH).all()]
+    if not ids:
+        return []
+    EmailOutbox.query.filter(EmailOutbox.id.in_(ids), claimable).update({
+        "status": "sending",
+        "locked_by": worker_id,
+        "locked_at": now,
+    }, synchronize_session=False)
+    db.session.commit()
+    return EmailOutbox.query.filter_by(status="sending", locked_by=worker_id)\
+        .order_by(EmailOutbox.id).all()
+
+
+def deliver_outbox(rows, smtp, rate=OUTBOX_DOMAIN_RATE):
+    """Send claimed rows round-robin across domains, at most `rate` messages/sec per domain."""
+    default_sender = formataddr(app.config["MAIL_DEFAULT_SENDER"])
+    by_domain = OrderedDict()
+    for row in rows:
+        by_domain.setdefault(row.domain, deque()).append(row)
+
+    interval = 1.0 / rate if rate > 0 else 0
+    next_slot = {}
+    sent = failed = 0
+    while by_domain:
+        now = time.monotonic()
+        ready = [d for d in by_domain if next_slot.get(d, 0) <= now]
+        if not ready:
+            time.sleep(max(0, min(next_slot[d] for d in by_domain) - now))
+            continue
+
+        for domain in ready:
+            row = by_domain[domain].popleft()
+            if not by_domain[domain]:
+                del by_domain[domain]
+            next_slot[domain] = now + interval
+
+            row.attempts += 1
+            try:
+                smtp.send(build_email(row, default_sender))
+                row.status = "sent"
+                row.sent_at = datetime.utcnow()
+                row.last_error = None
+                sent += 1
+            except smtplib.SMTPRecipientsRefused as e:
+                row.status = "failed"
+                row.last_error = str(e)[:2000]
+                failed += 1
+            except Exception as e:
+                row.status = "failed" if row.attempts >= OUTBOX_MAX_ATTEMPTS else "pending"
+                row.last_error = f"{type(e).__name__}: {e}"[:2000]
+                failed += 1
+                smtp.close()
+            row.locked_by = None
+            row.locked_at = None
+        db.session.commit()
+    return sent, failed
+
+
+@job_handler("flush_outbox")
+def flush_outbox_job(payload):
+    worker_id = f"outbox-{os.getpid()}-{random.getrandbits(32):x}"
+    total_sent = total_failed = 0
+    with SMTPConnection() as smtp:
+        while True:
+            rows = claim_outbox(worker_id)
+            if not rows:
+                break
+            sent, failed = deliver_outbox(rows, smtp)
+            total_sent += sent
+            total_failed += failed
+            if failed and not sent:
+                break  # server is refusing everything; let the retry kick handle it
+    app.logger.info(f"📨 Outbox flushed: {total_sent} sent, {total_failed} failed")
+
+    if EmailOutbox.query.filter_by(status="pending").first():
+        kick_outbox(delay=JOB_BACKOFF_BASE)
+
+
+@app.cli.command("outbox")
+@click.option("--recipient", default=None, help="Show delivery status for one address.")
+def outbox_command(recipient):
+    """Show email outbox delivery status."""
+    if recipient:
+        rows = EmailOutbox.query.filter_by(recipient=recipient.strip().lower())\
+            .order_by(EmailOutbox.id.desc()).limit(20).all()
+        for r in rows:
+            click.echo(f"{r.created_at:%Y-%m-%d %H:%M} {r.status:<8} {r.subject} {r.last_error or ''}")
+        return
+    rows = db.session.query(EmailOutbox.status, db.func.count(EmailOutbox.id))\
+        .group_by(EmailOutbox.status).all()
+    for status, count in rows:
+        click.echo(f"{status:<10} {count}")
 
-# === Add Group Access ===
-@app.route("/admin/group_subscribe", methods=["POST"])
-@login_required
-@admin_required
-def group_subscribe():
+
+@app.cli.command("bench-email")
+@click.option("--count", default=200, show_default=True)
+@click.option("--port", default=8025, show_default=True)
+def bench_email_command(count, port):
+    """Compare connection-per-message vs pooled SMTP against a local aiosmtpd server."""
     try:
-        emails = request.form.get("emails", "")
-        group_name = request.form.get("group_name", "").strip()
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        raise click.ClickException("aiosmtpd is required: pip install -r requirements-dev.txt")
+
+    class Sink:
+        received = 0
+
+        async def handle_DATA(self, server, session, envelope):
+            Sink.received += 1
+            return "250 OK"
+
+    controller = Controller(Sink(), hostname="127.0.0.1", port=port)
+    controller.start()
+    config = {"MAIL_SERVER": "127.0.0.1", "MAIL_PORT": port, "MAIL_USE_SSL": False, "MAIL_USE_TLS": False}
+    rows = [EmailOutbox(recipient=f"user{i}@bench.test", domain="bench.test",
+                        subject="Bench", body="Hello") for i in range(count)]
+    try:
+        start = time.perf_counter()
+        for row in rows:
+            with SMTPConnection(config) as smtp:
+                smtp.send(build_email(row, "bench@theralinkapp.com"))
+        per_message = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with SMTPConnection(config) as smtp:
+            for row in rows:
+                smtp.send(build_email(row, "bench@theralinkapp.com"))
+        pooled = time.perf_counter() - start
+    finally:
+        controller.stop()
+
+    click.echo(f"messages per run:       {count} ({Sink.received} received in total)")
+    click.echo(f"connection per message: {per_message:.3f}s ({count / per_message:.0f} msg/s)")
+    click.echo(f"pooled connection:      {pooled:.3f}s ({count / pooled:.0f} msg/s)")
+
+
+@app.cli.command("check-outbox")
+@click.option("--port", default=8026, show_default=True)
+def check_outbox_command(port):
+    """Flush a seeded outbox into a local aiosmtpd server and check every row's outcome (scratch database)."""
+    if not os.environ.get(SCRATCH_DB_ENV):
+        if rerun_in_scratch_database(["check-outbox", "--port", str(port)]):
+            raise click.ClickException("outbox check failed")
+        return
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        raise click.ClickException("aiosmtpd is required: pip install -r requirements-dev.txt")
+
+    class Sink:
+        sessions = set()
+        received = Counter()
+
+        async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+            if address.startswith("refused@"):
+                return "550 No such user"
+            envelope.rcpt_tos.append(address)
+            return "250 OK"
+
+        async def handle_DATA(self, server, session, envelope):
+            Sink.sessions.add(id(session))
+            for rcpt in envelope.rcpt_tos:
+                Sink.received[rcpt] += 1
+            return "250 OK"
+
+    db.create_all()
+    app.config.update(MAIL_SERVER="127.0.0.1", MAIL_PORT=port, MAIL_USE_SSL=False, MAIL_USE_TLS=False,
+                      MAIL_USERNAME=None, MAIL_PASSWORD=None)
+    delivered = [f"user{i}@{domain}" for i in range(3) for domain in ("a.test", "b.test", "c.test")]
+    for email in delivered + ["refused@b.test"]:
+        enqueue_email(email, "Outbox check", "Hello", commit=False)
+    db.session.commit()
 
-        if not emails or not group_name:
-            flash("Emails and group name are required.", "error")
-            return redirect(url_for("admin_page"))
+    controller = Controller(Sink(), hostname="127.0.0.1", port=port)
+    controller.start()
+    try:
+        flush_outbox_job({})
+    finally:
+        controller.stop()
+
+    status = dict(db.session.query(EmailOutbox.recipient, EmailOutbox.status).all())
+    problems = [f"{email}: {status[email]}" for email in delivered if status[email] != "sent"]
+    problems += [f"{email}: received {Sink.received[email]} times" for email in delivered if Sink.received[email] != 1]
+    if status["refused@b.test"] != "failed" or Sink.received["refused@b.test"]:
+        problems.append(f"refused@b.test: {status['refused@b.test']}, received {Sink.received['refused@b.test']} times")
+    if len(Sink.sessions) != 1:
+        problems.append(f"{len(Sink.sessions)} SMTP connections for one flush (expected 1)")
+    for problem in problems:
+        click.echo(f"❌ {problem}")
+    if problems:
+        raise click.ClickException(f"{len(problems)} outbox problem(s)")
+    click.echo(f"✅ {len(delivered)} sent and 1 refused over {len(Sink.sessions)} connection")
 
-        email_list = [e.strip().lower() for e in emails.split(",") if e.strip()]
-        for email in email_list:
-            user = User.query.filter_by(email=email).first()
-            if not user:
-                # ✅ Create new user in pending state with temp password
-                user = User(email=email)
-                user.set_password(os.urandom(8).hex())  # random placeholder
-                user.is_subscribed = False   # stays pending until setup
-                user.subscription_type = "group"
-                user.group_id = group_name
-                user.status = "Pending"
-                db.session.add(user)
-                db.session.commit()
-            else:
-                user.subscription_type = "group"
-                user.group_id = group_name
-                db.session.commit()
 
-            # ✅ Generate setup link for each user
-            token = generate_setup_token(user.email)
-            link = url_for("set_password", token=token, _external=True)
+# ========================================================================
+# GROUP PROVISIONING
+# ========================================================================
+GROUP_INLINE_LIMIT = 200      # larger imports run as a background job
+PROVISION_CHUNK = 500         # rows per IN query / batched insert
+EMAIL_RE = re.compile(r"^[^@\s,;]+@[^@\s,;]+\.[^@\s,;]+$")
 
-            # Send setup email
-            msg = Message(
-                "TheraLink Group Access - Set Your Password",
-                sender="support@theralinkapp.com",
-                recipients=[user.email]
-            )
-            msg.body = f"""
+
+def group_invite_email(email, group_name, link):
+    subject = "TheraLink Group Access - Set Your Password"
+    body = f"""
 Hello,
 
 You have been granted group access to TheraLink under '{group_name}'.
@@ -437,11 +2752,11 @@ This link will expire in 1 hour.
 Best regards,
 TheraLink Team
 """
-            msg.html = f"""
+    html = f"""
 <html>
   <body style="font-family: Arial, sans-serif; color: #333;">
     <h2 style="color:#0f2b23;">Welcome to <span style="color:#00ff9f;">TheraLink</span>!</h2>
-    <p>Hello {user.email},</p>
+    <p>Hello {email},</p>
     <p>You have been granted <strong>group access</strong> under <strong>{group_name}</strong>.</p>
     <p>Please click the button below to set your password:</p>
     <p style="text-align:center; margin:30px 0;">
@@ -455,141 +2770,312 @@ TheraLink Team
   </body>
 </html>
 """
-            mail.send(msg)
+    return subject, body, html
+
+
+def parse_group_emails(text="", csv_file=None):
+    """Collect unique, valid, lower-cased emails from a comma/newline list and an optional CSV upload."""
+    import csv
+    import io
+
+    raw = re.split(r"[,;\s]+", text or "")
+    if csv_file:
+        reader = csv.reader(io.TextIOWrapper(csv_file.stream, encoding="utf-8-sig", errors="replace"))
+        email_col = None
+        for i, row in enumerate(reader):
+            if i == 0:
+                header = [c.strip().lower() for c in row]
+                if "email" in header:
+                    email_col = header.index("email")
+                    continue
+            cells = [row[email_col]] if email_col is not None and email_col < len(row) else row
+            raw.extend(c for c in cells if "@" in c)
+
+    seen = set()
+    emails, invalid = [], 0
+    for e in raw:
+        e = e.strip().strip('"').lower()
+        if not e:
+            continue
+        if not EMAIL_RE.match(e):
+            invalid += 1
+            continue
+        if e not in seen:
+            seen.add(e)
+            emails.append(e)
+    return emails, invalid
+
+
+def provision_group(emails, group_name, link_template=None, progress=None):
+    """Attach `emails` to `group_name`, creating pending users as needed.
+
+    Each chunk costs one IN query, one bulk UPDATE, one bulk INSERT and one commit.
+    `link_template` is a set_password URL containing "__TOKEN__"; when given, setup
+    emails are written to the outbox in the same transaction. `progress(done, created,
+    updated)` is called after every chunk.
+    """
+    created = updated = 0
+    for i in range(0, len(emails), PROVISION_CHUNK):
+        chunk = emails[i:i + PROVISION_CHUNK]
+
+        existing = dict(db.session.query(User.email, User.id).filter(User.email.in_(chunk)).all())
+        if existing:
+            db.session.execute(
+                db.update(User).where(User.id.in_(list(existing.values())))
+                .values(subscription_type="group", group_id=group_name)
+            )
 
-        flash(f"✅ Group '{group_name}' created with {len(email_list)} users. Setup links sent.", "success")
-        return redirect(url_for("admin_page"))
+        new_rows = [
+            {
+                "email": email,
+                "password_hash": UNUSABLE_PASSWORD,
+                "is_subscribed": False,   # stays pending until setup
+                "subscription_type": "group",
+                "group_id": group_name,
+            }
+            for email in chunk if email not in existing
+        ]
+        if new_rows:
+            db.session.execute(db.insert(User), new_rows)
+            record_stat("signups", len(new_rows), "group")
+
+        if link_template:
+            outbox_rows = []
+            for email in chunk:
+                link = link_template.replace("__TOKEN__", generate_setup_token(email))
+                subject, body, html = group_invite_email(email, group_name, link)
+                outbox_rows.append({
+                    "recipient": email,
+                    "domain": email.rsplit("@", 1)[-1],
+                    "sender": "support@theralinkapp.com",
+                    "subject": subject,
+                    "body": body,
+                    "html": html,
+                    "status": "pending",
+                    "attempts": 0,
+                    "created_at": datetime.utcnow(),
+                })
+            db.session.execute(db.insert(EmailOutbox), outbox_rows)
+
+        created += len(new_rows)
+        updated += len(existing)
+        if progress:
+            progress(i + len(chunk), created, updated)
+        db.session.commit()
 
-    except Exception as e:
-        app.logger.exception("Error creating group subscription")
-        flash("⚠️ Something went wrong while adding group subscriptions.", "error")
-        return redirect(url_for("admin_page"))
+    if link_template and emails:
+        kick_outbox()
+    return created, updated
 
 
-# =======================================
+@job_handler("provision_group")
+def provision_group_job(payload):
+    run = db.session.get(GroupImport, payload["import_id"])
+    run.status = "running"
+    db.session.commit()
 
-#Stripe Set up
+    # Resume after the last committed chunk when the job is retried
+    offset, base_created, base_updated = run.processed, run.created, run.updated
 
-#===================
+    def progress(done, created, updated):
+        run.processed = offset + done
+        run.created = base_created + created
+        run.updated = base_updated + updated
 
-@app.route("/create-checkout-session", methods=["POST"])
-@login_required  # 👈 require login
-def create_checkout_session():
     try:
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=["card"],
-            mode="subscription",
-            line_items=[{
-                "price": "price_1S3oun9Z2P6yYsthvQydpeEN",  # 👈 use your $10 price ID
-                "quantity": 1,
-            }],
-            customer_email=current_user.email,  # 👈 link session to your logged-in user
-            success_url="https://theralinkapp.com/success",
-            cancel_url="https://theralinkapp.com/cancel",
-        )
-        return jsonify({"id": checkout_session.id})
+        provision_group(payload["emails"][offset:], run.group_name, payload.get("link_template"), progress)
     except Exception as e:
-        print("❌ Stripe error:", e)
-        return jsonify(error=str(e)), 403
+        db.session.rollback()
+        run = db.session.get(GroupImport, payload["import_id"])
+        run.error = f"{type(e).__name__}: {e}"[:2000]
+        db.session.commit()
+        raise
 
+    run.status = "done"
+    run.finished_at = datetime.utcnow()
+    db.session.commit()
 
 
-@app.route("/success")
-def success():
-    return "✅ Payment successful!"
+@app.cli.command("bench-provision")
+@click.option("--count", default=10000, show_default=True)
+@click.option("--legacy-sample", default=100, show_default=True,
+              help="Rows to run through the old per-row path (query + scrypt + commit each).")
+def bench_provision_command(count, legacy_sample):
+    """Benchmark bulk group provisioning. Uses @bench.invalid users and removes them afterwards."""
+    group = f"bench-{os.getpid()}"
+    emails = [f"user{i}-{os.getpid()}@bench.invalid" for i in range(count)]
+    try:
+        start = time.perf_counter()
+        provision_group(emails, group)
+        bulk = time.perf_counter() - start
+
+        sample = [f"legacy{i}-{os.getpid()}@bench.invalid" for i in range(legacy_sample)]
+        start = time.perf_counter()
+        for email in sample:
+            user = User.query.filter_by(email=email).first()
+            if not user:
+                user = User(email=email, subscription_type="group", group_id=group, is_subscribed=False)
+                user.set_password(os.urandom(8).hex())
+                db.session.add(user)
+            db.session.commit()
+        legacy = (time.perf_counter() - start) / max(legacy_sample, 1)
+    finally:
+        db.session.rollback()
+        User.query.filter(User.email.like("%@bench.invalid")).delete(synchronize_session=False)
+        db.session.commit()
+
+    click.echo(f"bulk:   {count} emails in {bulk:.2f}s ({count / bulk:.0f} rows/s)")
+    click.echo(f"legacy: {legacy * 1000:.1f} ms/row -> ~{legacy * count:.0f}s for {count} emails")
 
-@app.route("/cancel")
-def cancel():
-    return "❌ Payment canceled!"
 
 # ========================================================================
-# PASSWORD POLICY + RESET EMAIL
+# ANALYTICS
 # ========================================================================
-PASSWORD_REGEX = re.compile(r'^(?=.*[^A-Za-z0-9]).{6,}$')
+# Usage and subscription counts live in `daily_stat`, one row per (UTC day,
+# metric, dimension). Request paths and the webhook add to today's row with an
+# upsert inside their own transaction, so a count commits or rolls back with the
+# change it describes. Paths with no transaction of their own (anonymous trial
+# traffic, call replies, transcription) count in memory with defer_stat; each
+# worker writes those totals at most every ANALYTICS_FLUSH_SECONDS. Snapshots
+# (active subscribers) are overwritten by an hourly job. Dashboards read
+# O(days) rows and never touch users or messages.
+ANALYTICS_METRICS = {
+    "signups": "Accounts created (by source)",
+    "trial_starts": "Trial chats/calls started",
+    "trial_conversions": "Checkouts completed by a browser that used the trial",
+    "subscriptions_started": "Checkouts completed",
+    "subscriptions_renewed": "Invoices paid",
+    "subscriptions_frozen": "Invoice payments failed",
+    "subscriptions_canceled": "Subscriptions deleted in Stripe",
+    "sessions_created": "Chat/call sessions saved for the first time",
+    "messages": "Messages added to saved sessions",
+    "llm_replies": "Therapist replies generated",
+    "call_audio_seconds": "Seconds of speech transcribed",
+    "sessions_archived": "Idle sessions moved to the compressed archive",
+    "archive_bytes_reclaimed": "Bytes taken out of user_session by archiving (net of the compressed copy)",
+    "sessions_purged": "Sessions deleted by purges and retention policies (by reason)",
+    "users_purged": "Users deleted with their sessions (by reason)",
+    "active_subscribers": "Subscribed users at the last snapshot (by type)",
+}
+ANALYTICS_SNAPSHOTS = {"active_subscribers"}   # latest value, not summed over days
+ANALYTICS_DAYS_MAX = 366
+ANALYTICS_FLUSH_SECONDS = float(os.getenv("ANALYTICS_FLUSH_SECONDS", "30"))
+_deferred_stats = Counter()
+_deferred_stats_lock = threading.Lock()
+_deferred_stats_flushed_at = time.monotonic()
+
+
+def stat_upsert(metric, amount, dimension="", replace=False, day=None):
+    if db.engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(DailyStat).values(
+        day=day or datetime.utcnow().date(), metric=metric, dimension=dimension or "", value=amount,
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["day", "metric", "dimension"],
+        set_={"value": stmt.excluded.value if replace else DailyStat.value + stmt.excluded.value},
+    )
 
-def password_valid(pw: str) -> bool:
-    return bool(PASSWORD_REGEX.match(pw or ""))
 
-serializer = URLSafeTimedSerializer(app.secret_key)
+def record_stat(metric, amount=1, dimension="", replace=False):
+    """Add `amount` to today's (metric, dimension) row in the current transaction.
 
-def generate_reset_token(email: str) -> str:
-    return serializer.dumps(email, salt="password-reset")
+    The caller commits. With replace=True the row is set instead (snapshots).
+    """
+    db.session.execute(stat_upsert(metric, amount, dimension, replace))
 
-def verify_reset_token(token: str, max_age_seconds: int = 3600) -> str | None:
-    try:
-        return serializer.loads(token, salt="password-reset", max_age=max_age_seconds)
-    except (BadSignature, SignatureExpired):
-        return None
 
-def send_reset_email(to_email: str, reset_link: str):
-    host = os.getenv("MAIL_SERVER")
-    port = int(os.getenv("MAIL_PORT", "587"))
-    username = os.getenv("MAIL_USERNAME")
-    password = os.getenv("MAIL_PASSWORD")
-    use_tls = os.getenv("MAIL_USE_TLS", "true").lower() == "true"
-    sender = os.getenv("MAIL_SENDER", "no-reply@theralink.local")
+def defer_stat(metric, amount=1, dimension=""):
+    """Count in this process; flush_deferred_stats writes the total later (no transaction needed)."""
+    with _deferred_stats_lock:
+        _deferred_stats[(datetime.utcnow().date(), metric, dimension or "")] += amount
 
-    subject = "Theralink password reset"
-    body = (
-        "Hi,\n\nUse the link below to reset your Theralink password. "
-        "This link expires in 1 hour.\n\n"
-        f"{reset_link}\n\n"
-        "If you didn’t request this, you can ignore this email."
-    )
 
-    if not host or not username or not password:
-        app.logger.warning("SMTP not configured; reset link:\n%s", reset_link)
+def flush_deferred_stats(force=False):
+    """Write deferred counts in one transaction on its own connection, at most every ANALYTICS_FLUSH_SECONDS."""
+    global _deferred_stats_flushed_at
+    if not _deferred_stats or (not force and time.monotonic() - _deferred_stats_flushed_at < ANALYTICS_FLUSH_SECONDS):
         return
+    with _deferred_stats_lock:
+        _deferred_stats_flushed_at = time.monotonic()
+        pending = dict(_deferred_stats)
+        _deferred_stats.clear()
+    try:
+        with db.engine.begin() as conn:
+            for (day, metric, dimension), amount in pending.items():
+                conn.execute(stat_upsert(metric, amount, dimension, day=day))
+    except Exception:
+        app.logger.exception("📉 Could not write deferred analytics; keeping them for the next flush")
+        with _deferred_stats_lock:
+            _deferred_stats.update(pending)
 
-    msg = EmailMessage()
-    msg["Subject"] = subject
-    msg["From"] = sender
-    msg["To"] = to_email
-    msg.set_content(body)
 
-    with smtplib.SMTP(host, port) as s:
-        if use_tls:
-            s.starttls()
-        s.login(username, password)
-        s.send_message(msg)
+@app.teardown_request
+def flush_deferred_stats_after_request(exc):
+    flush_deferred_stats()
 
-# ========================================================================
-# MODELS
-# ========================================================================
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(256), nullable=False)
-    
-    # subscription fields
-    is_subscribed = db.Column(db.Boolean, default=False)
-    stripe_customer_id = db.Column(db.String(120), nullable=True)
-    subscription_type = db.Column(db.String(50), default="stripe")  
-    # "stripe", "free", "group"
-    group_id = db.Column(db.String(120), nullable=True)  # for batch/university groups
 
-    def set_password(self, password: str):
-        self.password_hash = generate_password_hash(password)
+def flush_deferred_stats_at_exit():
+    with app.app_context():
+        flush_deferred_stats(force=True)
 
-    def check_password(self, password: str) -> bool:
-        return check_password_hash(self.password_hash, password)
 
-class UserSession(db.Model):
-    __tablename__ = "user_session"
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
-    session_id = db.Column(db.String(120), nullable=False)
-    name = db.Column(db.String(120), default="Session")
-    messages = db.Column(db.JSON, default=[])
-    kind = db.Column(db.String(20), nullable=False, server_default="chat")
+atexit.register(flush_deferred_stats_at_exit)
 
-    __table_args__ = (
-        UniqueConstraint('user_id', 'session_id', 'kind', name='uq_user_session'),
-    )
 
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
+def wav_seconds(path):
+    import wave
+    try:
+        with wave.open(path, "rb") as w:
+            return w.getnframes() / float(w.getframerate() or 1)
+    except (wave.Error, EOFError, OSError):
+        return 0.0
+
+
+@job_handler("analytics_snapshot", every=3600)
+def analytics_snapshot_job(payload):
+    counts = dict(db.session.query(User.subscription_type, db.func.count(User.id))
+                  .filter(User.is_subscribed.is_(True)).group_by(User.subscription_type).all())
+    for subscription_type in set(counts) | {"stripe", "free", "group"}:
+        record_stat("active_subscribers", counts.get(subscription_type, 0), subscription_type or "", replace=True)
+    db.session.commit()
+
+
+def analytics_summary(days):
+    """Per-day series for the last `days` UTC days: {"days", "metrics", "totals"}."""
+    flush_deferred_stats(force=True)   # this worker's counts; others lag by up to ANALYTICS_FLUSH_SECONDS
+    days = min(max(int(days), 1), ANALYTICS_DAYS_MAX)
+    today = datetime.utcnow().date()
+    day_list = [today - timedelta(days=n) for n in range(days - 1, -1, -1)]
+    index = {d: i for i, d in enumerate(day_list)}
+
+    rows = DailyStat.query.filter(DailyStat.day >= day_list[0]).all()
+    metrics = {}
+    latest = {}   # snapshot metric -> index of its newest day in the window
+    for row in rows:
+        series = metrics.setdefault(row.metric, {}).setdefault(row.dimension, [0] * days)
+        series[index[row.day]] = row.value
+        if row.metric in ANALYTICS_SNAPSHOTS:
+            latest[row.metric] = max(latest.get(row.metric, 0), index[row.day])
+
+    totals = {}
+    for metric, by_dimension in metrics.items():
+        if metric in ANALYTICS_SNAPSHOTS:
+            totals[metric] = sum(s[latest[metric]] for s in by_dimension.values())
+        else:
+            totals[metric] = sum(sum(s) for s in by_dimension.values())
+    return {"days": [d.isoformat() for d in day_list], "metrics": metrics, "totals": totals}
+
+
+def analytics_table(summary):
+    """Rows of (day, {metric: value summed over dimensions}), newest first, for admin.html."""
+    rows = []
+    for i, day in enumerate(summary["days"]):
+        rows.append((day, {metric: sum(s[i] for s in by_dimension.values())
+                           for metric, by_dimension in summary["metrics"].items()}))
+    return rows[::-1]
 
 
 # ========================================================================
@@ -604,7 +3090,7 @@ TRIAL_CALL_MAX_SESSIONS = 5
 # ========================================================================
 @app.route("/")
 def index():
-    return render_template("index.html", publishable_key=PUBLISHABLE_KEY)
+    return render_cached("index.html", publishable_key=PUBLISHABLE_KEY)
 
 # ========================================================================
 # GOOGLE OAUTH
@@ -612,9 +3098,11 @@ def index():
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 
-if GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET:
+
+def _register_google():
+    from authlib.integrations.flask_client import OAuth
     oauth = OAuth(app)
-    google = oauth.register(
+    return oauth.register(
         name="google",
         server_metadata_url="https://accounts.google.com/.well-known/openid-configuration",
         client_id=GOOGLE_CLIENT_ID,
@@ -623,6 +3111,10 @@ if GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET:
         token_endpoint_auth_method="client_secret_post",
     )
 
+
+if GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET:
+    google = LazyProxy(_register_google)
+
     @app.route("/auth/google")
     def auth_google():
         redirect_uri = url_for("auth_google_callback", _external=True)
@@ -644,10 +3136,10 @@ if GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET:
 
         user = User.query.filter_by(email=email.lower()).first()
         if not user:
-            random_pw = os.urandom(16).hex()
-            user = User(email=email.lower())
-            user.set_password(random_pw)
+            # No password until they set one through "forgot password"
+            user = User(email=email.lower(), password_hash=UNUSABLE_PASSWORD)
             db.session.add(user)
+            record_stat("signups", 1, "google")
             db.session.commit()
 
         login_user(user)
@@ -675,18 +3167,13 @@ def signup():
             flash("Email already registered.", "error")
             return redirect(url_for("login"))
 
-        # 👉 Instead of creating user now, create checkout session
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=["card"],
-             mode="subscription",
-            line_items=[{
-                 "price": "price_1S3oun9Z2P6yYsthvQydpeEN",  # your $10 price ID
-                 "quantity": 1,
-            }],
-            customer_email=email,
-            success_url="https://theralinkapp.com/payment_success?session_id={CHECKOUT_SESSION_ID}",
-            cancel_url="https://theralinkapp.com/payment_failed",
-        )
+        # 👉 Instead of creating user now, send them to checkout
+        try:
+            checkout_session = get_checkout_session(email, "signup")
+        except Exception as e:
+            app.logger.error(f"❌ Stripe signup error: {e}")
+            flash("⚠️ Payment service is busy. Please try again in a moment.", "error")
+            return redirect(url_for("signup"))
         return redirect(checkout_session.url, code=303)
 
 
@@ -700,6 +3187,8 @@ def login():
 
         user = User.query.filter_by(email=email).first()
         if user and user.check_password(password):
+            if upgrade_password_hash(user, password):
+                db.session.commit()
             # Admin can always log in
             if user.email == "support@theralinkapp.com":
                 login_user(user)
@@ -710,18 +3199,11 @@ def login():
             if not user.is_subscribed:
                 flash("⚠️ Your subscription is inactive. Please renew to continue.", "error")
 
-                # Create new Stripe checkout session
-                checkout_session = stripe.checkout.Session.create(
-                    payment_method_types=["card"],
-                    mode="subscription",
-                    line_items=[{
-                        "price": "price_1S3oun9Z2P6yYsthvQydpeEN",  # your $10 price ID
-                        "quantity": 1,
-                    }],
-                    customer_email=user.email,
-                    success_url=url_for("reactivation_success", _external=True) + f"?email={user.email}",
-                    cancel_url=url_for("index", _external=True),
-                )
+                try:
+                    checkout_session = get_checkout_session(user.email, "reactivate")
+                except Exception as e:
+                    app.logger.error(f"❌ Stripe reactivation error: {e}")
+                    return redirect(url_for("login"))
 
                 # Redirect them directly to Stripe
                 return redirect(checkout_session.url, code=303)
@@ -751,17 +3233,7 @@ def login():
 @login_required
 def reactivate():
     try:
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=["card"],
-            mode="subscription",
-            line_items=[{
-                "price": "price_1S3oun9Z2P6yYsthvQydpeEN",  # your live price ID
-                "quantity": 1,
-            }],
-            customer_email=current_user.email,
-            success_url="https://theralinkapp.com/reactivation_success?session_id={CHECKOUT_SESSION_ID}",
-            cancel_url="https://theralinkapp.com/payment_failed",
-        )
+        checkout_session = get_checkout_session(current_user.email, "reactivate")
         return redirect(checkout_session.url, code=303)
     except Exception as e:
         app.logger.error(f"❌ Reactivation error: {e}")
@@ -779,6 +3251,7 @@ def reactivation_success():
 
     # ✅ Retrieve the checkout session from Stripe
     checkout_session = stripe.checkout.Session.retrieve(session_id)
+    forget_checkout_session(session_id)
     email = checkout_session.customer_email
     customer_id = checkout_session.customer
 
@@ -858,7 +3331,11 @@ def reset_password(token):
             flash("Account not found.", "error")
             return redirect(url_for("signup"))
 
-        user.set_password(new_pw)
+        password_hash = hash_password(new_pw)
+        if not consume_token(token, "reset"):
+            flash("This reset link has already been used.", "error")
+            return redirect(url_for("reset_password_request"))
+        user.password_hash = password_hash
         db.session.commit()
 
         flash("Your password has been reset successfully. Please log in.", "success")
@@ -882,7 +3359,7 @@ def dashboard():
 # ========================================================================
 @app.route("/trial_chat")
 def trial_chat():
-    lang = request.args.get('lang', 'en')
+    lang = current_lang()
     if "trial_chat_count" not in session:
         session["trial_chat_count"] = 0
 
@@ -890,7 +3367,7 @@ def trial_chat():
         flash("Your free trial has ended. Please sign up to continue.", "error")
         return redirect(url_for("signup"))
 
-    return render_template("trial_chat.html", lang=lang)
+    return render_cached("trial_chat.html", lang=lang)
 
 @app.route("/trial_chat_message", methods=["POST"])
 def trial_chat_message():
@@ -902,25 +3379,8 @@ def trial_chat_message():
     data = request.get_json()
     user_message = data.get("message", "")
 
-    # ==== Persist trial_chat session if logged in ====
-    if current_user.is_authenticated:
-        trial_session = UserSession.query.filter_by(
-            user_id=current_user.id,
-            session_id="trial_chat",
-            kind="trial_chat"
-        ).first()
-        if not trial_session:
-            trial_session = UserSession(
-                user_id=current_user.id,
-                session_id="trial_chat",
-                name="Trial Chat Session",
-                messages=[],
-                kind="trial_chat"
-            )
-            db.session.add(trial_session)
-
-        trial_session.messages.append({"role": "user", "content": user_message})
-        db.session.commit()
+    if session["trial_chat_count"] == 1:
+        session["trial_used"] = True   # counted as a conversion if this browser checks out
 
     # ==== Always English-only therapist logic ====
     conversation = [
@@ -943,9 +3403,38 @@ def trial_chat_message():
             max_tokens=400
         )
         reply = response.choices[0].message.content.strip()
+        replied = True
     except Exception:
         app.logger.exception("Trial chat API error")
         reply = "Sorry, something went wrong."
+        replied = False
+
+    # Signed-in counts ride on the session save; anonymous ones are deferred
+    stat = record_stat if current_user.is_authenticated else defer_stat
+    if session["trial_chat_count"] == 1:
+        stat("trial_starts", 1, "chat")
+    if replied:
+        stat("llm_replies", 1, "trial_chat")
+
+    # ==== Persist trial_chat session if logged in ====
+    if current_user.is_authenticated:
+        trial_session = UserSession.query.filter_by(
+            user_id=current_user.id,
+            session_id="trial_chat",
+            kind="trial_chat"
+        ).first()
+        if not trial_session:
+            trial_session = UserSession(
+                user_id=current_user.id,
+                session_id="trial_chat",
+                name="Trial Chat Session",
+                messages=[],
+                kind="trial_chat"
+            )
+            db.session.add(trial_session)
+
+        trial_session.messages = (trial_session.messages or []) + [{"role": "user", "content": user_message}]
+        db.session.commit()
 
     return jsonify({"reply": reply})
 
@@ -956,10 +3445,10 @@ def trial_chat_message():
 # ========================================================================
 @app.route("/trial_call")
 def trial_call():
-    lang = request.args.get("lang", "en")
+    lang = current_lang()
     session.setdefault("trial_call_sessions_left", TRIAL_CALL_MAX_SESSIONS)
     session.setdefault("trial_call_active_started_at", None)
-    return render_template("trial_call.html", lang=lang)
+    return render_cached("trial_call.html", lang=lang)
 
 @app.route("/trial_call/status")
 def trial_call_status():
@@ -995,6 +3484,7 @@ def trial_call_start():
 
     session["trial_call_sessions_left"] = sessions_left - 1
     session["trial_call_active_started_at"] = int(datetime.now().timestamp())
+    session["trial_used"] = True
 
     # ==== NEWLY ADDED/UPDATED: Persist trial_call session ====
     if current_user.is_authenticated:
@@ -1012,7 +3502,10 @@ def trial_call_start():
                 kind="trial_call"
             )
             db.session.add(trial_call)
+        record_stat("trial_starts", 1, "call")
         db.session.commit()
+    else:
+        defer_stat("trial_starts", 1, "call")
 
     return jsonify({"ok": True, "sessions_left": session["trial_call_sessions_left"], "remaining": TRIAL_CALL_LIMIT_SECONDS})
 
@@ -1024,7 +3517,7 @@ def trial_call_start():
 def chat_page():
     if not current_user.is_authenticated:
         return redirect(url_for("login"))
-    lang = request.args.get('lang', 'en')
+    lang = current_lang()
     return render_template("chat.html", lang=lang)
 
 @app.route("/chat", methods=["POST"])
@@ -1035,26 +3528,6 @@ def chat():
     message = data.get("message", "")
     user_lang = data.get("language", "en")
 
-    # ==== Persist session if logged in ====
-    if current_user.is_authenticated:
-        chat_session = UserSession.query.filter_by(
-            user_id=current_user.id,
-            session_id=session_id,
-            kind="chat"
-        ).first()
-        if not chat_session:
-            chat_session = UserSession(
-                user_id=current_user.id,
-                session_id=session_id,
-                name="Chat Session",
-                messages=[],
-                kind="chat"
-            )
-            db.session.add(chat_session)
-
-        chat_session.messages.append({"role": "user", "content": message})
-        db.session.commit()
-
     # ==== Adaptive Therapist Prompt ====
     conversation = [
         {
@@ -1105,9 +3578,35 @@ Which of these feels most relevant to you right now?
             max_tokens=400
         )
         reply = response.choices[0].message.content.strip()
+        replied = True
     except Exception:
         app.logger.exception("Chat API error")
         reply = "Sorry, something went wrong."
+        replied = False
+
+    # ==== Persist session if logged in ====
+    if current_user.is_authenticated:
+        chat_session = UserSession.query.filter_by(
+            user_id=current_user.id,
+            session_id=session_id,
+            kind="chat"
+        ).first()
+        if not chat_session:
+            chat_session = UserSession(
+                user_id=current_user.id,
+                session_id=session_id,
+                name="Chat Session",
+                messages=[],
+                kind="chat"
+            )
+            db.session.add(chat_session)
+
+        chat_session.messages = (chat_session.messages or []) + [{"role": "user", "content": message}]
+        if replied:
+            record_stat("llm_replies", 1, "chat")
+        db.session.commit()
+    elif replied:
+        defer_stat("llm_replies", 1, "chat")
 
     return jsonify({"reply": reply})
 
@@ -1119,7 +3618,7 @@ Which of these feels most relevant to you right now?
 def call_page():
     if not current_user.is_authenticated:
         return redirect(url_for("login"))
-    lang = request.args.get("lang", "en")
+    lang = current_lang()
     return render_template("call.html", lang=lang)
 
 
@@ -1186,45 +3685,100 @@ def call():
             max_tokens=400
         )
 
-        therapist_reply = response.choices[0].message.content.strip()
-        user_sessions[user_id][session_id].append({"role": "assistant", "content": therapist_reply})
+        therapist_reply = response.choices[0].message.content.strip()
+        user_sessions[user_id][session_id].append({"role": "assistant", "content": therapist_reply})
+        defer_stat("llm_replies", 1, "call")
+
+        return jsonify({"reply": therapist_reply, "session_id": session_id})
+
+    except Exception:
+        app.logger.exception("Call API error")
+        return jsonify({"error": "Sorry, something went wrong with the call."}), 500
+
+# ========================================================================
+# AUTO-NAMING
+# ========================================================================
+def generate_chat_title(message, lang="en"):
+    prompt = [
+        {
+            "role": "system",
+            "content": (
+                f"You are a helpful assistant. Generate a short, natural 2–4 word session title in {lang}. "
+                f"If {lang} is not supported, return it in English. "
+                f"Do NOT include quotes, punctuation, or explanations — just the title."
+            )
+        },
+        {"role": "user", "content": message}
+    ]
+    response = client.chat.completions.create(
+        model=MODEL,
+        messages=prompt,
+        temperature=0.6,
+        max_tokens=20
+    )
+    return response.choices[0].message.content.strip()
+
+
+def generate_call_title(messages):
+    prompt = (
+        "You are an assistant that generates short, meaningful titles for therapy sessions. "
+        "Summarize the emotional focus or main theme of this therapy session in 2–4 words. "
+        "Use title case. Do not add quotes, explanations, or extra text.\n\n"
+    )
+    for msg in messages:
+        role = "User" if msg["sender"] == "user" else "Therapist"
+        prompt += f"{role}: {msg['text']}\n"
+
+    response = client.chat.completions.create(
+        model=MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.6,
+        max_tokens=20
+    )
+    return response.choices[0].message.content.strip().split("\n")[0]
+
 
-        return jsonify({"reply": therapist_reply, "session_id": session_id})
+def title_job_key(user_id, kind, session_id):
+    return f"title:{user_id}:{kind}:{session_id}"
+
+
+def title_pending(user_id, kind, session_id):
+    """True while a queued title job owns the session's name (finished jobs release the dedupe key)."""
+    return db.session.query(Job.id).filter_by(dedupe_key=title_job_key(user_id, kind, session_id)).first() is not None
+
+
+def enqueue_title(data, source):
+    """Queue titling for a saved session; returns False if the request can't be deferred."""
+    session_id = data.get("session_id")
+    kind = data.get("kind")
+    if not current_user.is_authenticated or not session_id or not kind:
+        return False
+    saved = db.session.query(UserSession.id).filter_by(
+        user_id=current_user.id, session_id=session_id, kind=kind
+    ).first()
+    if saved is None:
+        return False   # not saved yet (or a local-only trial session): title it inline
+    enqueue("title_session", {
+        "user_id": current_user.id,
+        "session_id": session_id,
+        "kind": kind,
+        **source,
+    }, dedupe_key=title_job_key(current_user.id, kind, session_id))
+    return True
 
-    except Exception:
-        app.logger.exception("Call API error")
-        return jsonify({"error": "Sorry, something went wrong with the call."}), 500
 
-# ========================================================================
-# AUTO-NAMING
-# ========================================================================
 @app.route("/chat/rename_session", methods=["POST"])
 def rename_session():
     data = request.get_json()
     message = data.get("message", "")
     lang = data.get("language", "en")
 
-    prompt = [
-        {
-            "role": "system",
-            "content": (
-                f"You are a helpful assistant. Generate a short, natural 2–4 word session title in {lang}. "
-                f"If {lang} is not supported, return it in English. "
-                f"Do NOT include quotes, punctuation, or explanations — just the title."
-            )
-        },
-        {"role": "user", "content": message}
-    ]
+    # Saved sessions are titled in the background and updated in place
+    if enqueue_title(data, {"message": message, "language": lang}):
+        return jsonify({"name": None, "queued": True})
 
     try:
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=prompt,
-            temperature=0.6,
-            max_tokens=20
-        )
-        name = response.choices[0].message.content.strip()
-        return jsonify({"name": name})
+        return jsonify({"name": generate_chat_title(message, lang)})
     except Exception:
         app.logger.exception("Rename error")
         return jsonify({"name": "Session"})
@@ -1234,24 +3788,11 @@ def rename_call_session():
     data = request.json
     messages = data.get("messages", [])
 
-    prompt = (
-        "You are an assistant that generates short, meaningful titles for therapy sessions. "
-        "Summarize the emotional focus or main theme of this therapy session in 2–4 words. "
-        "Use title case. Do not add quotes, explanations, or extra text.\n\n"
-    )
-    for msg in messages:
-        role = "User" if msg["sender"] == "user" else "Therapist"
-        prompt += f"{role}: {msg['text']}\n"
+    if enqueue_title(data, {"messages": messages}):
+        return jsonify({"name": None, "queued": True})
 
     try:
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.6,
-            max_tokens=20
-        )
-        name = response.choices[0].message.content.strip().split("\n")[0]
-        return jsonify({"name": name})
+        return jsonify({"name": generate_call_title(messages)})
     except Exception:
         app.logger.exception("Call rename error")
         return jsonify({"name": "Unnamed Session"})
@@ -1286,6 +3827,7 @@ def transcribe():
                 ext = ".wav"  # default
 
         # Save upload to a temp file
+        stage_started = time.perf_counter()
         with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
             temp_path = tmp.name
             try:
@@ -1295,6 +3837,7 @@ def transcribe():
             audio_file.save(temp_path)
 
         file_size = os.path.getsize(temp_path)
+        observe("transcribe_stage_seconds", time.perf_counter() - stage_started, stage="save")
         app.logger.info(f"📦 Saved audio file: {temp_path}, size={file_size} bytes, type={mimetype}")
 
         # Treat tiny files as empty/corrupt
@@ -1305,31 +3848,33 @@ def transcribe():
             return jsonify({"error": "Empty audio file"}), 400
 
         # Convert to wav/16k mono if needed
+        stage_started = time.perf_counter()
         try:
             if not temp_path.endswith(".wav"):
                 from pydub import AudioSegment
-                import imageio_ffmpeg
-
-                try:
-                    AudioSegment.converter = imageio_ffmpeg.get_ffmpeg_exe()
-                except Exception:
-                    pass
+                ffmpeg = resolve_ffmpeg()
+                if ffmpeg:
+                    AudioSegment.converter = ffmpeg
 
                 wav_path = temp_path + ".wav"
-                AudioSegment.from_file(temp_path)\
-                    .set_frame_rate(16000)\
-                    .set_channels(1)\
-                    .export(wav_path, format="wav")
+                with span("ffmpeg"):
+                    AudioSegment.from_file(temp_path)\
+                        .set_frame_rate(16000)\
+                        .set_channels(1)\
+                        .export(wav_path, format="wav")
                 os.remove(temp_path)
                 temp_path = wav_path
                 app.logger.info("🔄 Converted to WAV/16k mono")
         except Exception as conv_err:
             app.logger.warning(f"⚠️ Could not convert to WAV: {conv_err}")
+        observe("transcribe_stage_seconds", time.perf_counter() - stage_started, stage="convert")
 
         # Transcribe
         text = ""
+        stage_started = time.perf_counter()
         try:
-            if IS_DEV and whisper_model:
+            whisper_model = get_whisper_model()
+            if whisper_model:
                 result = whisper_model.transcribe(temp_path)
                 text = (result.get("text") or "").strip()
             else:
@@ -1342,12 +3887,18 @@ def transcribe():
                 text = (getattr(transcript, "text", "") or "").strip()
         except Exception as transcribe_error:
             app.logger.error(f"❌ Transcription failed: {transcribe_error}")
+        observe("transcribe_stage_seconds", time.perf_counter() - stage_started, stage="transcribe")
+
+        if text:
+            # The trial call page uses this endpoint too, before sign-in
+            defer_stat("call_audio_seconds", wav_seconds(temp_path),
+                       "call" if current_user.is_authenticated else "trial_call")
 
         # Cleanup
         try: os.remove(temp_path)
         except Exception: pass
 
-        app.logger.info(f"✅ Transcription result: '{text}'")
+        app.logger.info(f"✅ Transcription result: {len(text)} chars", extra={"content": text})
         return jsonify({"text": text})
 
     except Exception as e:
@@ -1392,16 +3943,15 @@ def trial_transcribe():
         try:
             if ext != ".wav":
                 from pydub import AudioSegment
-                import imageio_ffmpeg
-                try:
-                    AudioSegment.converter = imageio_ffmpeg.get_ffmpeg_exe()
-                except Exception:
-                    pass
+                ffmpeg = resolve_ffmpeg()
+                if ffmpeg:
+                    AudioSegment.converter = ffmpeg
                 wav_path = temp_path + ".wav"
-                AudioSegment.from_file(temp_path)\
-                    .set_frame_rate(16000)\
-                    .set_channels(1)\
-                    .export(wav_path, format="wav")
+                with span("ffmpeg"):
+                    AudioSegment.from_file(temp_path)\
+                        .set_frame_rate(16000)\
+                        .set_channels(1)\
+                        .export(wav_path, format="wav")
                 os.remove(temp_path)
                 temp_path = wav_path
         except Exception as conv_err:
@@ -1413,6 +3963,8 @@ def trial_transcribe():
                 file=f,
             )
         text = (getattr(transcript, "text", "") or "").strip()
+        if text:
+            defer_stat("call_audio_seconds", wav_seconds(temp_path), "trial_call")
 
         os.remove(temp_path)
 
@@ -1491,10 +4043,10 @@ def get_sessions():
     if not current_user.is_authenticated:
         return redirect(url_for("login"))
     try:
-        sessions = UserSession.query.filter(
+        sessions = load_archived_messages(UserSession.query.filter(
             UserSession.user_id == current_user.id,
             UserSession.kind.in_(["chat", "call", "trial_chat", "trial_call"])
-        ).all()
+        ).all())
         result = [
             {
                 "session_id": s.session_id,
@@ -1550,14 +4102,22 @@ def save_session():
                 messages=[]
             )
             db.session.add(s)
+            record_stat("sessions_created", 1, kind)
 
-        if name:
+        # A queued title job owns the name until it runs; the client's placeholder must not win
+        pending = s.id is not None and title_pending(current_user.id, kind, session_id)
+        if name and not pending:
             s.name = name
         if messages is not None:
+            added = len(messages) - len(s.messages or [])
+            if added > 0:
+                record_stat("messages", added, kind)
             s.messages = messages
+            observe("session_payload_bytes", request.content_length or 0, kind=kind)
+            observe("session_messages", len(messages), kind=kind)
 
         db.session.commit()
-        return jsonify({"success": True})
+        return jsonify({"success": True, "name": s.name, "title_pending": pending})
     except Exception:
         app.logger.exception("Error saving session")
         return jsonify({"success": False, "message": "Could not save session"}), 500
@@ -1565,9 +4125,9 @@ def save_session():
 @app.route("/sessions/chat", methods=["GET"])
 @login_required
 def get_chat_sessions():
-    sessions = UserSession.query.filter_by(
+    sessions = load_archived_messages(UserSession.query.filter_by(
         user_id=current_user.id, kind="chat"
-    ).all()
+    ).all())
     return jsonify({"success": True, "sessions": [
         {"session_id": s.session_id, "name": s.name, "messages": s.messages, "kind": s.kind}
         for s in sessions
@@ -1576,9 +4136,9 @@ def get_chat_sessions():
 @app.route("/sessions/call", methods=["GET"])
 @login_required
 def get_call_sessions():
-    sessions = UserSession.query.filter_by(
+    sessions = load_archived_messages(UserSession.query.filter_by(
         user_id=current_user.id, kind="call"
-    ).all()
+    ).all())
     return jsonify({"success": True, "sessions": [
         {"session_id": s.session_id, "name": s.name, "messages": s.messages, "kind": s.kind}
         for s in sessions
@@ -1591,13 +4151,16 @@ def delete_session():
     try:
         data = request.get_json()
         session_id = data.get("session_id")
+        kind = data.get("kind")
 
         if not session_id:
             return jsonify({"success": False, "message": "Missing session_id"}), 400
 
-        rows_deleted = UserSession.query.filter_by(
-            user_id=current_user.id, session_id=session_id
-        ).delete()
+        # Without a kind, every session with this id goes (older clients)
+        query = UserSession.query.filter_by(user_id=current_user.id, session_id=session_id)
+        if kind:
+            query = query.filter_by(kind=kind)
+        rows_deleted = query.delete()
         db.session.commit()
 
         if rows_deleted == 0:
@@ -1609,17 +4172,981 @@ def delete_session():
         return jsonify({"success": False, "message": "Could not delete session"}), 500
 
 
+# ========================================================================
+# SESSION SEARCH
+# ========================================================================
+# Session names and message text are indexed per row of `user_session` by
+# database triggers, so every write path (save, /chat, /call, titling, bulk
+# deletes) keeps the index current on its own. SQLite uses an FTS5 table whose
+# rowid is user_session.id and whose `owner` column ("u<user_id> k<kind>") is
+# part of every MATCH; Postgres uses `session_search` with a generated tsvector
+# and a GIN index. Hits are re-checked against user_session.user_id, and
+# ranking + snippets are computed over that user's matches only. A batch
+# migration that rebuilds user_session on SQLite drops its triggers: run
+# `flask search-reindex` afterwards (it recreates them and rebuilds the index).
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_MAX = 50
+SEARCH_TERMS_MAX = 8
+SEARCH_SNIPPET_CHARS = 160
+SEARCH_CANDIDATES = 500   # newest matching sessions that get ranked
+SNIPPET_OPEN, SNIPPET_CLOSE = "\ue000", "\ue001"   # swapped for <mark> after escaping
+
+# Text of one session row: its messages' `text` (browser) or `content` (server)
+# fields, one per line. {row} is NEW inside a trigger, user_session in a backfill.
+SESSION_TEXT_SQL = {
+    "sqlite": (
+        "coalesce((SELECT group_concat(coalesce(json_extract(value, '$.text'), json_extract(value, '$.content')), char(10))"
+        " FROM json_each(CASE WHEN json_valid({row}.messages) AND json_type({row}.messages) = 'array'"
+        " THEN {row}.messages ELSE '[]' END) WHERE type = 'object'), '')"
+    ),
+    "postgresql": (
+        "coalesce((SELECT string_agg(coalesce(m ->> 'text', m ->> 'content'), E'\\n')"
+        " FROM json_array_elements(CASE WHEN json_typeof({row}.messages) = 'array'"
+        " THEN {row}.messages ELSE '[]'::json END) AS m WHERE json_typeof(m) = 'object'), '')"
+    ),
+}
+SQLITE_FTS_ROW = ("'u' || {row}.user_id || ' k' || replace({row}.kind, '_', ''), coalesce({row}.name, ''), "
+                  + SESSION_TEXT_SQL["sqlite"])
+SESSION_SEARCH_DDL = {
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS session_fts USING fts5("
+        "owner, name, body, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+        "CREATE TRIGGER IF NOT EXISTS user_session_fts_insert AFTER INSERT ON user_session BEGIN "
+        "INSERT INTO session_fts (rowid, owner, name, body) VALUES (NEW.id, " + SQLITE_FTS_ROW.format(row="NEW") + "); "
+        "END",
+        # Archiving NULLs messages; the indexed body is kept so archived sessions stay searchable
+        "CREATE TRIGGER IF NOT EXISTS user_session_fts_update AFTER UPDATE OF user_id, kind, name, messages "
+        "ON user_session BEGIN "
+        "UPDATE session_fts SET owner = 'u' || NEW.user_id || ' k' || replace(NEW.kind, '_', ''), "
+        "name = coalesce(NEW.name, ''), body = CASE WHEN NEW.archived_at IS NULL THEN "
+        + SESSION_TEXT_SQL["sqlite"].format(row="NEW") + " ELSE body END WHERE rowid = NEW.id; "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS user_session_fts_delete AFTER DELETE ON user_session BEGIN "
+        "DELETE FROM session_fts WHERE rowid = OLD.id; "
+        "END",
+    ],
+    "postgresql": [
+        "CREATE TABLE IF NOT EXISTS session_search ("
+        " session_pk INTEGER PRIMARY KEY REFERENCES user_session (id) ON DELETE CASCADE,"
+        " user_id INTEGER NOT NULL,"
+        " kind VARCHAR(20) NOT NULL,"
+        " name TEXT NOT NULL DEFAULT '',"
+        " body TEXT NOT NULL DEFAULT '',"
+        " document tsvector GENERATED ALWAYS AS (to_tsvector('simple', name || ' ' || body)) STORED)",
+        "CREATE INDEX IF NOT EXISTS ix_session_search_document ON session_search USING gin (document)",
+        "CREATE INDEX IF NOT EXISTS ix_session_search_user_kind ON session_search (user_id, kind)",
+        "CREATE OR REPLACE FUNCTION session_search_sync() RETURNS trigger AS $$ BEGIN "
+        "INSERT INTO session_search (session_pk, user_id, kind, name, body) "
+        "VALUES (NEW.id, NEW.user_id, NEW.kind, coalesce(NEW.name, ''), " + SESSION_TEXT_SQL["postgresql"].format(row="NEW") + ") "
+        "ON CONFLICT (session_pk) DO UPDATE SET user_id = EXCLUDED.user_id, kind = EXCLUDED.kind, "
+        "name = EXCLUDED.name, body = CASE WHEN NEW.archived_at IS NULL THEN EXCLUDED.body "
+        "ELSE session_search.body END; "
+        "RETURN NULL; END $$ LANGUAGE plpgsql",
+        "DROP TRIGGER IF EXISTS user_session_search ON user_session",
+        "CREATE TRIGGER user_session_search AFTER INSERT OR UPDATE OF user_id, kind, name, messages "
+        "ON user_session FOR EACH ROW EXECUTE FUNCTION session_search_sync()",
+    ],
+}
+
+
+def create_session_search(target, connection, **kw):
+    """after_create hook for user_session (db.create_all); deployed databases get this from the migration."""
+    for statement in SESSION_SEARCH_DDL.get(connection.dialect.name, []):
+        connection.exec_driver_sql(statement)
+
+
+db_event.listen(UserSession.__table__, "after_create", create_session_search)
+
+
+def session_text(messages):
+    """SESSION_TEXT_SQL in Python, for transcripts the triggers no longer see (archived ones)."""
+    lines = []
+    for m in messages if isinstance(messages, list) else []:
+        if isinstance(m, dict):
+            value = m.get("text") if m.get("text") is not None else m.get("content")
+            if value is not None:
+                lines.append(value if isinstance(value, str) else json.dumps(value))
+    return "\n".join(lines)
+
+
+def search_terms(query):
+    """Lower-cased word terms of a user query; the last one (2+ letters) is matched as a prefix."""
+    return re.findall(r"[^\W_]+", fold_text(query or ""))[:SEARCH_TERMS_MAX]
+
+
+_FOLDED_CHARS = {}
+
+
+def fold_text(text):
+    """Lower-case and strip diacritics one character at a time, so offsets still match `text`."""
+    if text.isascii():
+        return text.lower()
+    import unicodedata
+    for ch in set(text):
+        if ord(ch) not in _FOLDED_CHARS:
+            folded = unicodedata.normalize("NFD", ch)[0].lower()
+            _FOLDED_CHARS[ord(ch)] = folded if len(folded) == 1 else ch
+    return text.translate(_FOLDED_CHARS)
+
+
+def term_pattern(terms):
+    exact = "|".join(re.escape(t) for t in sorted(terms[:-1], key=len, reverse=True))
+    last = re.escape(terms[-1]) + (r"[^\W_]*" if len(terms[-1]) > 1 else "")
+    # No lookbehind: it defeats the regex engine's prefix search; term_matches checks the left edge
+    return re.compile(rf"(?:{exact + '|' if exact else ''}{last})(?![^\W_])")
+
+
+def term_matches(pattern, folded, start=0, end=None):
+    for m in pattern.finditer(folded, start, len(folded) if end is None else end):
+        if m.start() == 0 or not folded[m.start() - 1].isalnum():
+            yield m
+
+
+def mark_matches(text, folded, pattern, start=0, end=None):
+    end = len(text) if end is None else end
+    out, pos = [], start
+    for m in term_matches(pattern, folded, start, end):
+        out += [text[pos:m.start()], SNIPPET_OPEN, text[m.start():m.end()], SNIPPET_CLOSE]
+        pos = m.end()
+    out.append(text[pos:end])
+    return "".join(out)
+
+
+def snippet_html(text):
+    from markupsafe import escape
+    return str(escape(text or "")).replace(SNIPPET_OPEN, "<mark>").replace(SNIPPET_CLOSE, "</mark>")
+
+
+def session_snippet(body, folded, terms, pattern):
+    """The message line with the most matches, cut to SEARCH_SNIPPET_CHARS around its first one."""
+    best, best_count, offset = 0, 0, 0
+    for line in folded.split("\n"):
+        count = sum(line.count(t) for t in terms)
+        if count > best_count:
+            best, best_count = offset, count
+        offset += len(line) + 1
+    best_end = folded.find("\n", best)
+    # Substring counts may pick a line with only "sisters"; then use the first whole-word match
+    first = (next(term_matches(pattern, folded, best, len(folded) if best_end < 0 else best_end), None)
+             or next(term_matches(pattern, folded), None))
+    hit = first.start() if first else 0
+    line_start = folded.rfind("\n", 0, hit) + 1
+    line_end = folded.find("\n", hit)
+    line_end = len(folded) if line_end < 0 else line_end
+
+    start = max(line_start, hit - SEARCH_SNIPPET_CHARS // 3)
+    if start > line_start:
+        space = folded.find(" ", start, hit)
+        start = space + 1 if space >= 0 else start
+    end = min(line_end, start + SEARCH_SNIPPET_CHARS)
+    if end < line_end:
+        space = folded.rfind(" ", hit, end)
+        end = space if space > 0 else end
+    return "".join([
+        "…" if start > line_start else "",
+        mark_matches(body, folded, pattern, start, end),
+        "…" if end < line_end else "",
+    ])
+
+
+def search_sessions(user_id, query, kind=None, page=1, limit=SEARCH_PAGE_SIZE):
+    """Ranked matches in one user's sessions: (results, has_more).
+
+    The index returns the user's newest SEARCH_CANDIDATES matching sessions and
+    they are ranked here with BM25 over that set (names weigh 4x), so the cost
+    depends on the user's history, never on how common a word is across users.
+    Each result has "session_id", "kind", "name", "snippet" and "rank", with
+    matched words wrapped in SNIPPET_OPEN/SNIPPET_CLOSE.
+    """
+    import math
+    terms = search_terms(query)
+    if not terms:
+        return [], False
+    limit = min(max(int(limit), 1), SEARCH_PAGE_MAX)
+    offset = (max(int(page), 1) - 1) * limit
+    params = {"user_id": user_id, "kind": kind, "cap": SEARCH_CANDIDATES}
+    prefix = len(terms[-1]) > 1
+    confirm = None
+
+    if db.engine.dialect.name == "postgresql":
+        params["query"] = " & ".join(terms[:-1] + [terms[-1] + (":*" if prefix else "")])
+        sql = """
+            SELECT s.session_id, s.kind, x.name, x.body
+            FROM session_search AS x JOIN user_session AS s ON s.id = x.session_pk
+            WHERE x.user_id = :user_id AND s.user_id = :user_id
+              AND x.document @@ to_tsquery('simple', :query)
+              AND (CAST(:kind AS VARCHAR) IS NULL OR x.kind = :kind)
+            ORDER BY x.session_pk DESC
+            LIMIT :cap
+        """
+    else:
+        owner = f'owner : "u{int(user_id)}"'
+        if kind:
+            owner += f' AND owner : "k{kind.replace("_", "")}"'
+        # The FTS5 prefix index covers 2-3 letters; a longer prefix would merge every
+        # matching term's postings across all users, so it is narrowed to 3 letters
+        # here and the full prefix is confirmed on the fetched rows below.
+        fts_terms = terms[:-1] + [terms[-1][:3] if prefix else terms[-1]]
+        confirm = term_pattern(terms[-1:]) if prefix and len(terms[-1]) > 3 else None
+        words = " AND ".join(f'"{t}"' for t in fts_terms) + ("*" if prefix else "")
+        params["match"] = f"{owner} AND {{name body}} : ({words})"
+        sql = """
+            SELECT s.session_id, s.kind, session_fts.name, session_fts.body
+            FROM session_fts JOIN user_session AS s ON s.id = session_fts.rowid
+            WHERE session_fts MATCH :match AND s.user_id = :user_id
+            ORDER BY session_fts.rowid DESC
+            LIMIT :cap
+        """
+    rows = db.session.execute(db.text(sql), params).all()
+
+    scored = []
+    for row in rows:
+        folded_name, folded_body = fold_text(row.name or ""), fold_text(row.body or "")
+        if confirm and not any(next(term_matches(confirm, f), None) for f in (folded_name, folded_body)):
+            continue
+        # Substring counts are enough here: the index already required whole-word matches
+        tf = [4 * folded_name.count(t) + folded_body.count(t) for t in terms]
+        scored.append((row, folded_name, folded_body, tf, len(folded_body) + 1))
+
+    if not scored:
+        return [], False
+    k1, b = 1.2, 0.75
+    avg_length = sum(s[4] for s in scored) / len(scored)
+    matching = [sum(1 for s in scored if s[3][i]) for i in range(len(terms))]
+    idf = [math.log(1 + (len(scored) - n + 0.5) / (n + 0.5)) for n in matching]
+
+    def bm25(tf, length):
+        norm = k1 * (1 - b + b * length / avg_length)
+        return sum(w * f * (k1 + 1) / (f + norm) for w, f in zip(idf, tf))
+
+    ranked = sorted(((bm25(tf, length), row, fn, fb) for row, fn, fb, tf, length in scored),
+                    key=lambda r: r[0], reverse=True)   # stable: ties stay newest first
+
+    pattern = term_pattern(terms)
+    results = [{
+        "session_id": row.session_id, "kind": row.kind, "rank": round(score, 4),
+        "name": mark_matches(row.name or "", folded_name, pattern),
+        "snippet": session_snippet(row.body or "", folded_body, terms, pattern),
+    } for score, row, folded_name, folded_body in ranked[offset:offset + limit]]
+    return results, len(ranked) > offset + limit
+
+
+@app.route("/sessions/search", methods=["GET"])
+@login_required
+def search_sessions_route():
+    query = request.args.get("q", "")[:200]
+    kind = request.args.get("kind") or None
+    if kind and kind not in ("chat", "call", "trial_chat", "trial_call"):
+        return jsonify({"success": False, "message": "Unknown kind"}), 400
+    try:
+        page = int(request.args.get("page", 1))
+        limit = int(request.args.get("limit", SEARCH_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"success": False, "message": "page and limit must be integers"}), 400
+
+    try:
+        results, has_more = search_sessions(current_user.id, query, kind, page, limit)
+    except Exception:
+        app.logger.exception("Error searching sessions")
+        return jsonify({"success": False, "message": "Could not search sessions"}), 500
+    return jsonify({"success": True, "page": max(page, 1), "has_more": has_more, "results": [
+        {"session_id": r["session_id"], "kind": r["kind"], "rank": r["rank"],
+         "name_html": snippet_html(r["name"]), "snippet_html": snippet_html(r["snippet"])}
+        for r in results
+    ]})
+
+
+@app.cli.command("search-reindex")
+@click.option("--batch", default=5000, show_default=True)
+def search_reindex_command(batch):
+    """Rebuild the session search index from user_session (after a restore or a trigger change)."""
+    dialect = db.engine.dialect.name
+    if dialect not in SESSION_SEARCH_DDL:
+        raise click.ClickException(f"session search is not supported on {dialect}")
+    with db.engine.begin() as conn:
+        for statement in SESSION_SEARCH_DDL[dialect]:
+            conn.exec_driver_sql(statement)
+        conn.exec_driver_sql("DELETE FROM session_fts" if dialect == "sqlite" else "TRUNCATE session_search")
+        last_id = conn.exec_driver_sql("SELECT coalesce(max(id), 0) FROM user_session").scalar()
+
+    if dialect == "sqlite":
+        insert = ("INSERT INTO session_fts (rowid, owner, name, body) SELECT user_session.id, "
+                  + SQLITE_FTS_ROW.format(row="user_session"))
+    else:
+        insert = ("INSERT INTO session_search (session_pk, user_id, kind, name, body) "
+                  "SELECT user_session.id, user_session.user_id, user_session.kind, coalesce(user_session.name, ''), "
+                  + SESSION_TEXT_SQL["postgresql"].format(row="user_session"))
+    insert += " FROM user_session WHERE user_session.id > :low AND user_session.id <= :high"
+
+    started = time.perf_counter()
+    for low in range(0, last_id, batch):
+        with db.engine.begin() as conn:   # one short transaction per chunk
+            conn.execute(db.text(insert), {"low": low, "high": low + batch})
+
+    # Archived transcripts are NULL in user_session: index them from session_archive
+    update = ("UPDATE session_fts SET body = :body WHERE rowid = :pk" if dialect == "sqlite"
+              else "UPDATE session_search SET body = :body WHERE session_pk = :pk")
+    last_pk = 0
+    while True:
+        archives = db.session.execute(
+            db.select(SessionArchive.session_pk, SessionArchive.codec, SessionArchive.payload)
+            .where(SessionArchive.session_pk > last_pk).order_by(SessionArchive.session_pk).limit(batch)
+        ).all()
+        db.session.rollback()
+        if not archives:
+            break
+        with db.engine.begin() as conn:
+            conn.execute(db.text(update), [
+                {"pk": a.session_pk, "body": session_text(decompress_messages(a.codec, a.payload))}
+                for a in archives
+            ])
+        last_pk = archives[-1].session_pk
+    if dialect == "sqlite":
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("INSERT INTO session_fts (session_fts) VALUES ('optimize')")
+    click.echo(f"✅ Reindexed sessions up to id {last_id} in {time.perf_counter() - started:.1f}s")
+
+
+SEARCH_BENCH_TOPICS = ["sister", "mother", "father", "work", "anxiety", "sleep", "panic", "grief", "school",
+                       "friend", "partner", "anger", "lonely", "money", "exam", "holiday", "boundaries", "guilt"]
+
+
+@app.cli.command("bench-search")
+@click.option("--users", default=2000, show_default=True, help="Other users sharing the index")
+@click.option("--sessions-per-user", default=20, show_default=True)
+@click.option("--messages", default=5000, show_default=True, help="Messages across the probed user's sessions")
+@click.option("--queries", default=500, show_default=True)
+@click.option("--max-p99-ms", default=25.0, show_default=True, help="Fail when p99 latency is above this")
+@click.option("--keep", is_flag=True, help="Keep the scratch database and print its path")
+def bench_search_command(users, sessions_per_user, messages, queries, max_p99_ms, keep):
+    """Seed a scratch database and time search_sessions() for a user with thousands of messages."""
+    if not os.environ.get(SCRATCH_DB_ENV):
+        args = ["bench-search", "--users", str(users), "--sessions-per-user", str(sessions_per_user),
+                "--messages", str(messages), "--queries", str(queries), "--max-p99-ms", str(max_p99_ms)]
+        if rerun_in_scratch_database(args, keep):
+            raise click.ClickException("search benchmark failed")
+        return
+
+    db.create_all()
+    rng = random.Random(45)
+    syllables = ["ka", "lo", "mi", "ne", "ra", "su", "te", "vo", "shi", "an", "el", "or", "un", "ba", "di"]
+    vocabulary = list(SEARCH_BENCH_TOPICS) + list({"".join(rng.choices(syllables, k=rng.randint(2, 4)))
+                                                   for _ in range(4000)})
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]   # Zipf-like
+
+    def sentence():
+        return " ".join(rng.choices(vocabulary, weights, k=rng.randint(6, 18)))
+
+    def seed(user_id, n_sessions, per_session):
+        db.session.execute(UserSession.__table__.insert(), [{
+            "user_id": user_id, "session_id": f"bench-{user_id}-{n}", "kind": ("chat", "call")[n % 2],
+            "name": sentence()[:60],
+            "messages": [{"sender": "user", "text": sentence()} if m % 2 == 0 else
+                         {"role": "assistant", "content": sentence()} for m in range(per_session)],
+        } for n in range(n_sessions)])
+
+    started = time.perf_counter()
+    db.session.execute(User.__table__.insert(), [{"email": f"bench{i}@example.test", "password_hash": "-"}
+                                                 for i in range(users + 1)])
+    probe_id = db.session.execute(db.select(db.func.max(User.id))).scalar()
+    for user_id in range(probe_id - users, probe_id):
+        seed(user_id, sessions_per_user, 10)
+        if user_id % 200 == 0:
+            db.session.commit()
+    per_session = 25
+    seed(probe_id, max(messages // per_session, 1), per_session)
+    db.session.commit()
+    click.echo(f"seeded {users * sessions_per_user * 10 + messages} messages in {time.perf_counter() - started:.0f}s")
+
+    samples, hits = [], 0
+    for i in range(max(queries, 1)):
+        words = rng.sample(SEARCH_BENCH_TOPICS, 2) + rng.choices(vocabulary, weights, k=2)
+        query = [words[0], f"{words[0]} {words[1]}", words[2][:3], f"{words[3]} {words[1][:4]}"][i % 4]
+        t0 = time.perf_counter()
+        results, _ = search_sessions(probe_id, query, page=1 + i % 2)
+        samples.append((time.perf_counter() - t0) * 1000)
+        hits += len(results)
+        db.session.rollback()
+
+    samples.sort()
+    p50 = samples[len(samples) // 2]
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    click.echo(f"{queries} queries, {hits / queries:.1f} results/query: "
+               f"p50 {p50:.2f} ms, p99 {p99:.2f} ms, max {samples[-1]:.2f} ms")
+    if p99 > max_p99_ms:
+        raise click.ClickException(f"p99 above {max_p99_ms} ms")
+
+
+# ========================================================================
+# SESSION ARCHIVE
+# ========================================================================
+# Sessions idle for SESSION_ARCHIVE_DAYS (trial sessions: SESSION_ARCHIVE_TRIAL_DAYS)
+# move to the cold tier: the transcript is compressed into `session_archive`
+# and user_session.messages becomes NULL, so the hot table, its pages and the
+# page cache only carry active sessions. Reading `UserSession.messages`
+# decompresses the archive once per session; assigning to it moves the session
+# back to the hot table. The search index keeps the text of archived sessions.
+# Payloads are zstd when the zstandard package is installed and gzip otherwise;
+# the codec is stored per row.
+SESSION_ARCHIVE_DAYS = int(os.getenv("SESSION_ARCHIVE_DAYS", "90"))
+SESSION_ARCHIVE_TRIAL_DAYS = int(os.getenv("SESSION_ARCHIVE_TRIAL_DAYS", "7"))
+SESSION_ARCHIVE_BATCH = 500
+SESSION_ARCHIVE_MAX_PER_RUN = 20000   # the hourly job picks up the rest next time
+TRIAL_SESSION_KINDS = ("trial_chat", "trial_call")
+
+# Deleting a session drops its archive: ON DELETE CASCADE on Postgres, a trigger
+# on SQLite (which does not enforce foreign keys here).
+SESSION_ARCHIVE_DDL = {
+    "sqlite": [
+        "CREATE TRIGGER IF NOT EXISTS user_session_archive_delete AFTER DELETE ON user_session BEGIN "
+        "DELETE FROM session_archive WHERE session_pk = OLD.id; "
+        "END",
+    ],
+}
+
+
+def create_session_archive(target, connection, **kw):
+    """after_create hook for session_archive (db.create_all); deployed databases get this from the migration."""
+    for statement in SESSION_ARCHIVE_DDL.get(connection.dialect.name, []):
+        connection.exec_driver_sql(statement)
+
+
+db_event.listen(SessionArchive.__table__, "after_create", create_session_archive)
+
+
+def compress_messages(messages):
+    """(codec, payload, raw_bytes) for a transcript; raw_bytes is its size as stored inline."""
+    import gzip
+    raw = json.dumps(messages).encode("utf-8")   # what the JSON column held
+    try:
+        import zstandard
+        return "zstd", zstandard.ZstdCompressor(level=9).compress(raw), len(raw)
+    except ImportError:
+        return "gzip", gzip.compress(raw, compresslevel=9, mtime=0), len(raw)
+
+
+def decompress_messages(codec, payload):
+    if codec == "zstd":
+        import zstandard
+        raw = zstandard.ZstdDecompressor().decompress(payload)
+    elif codec == "gzip":
+        import gzip
+        raw = gzip.decompress(payload)
+    else:
+        raise ValueError(f"unknown session archive codec {codec!r}")
+    return json.loads(raw)
+
+
+def load_archived_messages(sessions):
+    """Decompress the archived transcripts among `sessions` with one query (listings use this)."""
+    cold = {s.id: s for s in sessions if s.archived_at is not None and "_cold_messages" not in s.__dict__}
+    if not cold:
+        return sessions
+    for archive in SessionArchive.query.filter(SessionArchive.session_pk.in_(list(cold))):
+        cold.pop(archive.session_pk)._cold_messages = decompress_messages(archive.codec, archive.payload)
+    for s in cold.values():   # archive row missing: show an empty transcript rather than fail
+        app.logger.warning(f"⚠️ Session {s.id} is archived but has no archive row")
+        s._cold_messages = []
+    return sessions
+
+
+def archive_cold_sessions(limit=SESSION_ARCHIVE_MAX_PER_RUN):
+    """Move idle sessions to session_archive in batches: (sessions archived, bytes reclaimed).
+
+    Each batch is compressed first, then swapped in one short transaction. The
+    swap only applies to rows whose updated_at is unchanged since they were
+    read, so a session saved meanwhile stays hot.
+    """
+    now = datetime.utcnow()
+    cutoff = now - timedelta(days=SESSION_ARCHIVE_DAYS)
+    trial_cutoff = now - timedelta(days=SESSION_ARCHIVE_TRIAL_DAYS)
+    table = UserSession.__table__
+    idle = and_(
+        table.c.archived_at.is_(None),
+        table.c.updated_at < max(cutoff, trial_cutoff),
+        table.c.messages.isnot(None),
+        or_(and_(table.c.kind.in_(TRIAL_SESSION_KINDS), table.c.updated_at < trial_cutoff),
+            and_(table.c.kind.notin_(TRIAL_SESSION_KINDS), table.c.updated_at < cutoff)),
+    )
+    archived = reclaimed = 0
+    while archived < limit:
+        rows = db.session.execute(
+            db.select(table.c.id, table.c.messages, table.c.updated_at)
+            .where(idle).order_by(table.c.updated_at)
+            .limit(min(SESSION_ARCHIVE_BATCH, limit - archived))
+        ).all()
+        if not rows:
+            break
+        packed = {row.id: compress_messages(row.messages) for row in rows}
+
+        db.session.execute(
+            table.update()
+            .where(table.c.id == db.bindparam("pk"), table.c.updated_at == db.bindparam("seen"),
+                   table.c.archived_at.is_(None))
+            .values(messages=db.null(), archived_at=now, updated_at=table.c.updated_at),
+            [{"pk": row.id, "seen": row.updated_at} for row in rows],
+        )
+        swapped = db.session.execute(
+            db.select(table.c.id).where(table.c.id.in_(list(packed)), table.c.archived_at == now)
+        ).scalars().all()
+        if swapped:
+            db.session.execute(SessionArchive.__table__.insert(), [
+                {"session_pk": pk, "codec": packed[pk][0], "payload": packed[pk][1],
+                 "raw_bytes": packed[pk][2], "archived_at": now}
+                for pk in swapped
+            ])
+            saved = sum(packed[pk][2] - len(packed[pk][1]) for pk in swapped)
+            record_stat("sessions_archived", len(swapped))
+            record_stat("archive_bytes_reclaimed", saved)
+            archived += len(swapped)
+            reclaimed += saved
+        db.session.commit()
+        if len(rows) < SESSION_ARCHIVE_BATCH:
+            break
+    return archived, reclaimed
+
+
+@job_handler("archive_sessions", every=3600)
+def archive_sessions_job(payload):
+    archived, reclaimed = archive_cold_sessions()
+    if archived:
+        app.logger.info(f"🧊 Archived {archived} idle sessions, {reclaimed / 1e6:.1f} MB out of user_session")
+
+
+def session_tier_sizes():
+    """Sessions and bytes per tier: {"hot": (n, bytes), "cold": (n, raw bytes, stored bytes)}."""
+    table = UserSession.__table__
+    hot = db.session.execute(
+        db.select(db.func.count(), db.func.coalesce(db.func.sum(db.func.length(db.cast(table.c.messages, db.Text))), 0))
+        .where(table.c.archived_at.is_(None))
+    ).one()
+    cold = db.session.execute(
+        db.select(db.func.count(), db.func.coalesce(db.func.sum(SessionArchive.raw_bytes), 0),
+                  db.func.coalesce(db.func.sum(db.func.length(SessionArchive.payload)), 0))
+    ).one()
+    return {"hot": tuple(hot), "cold": tuple(cold)}
+
+
+@app.cli.command("archive-sessions")
+@click.option("--limit", default=SESSION_ARCHIVE_MAX_PER_RUN, show_default=True, help="Most sessions to archive")
+@click.option("--vacuum", is_flag=True, help="SQLite: VACUUM afterwards so the file shrinks")
+def archive_sessions_command(limit, vacuum):
+    """Archive idle sessions now (the worker also does this hourly) and print tier sizes."""
+    started = time.perf_counter()
+    archived, reclaimed = archive_cold_sessions(limit)
+    click.echo(f"🧊 Archived {archived} sessions in {time.perf_counter() - started:.1f}s, "
+               f"{reclaimed / 1e6:.2f} MB out of user_session")
+    if vacuum and db.engine.dialect.name == "sqlite":
+        db.session.remove()
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("VACUUM")
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    sizes = session_tier_sizes()
+    (hot, hot_bytes), (cold, raw, stored) = sizes["hot"], sizes["cold"]
+    click.echo(f"hot: {hot} sessions, {hot_bytes / 1e6:.2f} MB of messages")
+    click.echo(f"cold: {cold} sessions, {raw / 1e6:.2f} MB compressed to {stored / 1e6:.2f} MB")
+
+
+# ========================================================================
+# DATA EXPORT
+# ========================================================================
+# A user's account and every saved session (archived ones included), streamed
+# as NDJSON or a zip archive for the user, an admin, or a whole group_id cohort.
+# Users and sessions are read in keyset batches (a user's sessions in kind, id
+# order, which is ix_user_session_user_kind's order) and no transaction is
+# held between batches, so memory stays flat and a slow download pins nothing.
+# Every record carries the cursor of its position: passing the last one
+# received as `after` resumes the export right behind it, and a final
+# {"type": "end"} record marks a complete download.
+EXPORT_BATCH = 50
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "zip": "application/zip"}
+EXPORT_USER_COLUMNS = (User.id, User.email, User.is_subscribed, User.subscription_type, User.group_id,
+                       User.stripe_customer_id)
+
+
+def export_user_sessions(user_id, position=("", 0)):
+    """Session records of one user after (kind, id) `position`."""
+    table = UserSession.__table__
+    while True:
+        rows = db.session.execute(
+            db.select(table.c.id, table.c.session_id, table.c.kind, table.c.name, table.c.messages,
+                      table.c.updated_at, table.c.archived_at, SessionArchive.codec, SessionArchive.payload)
+            .outerjoin(SessionArchive, SessionArchive.session_pk == table.c.id)
+            .where(table.c.user_id == user_id, tuple_(table.c.kind, table.c.id) > tuple_(*position))
+            .order_by(table.c.kind, table.c.id)
+            .limit(EXPORT_BATCH)
+        ).all()
+        db.session.rollback()   # nothing to write; just don't keep a snapshot open between batches
+        for row in rows:
+            if row.archived_at is None:
+                messages = row.messages
+            else:
+                messages = decompress_messages(row.codec, row.payload) if row.payload is not None else []
+            yield {
+                "type": "session",
+                "cursor": encode_cursor([user_id, row.kind, row.id]),
+                "user_id": user_id,
+                "session_id": row.session_id,
+                "kind": row.kind,
+                "name": row.name,
+                "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+                "messages": messages,
+            }
+        if len(rows) < EXPORT_BATCH:
+            return
+        position = (rows[-1].kind, rows[-1].id)
+
+
+def export_records(where, after=None):
+    """Account and session records of the users matching `where`, in cursor order.
+
+    `after` is a decoded cursor; everything up to and including it is skipped.
+    The last record is {"type": "end"} with what this call produced.
+    """
+    counts = {"users": 0, "sessions": 0}
+    last_id = 0
+    if after:
+        last_id = after[0]
+        if db.session.execute(db.select(User.id).where(where, User.id == last_id)).first():
+            for record in export_user_sessions(last_id, (after[1], after[2])):
+                counts["sessions"] += 1
+                yield record
+    while True:
+        users = db.session.execute(
+            db.select(*EXPORT_USER_COLUMNS).where(where, User.id > last_id).order_by(User.id).limit(EXPORT_BATCH)
+        ).all()
+        db.session.rollback()
+        for user in users:
+            counts["users"] += 1
+            yield {"type": "account", "cursor": encode_cursor([user.id, "", 0]), "account": dict(user._mapping)}
+            for record in export_user_sessions(user.id):
+                counts["sessions"] += 1
+                yield record
+        if len(users) < EXPORT_BATCH:
+            break
+        last_id = users[-1].id
+    yield {"type": "end", "exported_at": datetime.utcnow().isoformat(), **counts}
+
+
+def export_line(record):
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class ExportBuffer:
+    """Write-only file for zipfile; export_zip() hands its bytes on after every record."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def export_zip(records):
+    """Stream `records` as a zip: <user_id>/account.json, <user_id>/sessions.ndjson, manifest.json.
+
+    The manifest holds the end record plus `last_cursor`, to resume a cut-off
+    export with a second archive.
+    """
+    import zipfile
+    out = ExportBuffer()
+    manifest, last_cursor = {}, None
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        entry, entry_user = None, None
+        for record in records:
+            if record["type"] == "end":
+                manifest = dict(record, last_cursor=last_cursor)
+                continue
+            user_id = record["account"]["id"] if record["type"] == "account" else record["user_id"]
+            if entry is not None and (record["type"] == "account" or entry_user != user_id):
+                entry.close()
+                entry = None
+            if record["type"] == "account":
+                archive.writestr(f"{user_id}/account.json", json.dumps(record["account"], ensure_ascii=False, indent=2))
+            else:
+                if entry is None:
+                    info = zipfile.ZipInfo(f"{user_id}/sessions.ndjson", time.localtime()[:6])
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    entry, entry_user = archive.open(info, "w", force_zip64=True), user_id
+                entry.write(export_line(record))
+            last_cursor = record["cursor"]
+            data = out.drain()
+            if data:
+                yield data
+        if entry is not None:
+            entry.close()
+        archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+    yield out.drain()
+
+
+def export_response(where, filename, fmt, after):
+    from flask import Response, stream_with_context
+    records = export_records(where, after)
+    body = export_zip(records) if fmt == "zip" else (export_line(r) for r in records)
+    return Response(stream_with_context(body), mimetype=EXPORT_FORMATS[fmt], headers={
+        "Content-Disposition": f'attachment; filename="{filename}.{fmt}"',
+        "Cache-Control": "no-store",
+        "X-Accel-Buffering": "no",   # let nginx pass chunks through as they are produced
+    })
+
+
+def export_request_args():
+    """(format, decoded `after` cursor) from the query string; aborts with 400 when invalid."""
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in EXPORT_FORMATS:
+        abort(400)
+    after = decode_cursor(request.args["after"], size=3) if request.args.get("after") else None
+    if after and not (isinstance(after[0], int) and isinstance(after[1], str) and isinstance(after[2], int)):
+        abort(400)
+    return fmt, after
+
+
+@app.route("/account/export")
+@login_required
+def export_account_data():
+    fmt, after = export_request_args()
+    app.logger.info(f"📦 Data export ({fmt}) for user {current_user.id}")
+    return export_response(User.id == current_user.id, f"theralink-export-{current_user.id}", fmt, after)
+
+
+@app.route("/admin/export")
+@login_required
+@admin_required
+def admin_export():
+    """One user (?user_id=) or a whole cohort (?group=), as NDJSON or zip."""
+    fmt, after = export_request_args()
+    group_id = (request.args.get("group") or "").strip()
+    user_id = request.args.get("user_id", type=int)
+    if group_id:
+        where, filename = User.group_id == group_id, "theralink-group-" + re.sub(r"[^\w.-]+", "_", group_id)
+    elif user_id:
+        where, filename = User.id == user_id, f"theralink-export-{user_id}"
+    else:
+        return jsonify({"success": False, "message": "Pass user_id or group"}), 400
+    app.logger.info(f"📦 Admin data export ({fmt}): {group_id or user_id}")
+    return export_response(where, filename, fmt, after)
+
+
+def ndjson_resume_point(path):
+    """Cut `path` after its last complete line and return that record (None when there is none)."""
+    with open(path, "rb+") as f:
+        pos = f.seek(0, os.SEEK_END)
+        tail = b""
+        while pos > 0 and tail.count(b"\n") < 2:
+            step = min(64 * 1024, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+        cut = tail.rfind(b"\n")
+        if cut < 0:
+            f.truncate(0)
+            return None
+        f.truncate(pos + cut + 1)
+        return json.loads(tail[tail.rfind(b"\n", 0, cut) + 1:cut])
+
+
+@app.cli.command("export-data")
+@click.option("--email", help="Export one user")
+@click.option("--group", "group_id", help="Export every user of a group_id cohort")
+@click.option("--format", "fmt", type=click.Choice(sorted(EXPORT_FORMATS)), default="ndjson", show_default=True)
+@click.option("--output", type=click.Path(dir_okay=False), required=True)
+@click.option("--resume", is_flag=True, help="NDJSON: continue a partial file after its last complete record")
+def export_data_command(email, group_id, fmt, output, resume):
+    """Write a user's or a group's data export to a file."""
+    if bool(email) == bool(group_id):
+        raise click.ClickException("pass exactly one of --email or --group")
+    where = User.email == email.strip().lower() if email else User.group_id == group_id
+    after = None
+    if resume and os.path.exists(output):
+        if fmt != "ndjson":
+            raise click.ClickException("--resume only works with --format ndjson")
+        last = ndjson_resume_point(output)
+        if last and last["type"] == "end":
+            click.echo(f"✅ {output} is already complete")
+            return
+        after = decode_cursor(last["cursor"], size=3) if last else None
+
+    summary = {}
+
+    def tap(records):
+        for record in records:
+            if record["type"] == "end":
+                summary.update(record)
+            yield record
+
+    started = time.perf_counter()
+    records = tap(export_records(where, after))
+    with open(output, "ab" if after else "wb") as f:
+        for chunk in export_zip(records) if fmt == "zip" else (export_line(r) for r in records):
+            f.write(chunk)
+    click.echo(f"✅ Exported {summary.get('users', 0)} users and {summary.get('sessions', 0)} sessions "
+               f"to {output} in {time.perf_counter() - started:.1f}s" + (" (resumed)" if after else ""))
+
+
+# ========================================================================
+# PURGE + RETENTION
+# ========================================================================
+# Users and sessions are deleted through purge_sessions()/purge_users(), which
+# remove at most PURGE_CHUNK sessions or users per transaction and pause
+# PURGE_PAUSE_MS between chunks, so a departing cohort or a retention sweep
+# never holds SQLite's write lock for long. A user's sessions go before the
+# user row, so an interrupted purge leaves no orphans and finishes on the next
+# run. Archive and search rows follow their session through the delete
+# triggers. Retention policies run daily; each returns the WHERE clause of the
+# sessions it expires, or None when it is switched off (0 days).
+PURGE_CHUNK = int(os.getenv("PURGE_CHUNK", "500"))
+PURGE_PAUSE = int(os.getenv("PURGE_PAUSE_MS", "50")) / 1000
+PURGE_MAX_PER_RUN = 50000   # sessions per policy per run; the next run continues
+RETENTION_TRIAL_DAYS = int(os.getenv("RETENTION_TRIAL_DAYS", "30"))
+
+
+def trial_sessions_policy(now):
+    """Trial chats/calls idle for RETENTION_TRIAL_DAYS."""
+    if not RETENTION_TRIAL_DAYS:
+        return None
+    return and_(UserSession.kind.in_(TRIAL_SESSION_KINDS),
+                UserSession.updated_at < now - timedelta(days=RETENTION_TRIAL_DAYS))
+
+
+RETENTION_POLICIES = {
+    "trial_sessions": trial_sessions_policy,
+}
+
+
+def purge_sessions(where, limit=None, reason=""):
+    """Delete the sessions matching `where` in chunks; returns how many were removed."""
+    removed = 0
+    while limit is None or removed < limit:
+        size = PURGE_CHUNK if limit is None else min(PURGE_CHUNK, limit - removed)
+        ids = db.session.execute(db.select(UserSession.id).where(where).limit(size)).scalars().all()
+        if not ids:
+            break
+        db.session.execute(db.delete(UserSession).where(UserSession.id.in_(ids)))
+        record_stat("sessions_purged", len(ids), reason)
+        db.session.commit()
+        removed += len(ids)
+        if len(ids) < size:
+            break
+        time.sleep(PURGE_PAUSE)
+    return removed
+
+
+def purge_users(ids, reason="admin"):
+    """Delete users with their sessions and cached checkouts, chunk by chunk.
+
+    The primary admin is never deleted. Returns {"users", "sessions", "seconds"}.
+    """
+    started = time.perf_counter()
+    ids = list(ids)
+    users = sessions = 0
+    for start in range(0, len(ids), PURGE_CHUNK):
+        rows = db.session.execute(
+            db.select(User.id, User.email)
+            .where(User.id.in_(ids[start:start + PURGE_CHUNK]), User.email != PRIMARY_ADMIN_EMAIL)
+        ).all()
+        if not rows:
+            continue
+        chunk = [user_id for user_id, _ in rows]
+        sessions += purge_sessions(UserSession.user_id.in_(chunk), reason=reason)
+        db.session.execute(db.delete(CheckoutSessionCache)
+                           .where(CheckoutSessionCache.email.in_([email for _, email in rows])))
+        db.session.execute(db.delete(User).where(User.id.in_(chunk)))
+        record_stat("users_purged", len(chunk), reason)
+        db.session.commit()
+        users += len(chunk)
+        time.sleep(PURGE_PAUSE)
+    seconds = time.perf_counter() - started
+    if users:
+        app.logger.info(f"🗑️ Purged {users} users and {sessions} sessions in {seconds:.1f}s ({reason})")
+    return {"users": users, "sessions": sessions, "seconds": round(seconds, 3)}
+
+
+def run_retention(policies=None, limit=PURGE_MAX_PER_RUN):
+    """Apply retention policies; returns {policy: {"sessions", "seconds"}} for the ones that are on."""
+    now = datetime.utcnow()
+    report = {}
+    for name in policies or RETENTION_POLICIES:
+        where = RETENTION_POLICIES[name](now)
+        if where is None:
+            continue
+        started = time.perf_counter()
+        removed = purge_sessions(where, limit, reason=name)
+        report[name] = {"sessions": removed, "seconds": round(time.perf_counter() - started, 3)}
+        app.logger.info(f"🧹 Retention {name}: {removed} sessions in {report[name]['seconds']:.1f}s")
+    return report
+
+
+@job_handler("retention_purge", every=24 * 3600)
+def retention_purge_job(payload):
+    run_retention()
+
+
+@app.cli.command("retention")
+@click.option("--policy", "policies", multiple=True, type=click.Choice(sorted(RETENTION_POLICIES)),
+              help="Run only these policies (default: all)")
+@click.option("--dry-run", is_flag=True, help="Count what would be deleted")
+def retention_command(policies, dry_run):
+    """Apply the session retention policies now (the worker also runs them daily)."""
+    if dry_run:
+        now = datetime.utcnow()
+        for name in policies or RETENTION_POLICIES:
+            where = RETENTION_POLICIES[name](now)
+            count = db.session.execute(db.select(db.func.count()).select_from(UserSession).where(where)).scalar() \
+                if where is not None else 0
+            click.echo(f"{name}: {count} sessions ({RETENTION_POLICIES[name].__doc__})")
+        return
+    for name, result in run_retention(policies).items():
+        click.echo(f"✅ {name}: {result['sessions']} sessions in {result['seconds']:.1f}s")
+
+
+@app.cli.command("purge-users")
+@click.option("--email", help="Purge one user")
+@click.option("--group", "group_id", help="Purge every user of a group_id cohort")
+@click.option("--yes", is_flag=True, help="Don't ask for confirmation")
+def purge_users_command(email, group_id, yes):
+    """Delete users and all their sessions in throttled chunks."""
+    if bool(email) == bool(group_id):
+        raise click.ClickException("pass exactly one of --email or --group")
+    where = User.email == email.strip().lower() if email else User.group_id == group_id
+    count = db.session.execute(db.select(db.func.count()).select_from(User).where(where)).scalar()
+    if not count:
+        raise click.ClickException("no matching users")
+    if not yes:
+        click.confirm(f"Delete {count} users and all their sessions?", abort=True)
+
+    total = {"users": 0, "sessions": 0, "seconds": 0.0}
+    last_id = 0
+    while True:
+        ids = db.session.execute(db.select(User.id).where(where, User.id > last_id)
+                                 .order_by(User.id).limit(PURGE_CHUNK)).scalars().all()
+        if not ids:
+            break
+        for key, value in purge_users(ids, reason="cli").items():
+            total[key] += value
+        last_id = ids[-1]
+    click.echo(f"✅ Purged {total['users']} users and {total['sessions']} sessions in {total['seconds']:.1f}s")
+
+
 #======================================================
 # TERMS & Privacy
 #======================================================
 
 @app.route("/terms")
 def terms():
-    return render_template("terms.html")
+    return render_cached("terms.html")
 
 @app.route("/privacy")
 def privacy():
-    return render_template("privacy.html")
+    return render_cached("privacy.html")
 
 
 #=================================
@@ -1637,23 +5164,27 @@ def payment_success():
 
     # ✅ Retrieve checkout session from Stripe
     checkout_session = stripe.checkout.Session.retrieve(session_id)
+    forget_checkout_session(session_id)
     email = checkout_session.customer_email
     customer_id = checkout_session.customer
 
     # ✅ Create or update user
     user = User.query.filter_by(email=email).first()
     if not user:
-        # Temporary random password (user can reset later)
-        random_pw = os.urandom(12).hex()
-        user = User(email=email, stripe_customer_id=customer_id)
-        user.set_password(random_pw)
+        # No password yet (user can reset later)
+        user = User(email=email, stripe_customer_id=customer_id, password_hash=UNUSABLE_PASSWORD)
         user.is_subscribed = True
         db.session.add(user)
+        record_stat("signups", 1, "stripe")
+        if session.pop("trial_used", False):
+            record_stat("trial_conversions")
         db.session.commit()
         flash("Account created. Please reset your password from login.", "success")
     else:
         user.is_subscribed = True
         user.stripe_customer_id = customer_id
+        if session.pop("trial_used", False):
+            record_stat("trial_conversions")
         db.session.commit()
         flash("Subscription active. You can log in now.", "success")
 
@@ -1684,20 +5215,38 @@ def stripe_webhook():
         app.logger.error(f"❌ Webhook error: {e}")
         return str(e), 400
 
+    app.logger.info(f"📩 Stripe Event Received: {event['type']}")
+
+    # Record in the ledger and acknowledge; the worker applies the change
+    if not record_stripe_event(json.loads(payload)):
+        app.logger.info(f"↩️ Duplicate Stripe event {event['id']} ignored")
+    return "success", 200
+
+
+STRIPE_HANDLED_EVENTS = [
+    "checkout.session.completed",
+    "invoice.paid",
+    "invoice.payment_failed",
+    "customer.subscription.deleted",
+]
+
+
+def process_stripe_event(event):
     event_type = event["type"]
-    app.logger.info(f"📩 Stripe Event Received: {event_type}")
 
     # === Checkout Completed (new subscription or renewal) ===
     if event_type == "checkout.session.completed":
         session_data = event["data"]["object"]
         email = session_data.get("customer_email") or (session_data.get("customer_details") or {}).get("email")
         customer_id = session_data.get("customer")
+        forget_checkout_session(session_data.get("id"))
 
         if email:
             user = User.query.filter_by(email=email.lower()).first()
             if user:
                 user.is_subscribed = True
                 user.stripe_customer_id = customer_id
+                record_stat("subscriptions_started")
                 db.session.commit()
                 app.logger.info(f"🎉 Subscription activated for {email}")
 
@@ -1710,6 +5259,7 @@ def stripe_webhook():
             user = User.query.filter_by(email=email.lower()).first()
             if user:
                 user.is_subscribed = True
+                record_stat("subscriptions_renewed")
                 db.session.commit()
                 app.logger.info(f"✅ Subscription renewed for {email}")
 
@@ -1722,8 +5272,10 @@ def stripe_webhook():
             user = User.query.filter_by(email=email.lower()).first()
             if user:
                 user.is_subscribed = False
+                record_stat("subscriptions_frozen")
                 db.session.commit()
                 app.logger.warning(f"⚠️ Subscription frozen for {email}")
+                precreate_checkout(user.email)
 
     # === Subscription Canceled ===
     elif event_type == "customer.subscription.deleted":
@@ -1733,27 +5285,208 @@ def stripe_webhook():
         user = User.query.filter_by(stripe_customer_id=customer_id).first()
         if user:
             user.is_subscribed = False
+            record_stat("subscriptions_canceled")
             db.session.commit()
             app.logger.warning(f"❌ Subscription canceled for {user.email}")
+            precreate_checkout(user.email)
+
+
+# ---- Checkout pre-creation ----
+# Frozen users land on checkout at their next login; have the session ready.
+def precreate_checkout(email, purpose="reactivate"):
+    enqueue("precreate_checkout", {"email": email, "purpose": purpose},
+            dedupe_key=f"checkout:{purpose}:{email.lower()}")
+
+
+@job_handler("precreate_checkout")
+def precreate_checkout_job(payload):
+    get_checkout_session(payload["email"], payload["purpose"])
+
+
+@job_handler("prune_checkout_sessions", every=3600)
+def prune_checkout_sessions_job(payload):
+    CheckoutSessionCache.query.filter(CheckoutSessionCache.expires_at < datetime.utcnow()).delete()
+    db.session.commit()
+
+
+# ---- Stripe event ledger ----
+# Every verified event is stored once, keyed by its Stripe id, so retries are
+# no-ops. Events are applied by the worker in `created` order per customer.
+STRIPE_EVENT_MAX_ATTEMPTS = 5
+STRIPE_SWEEP_AFTER = 120   # seconds before a still-unprocessed event is re-queued
+
+
+def stripe_customer_key(event):
+    obj = (event.get("data") or {}).get("object") or {}
+    if obj.get("customer"):
+        return f"cus:{obj['customer']}"
+    email = obj.get("customer_email") or (obj.get("customer_details") or {}).get("email")
+    if email:
+        return f"email:{email.lower()}"
+    return "none"
+
+
+def record_stripe_event(event, enqueue_processing=True):
+    """Insert `event` into the ledger. Returns False if it was already recorded."""
+    row = StripeEvent(
+        id=event["id"],
+        type=event["type"],
+        customer_key=stripe_customer_key(event),
+        stripe_created=event.get("created") or 0,
+        payload=event,
+    )
+    db.session.add(row)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    if enqueue_processing:
+        enqueue_customer_events(row.customer_key)
+    return True
+
+
+def enqueue_customer_events(customer_key):
+    enqueue("stripe_customer_events", {"customer_key": customer_key},
+            dedupe_key=f"stripe-customer:{customer_key}")
 
-    return "success", 200
+
+def process_customer_events(customer_key):
+    """Apply every pending ledger event for one customer, oldest first."""
+    processed = 0
+    while True:
+        events = StripeEvent.query.filter_by(customer_key=customer_key, status="received")\
+            .order_by(StripeEvent.stripe_created, StripeEvent.received_at).limit(100).all()
+        if not events:
+            return processed
+
+        for ev in events:
+            try:
+                process_stripe_event(ev.payload)
+            except Exception as e:
+                db.session.rollback()
+                ev = db.session.get(StripeEvent, ev.id)
+                ev.attempts += 1
+                ev.error = f"{type(e).__name__}: {e}"[:2000]
+                if ev.attempts >= STRIPE_EVENT_MAX_ATTEMPTS:
+                    ev.status = "failed"   # stop blocking later events; replay with `flask stripe-replay`
+                    db.session.commit()
+                    app.logger.error(f"❌ Stripe event {ev.id} failed permanently: {e}")
+                    continue
+                db.session.commit()
+                raise  # retry the job; later events for this customer wait
+
+            ev.status = "processed"
+            ev.attempts += 1
+            ev.error = None
+            ev.processed_at = datetime.utcnow()
+            db.session.commit()
+            processed += 1
+
+
+@job_handler("stripe_customer_events")
+def stripe_customer_events_job(payload):
+    process_customer_events(payload["customer_key"])
+
+
+@job_handler("stripe_sweep", every=60)
+def stripe_sweep_job(payload):
+    # Safety net for events recorded while their customer's job was finishing
+    cutoff = datetime.utcnow() - timedelta(seconds=STRIPE_SWEEP_AFTER)
+    keys = db.session.query(StripeEvent.customer_key).filter(
+        StripeEvent.status == "received",
+        StripeEvent.received_at < cutoff
+    ).distinct().all()
+    for (key,) in keys:
+        enqueue_customer_events(key)
+
+
+@app.cli.command("stripe-events")
+@click.option("--limit", default=20, show_default=True)
+def stripe_events_command(limit):
+    """Show ledger counts and the most recent events."""
+    for status, count in db.session.query(StripeEvent.status, db.func.count(StripeEvent.id))\
+            .group_by(StripeEvent.status).all():
+        click.echo(f"{status:<10} {count}")
+    click.echo("")
+    for ev in StripeEvent.query.order_by(StripeEvent.received_at.desc()).limit(limit).all():
+        click.echo(f"{ev.received_at:%Y-%m-%d %H:%M:%S} {ev.id} {ev.type:<32} {ev.status:<9} {ev.error or ''}")
+
+
+@app.cli.command("stripe-replay")
+@click.argument("event_ids", nargs=-1)
+@click.option("--status", "statuses", multiple=True, help="Replay every event in this status (e.g. failed).")
+@click.option("--since", type=click.DateTime(), default=None, help="Only events received since this date.")
+@click.option("--sync", is_flag=True, help="Process in this process instead of queueing.")
+def stripe_replay_command(event_ids, statuses, since, sync):
+    """Reset ledger events to 'received' and re-apply them."""
+    query = StripeEvent.query
+    if event_ids:
+        query = query.filter(StripeEvent.id.in_(event_ids))
+    if statuses:
+        query = query.filter(StripeEvent.status.in_(statuses))
+    if since:
+        query = query.filter(StripeEvent.received_at >= since)
+    if not (event_ids or statuses or since):
+        raise click.UsageError("Pass event ids, --status or --since.")
+
+    keys = set()
+    for ev in query.all():
+        ev.status = "received"
+        ev.attempts = 0
+        ev.error = None
+        keys.add(ev.customer_key)
+    db.session.commit()
+
+    for key in keys:
+        if sync:
+            process_customer_events(key)
+        else:
+            enqueue_customer_events(key)
+    click.echo(f"Replaying events for {len(keys)} customers")
+
+
+@app.cli.command("stripe-backfill")
+@click.option("--days", default=3, show_default=True, help="How far back to list events from Stripe.")
+@click.option("--sync", is_flag=True, help="Process in this process instead of queueing.")
+def stripe_backfill_command(days, sync):
+    """Pull recent events from the Stripe API and record any the webhook missed."""
+    since = int(time.time()) - days * 86400
+    events = stripe.Event.list(created={"gte": since}, types=STRIPE_HANDLED_EVENTS, limit=100)
+    added = 0
+    for event in events.auto_paging_iter():
+        if record_stripe_event(event.to_dict_recursive(), enqueue_processing=not sync):
+            added += 1
+    if sync:
+        keys = db.session.query(StripeEvent.customer_key).filter_by(status="received").distinct().all()
+        for (key,) in keys:
+            process_customer_events(key)
+    click.echo(f"Recorded {added} missing events")
+
+
+@app.cli.command("stripe-ingest")
+@click.argument("paths", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option("--sync", is_flag=True, help="Process in this process instead of queueing.")
+def stripe_ingest_command(paths, sync):
+    """Record events from JSON files (recorded fixtures or `stripe events retrieve` output)."""
+    keys = set()
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        for event in (data if isinstance(data, list) else [data]):
+            if record_stripe_event(event, enqueue_processing=not sync):
+                keys.add(stripe_customer_key(event))
+    if sync:
+        for key in keys:
+            process_customer_events(key)
+    click.echo(f"Recorded events for {len(keys)} customers")
 
 
 @app.route("/renew_subscription")
 @login_required
 def renew_subscription():
     try:
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=["card"],
-            mode="subscription",
-            line_items=[{
-                "price": "price_1S3oun9Z2P6yYsthvQydpeEN",  # your live price ID
-                "quantity": 1,
-            }],
-            customer_email=current_user.email,
-            success_url="https://theralinkapp.com/reactivation_success?session_id={CHECKOUT_SESSION_ID}",
-            cancel_url="https://theralinkapp.com/payment_failed",
-        )
+        checkout_session = get_checkout_session(current_user.email, "reactivate")
         return redirect(checkout_session.url, code=303)
     except Exception as e:
         app.logger.error(f"❌ Stripe renew error: {e}")
@@ -1811,6 +5544,23 @@ def cancel_subscription():
 # ==========================
 # ADMIN PAGE
 # ==========================
+# The page only renders the forms; the user table is filled from
+# /admin/api/users, which pages with a keyset cursor over (sort column, email)
+# so each page is one index range however large the user table grows.
+ADMIN_PAGE_SIZE = 50
+ADMIN_PAGE_MAX = 200
+ADMIN_BULK_MAX = 500   # ids per request / per chunk of an "all matching" job
+# sort key -> (column, tie-breaker); nullable columns sort NULLs first
+ADMIN_SORT_COLUMNS = {
+    "email": (User.email, None),
+    "id": (User.id, None),
+    "group": (User.group_id, User.email),
+    "type": (User.subscription_type, User.email),
+}
+ADMIN_BULK_ACTIONS = ("deactivate", "delete", "grant_free")
+ADMIN_ANALYTICS_DAYS = 14
+
+
 @app.route("/admin")
 @login_required
 def admin_page():
@@ -1818,13 +5568,190 @@ def admin_page():
         flash("You are not authorized to view this page.", "error")
         return redirect(url_for("dashboard"))
 
-    users = User.query.all()
-    return render_template("admin.html", users=users)
+    imports = GroupImport.query.order_by(GroupImport.id.desc()).limit(5).all()
+    summary = analytics_summary(ADMIN_ANALYTICS_DAYS)
+    return render_template("admin.html", imports=imports, page_size=ADMIN_PAGE_SIZE,
+                           analytics=analytics_table(summary), analytics_totals=summary["totals"])
+
+
+@app.route("/admin/analytics")
+@login_required
+@admin_required
+def admin_analytics():
+    """Daily series per metric and dimension; ?days= (default 30)."""
+    summary = analytics_summary(request.args.get("days", 30, type=int))
+    summary["descriptions"] = ANALYTICS_METRICS
+    return jsonify(summary)
+
+
+def admin_user_filters(args):
+    """WHERE clauses for the admin search: email prefix (`q`), exact `group` and `type`."""
+    clauses = [User.email != PRIMARY_ADMIN_EMAIL]
+    prefix = (args.get("q") or "").strip().lower()
+    if prefix:
+        # A range rather than LIKE, so both SQLite and Postgres use the email index
+        clauses += [User.email >= prefix, User.email < prefix + "\U0010ffff"]
+    if args.get("group"):
+        clauses.append(User.group_id == args["group"].strip())
+    if args.get("type"):
+        clauses.append(User.subscription_type == args["type"].strip())
+    return clauses
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, size=2):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != size:
+            raise ValueError(cursor)
+        return values
+    except (ValueError, binascii.Error):
+        abort(400)
+
+
+def admin_user_segments(sort, descending, cursor):
+    """(where, order_by) pairs that together list the rows after `cursor`, in order.
+
+    NULLs of a nullable sort column are their own segment, so every query stays an
+    index range instead of an OR the planner can only satisfy by walking the index.
+    """
+    column, tie = ADMIN_SORT_COLUMNS[sort]
+    if tie is None:
+        order = [column.desc() if descending else column.asc()]
+        if cursor is None:
+            return [(None, order)]
+        return [(column < cursor[0] if descending else column > cursor[0], order)]
+
+    value, last = cursor if cursor else (None, None)
+    if descending:
+        values_order = [column.desc(), tie.desc()]
+        nulls_order = [tie.desc()]
+        if cursor is None:
+            return [(column.isnot(None), values_order), (column.is_(None), nulls_order)]
+        if value is None:
+            return [(and_(column.is_(None), tie < last), nulls_order)]
+        return [(tuple_(column, tie) < tuple_(value, last), values_order), (column.is_(None), nulls_order)]
+
+    values_order = [column.asc(), tie.asc()]
+    nulls_order = [tie.asc()]
+    if cursor is None:
+        return [(column.is_(None), nulls_order), (column.isnot(None), values_order)]
+    if value is None:
+        return [(and_(column.is_(None), tie > last), nulls_order), (column.isnot(None), values_order)]
+    return [(tuple_(column, tie) > tuple_(value, last), values_order)]
+
+
+def admin_user_row(user):
+    return {
+        "id": user.id,
+        "email": user.email,
+        "group_id": user.group_id,
+        "subscription_type": user.subscription_type,
+        "status": "Active" if user.is_subscribed else "Pending",
+    }
+
+
+@app.route("/admin/api/users")
+@login_required
+@admin_required
+def admin_users_api():
+    sort = request.args.get("sort", "email")
+    if sort not in ADMIN_SORT_COLUMNS:
+        return jsonify({"success": False, "message": f"Unknown sort column: {sort}"}), 400
+    descending = request.args.get("dir") == "desc"
+    limit = min(max(request.args.get("limit", ADMIN_PAGE_SIZE, type=int), 1), ADMIN_PAGE_MAX)
+    cursor = decode_cursor(request.args["cursor"]) if request.args.get("cursor") else None
+
+    filters = admin_user_filters(request.args)
+    users = []
+    for where, order in admin_user_segments(sort, descending, cursor):
+        query = User.query.filter(*filters)
+        if where is not None:
+            query = query.filter(where)
+        users += query.order_by(*order).limit(limit + 1 - len(users)).all()
+        if len(users) > limit:
+            break
+
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        column, tie = ADMIN_SORT_COLUMNS[sort]
+        last = users[-1]
+        next_cursor = encode_cursor([getattr(last, column.key), getattr(last, tie.key) if tie is not None else None])
+    return jsonify({"success": True, "users": [admin_user_row(u) for u in users], "next_cursor": next_cursor})
+
+
+def apply_admin_bulk(action, ids, link_template):
+    """Run one bulk action over `ids` as set-based statements; returns the number of users changed."""
+    rows = db.session.query(User.id, User.email)\
+        .filter(User.id.in_(ids), User.email != PRIMARY_ADMIN_EMAIL).all()
+    ids = [user_id for user_id, _ in rows]
+    if not ids:
+        return 0
+
+    if action == "deactivate":
+        db.session.execute(db.update(User).where(User.id.in_(ids)).values(is_subscribed=False))
+    elif action == "delete":
+        purge_users(ids)   # chunked; commits as it goes
+    elif action == "grant_free":
+        db.session.execute(db.update(User).where(User.id.in_(ids))
+                           .values(is_subscribed=True, subscription_type="free"))
+        for _, email in rows:
+            link = link_template.replace("__TOKEN__", generate_setup_token(email))
+            subject, body, html = free_access_email(email, link)
+            enqueue_email(email, subject, body, html=html, commit=False)
+    db.session.commit()
+
+    if action == "grant_free":
+        kick_outbox()
+    app.logger.info(f"🛠️ Admin bulk {action}: {len(ids)} users")
+    return len(ids)
+
+
+@app.route("/admin/api/users/bulk", methods=["POST"])
+@login_required
+@admin_required
+def admin_users_bulk():
+    data = request.get_json(silent=True) or {}
+    action = data.get("action")
+    if action not in ADMIN_BULK_ACTIONS:
+        return jsonify({"success": False, "message": "Unknown action"}), 400
+    link_template = url_for("set_password", token="__TOKEN__", _external=True)
+
+    if data.get("all"):
+        # Every user matching the search; may be a whole university, so it runs in the worker
+        filters = {k: v for k, v in (data.get("filters") or {}).items() if k in ("q", "group", "type") and v}
+        enqueue("admin_bulk_users", {"action": action, "filters": filters, "link_template": link_template})
+        return jsonify({"success": True, "queued": True})
+
+    try:
+        ids = [int(i) for i in data.get("ids") or []]
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "ids must be integers"}), 400
+    if not ids or len(ids) > ADMIN_BULK_MAX:
+        return jsonify({"success": False, "message": f"Select between 1 and {ADMIN_BULK_MAX} users"}), 400
+
+    return jsonify({"success": True, "count": apply_admin_bulk(action, ids, link_template)})
+
+
+@job_handler("admin_bulk_users")
+def admin_bulk_users_job(payload):
+    filters = admin_user_filters(payload.get("filters") or {})
+    last_id = 0
+    while True:
+        ids = [i for (i,) in db.session.query(User.id).filter(*filters, User.id > last_id)
+               .order_by(User.id).limit(ADMIN_BULK_MAX).all()]
+        if not ids:
+            return
+        apply_admin_bulk(payload["action"], ids, payload["link_template"])
+        last_id = ids[-1]
 
 
 @app.route("/create_admin")
 def create_admin():
-    from werkzeug.security import generate_password_hash
     existing = User.query.filter_by(email=os.getenv("ADMIN_EMAIL")).first()
     if existing:
         return "Admin user already exists!"
@@ -1832,7 +5759,7 @@ def create_admin():
     admin_password = os.getenv("ADMIN_PASSWORD")
     admin = User(
         email=os.getenv("ADMIN_EMAIL"),
-        password_hash=generate_password_hash(admin_password),
+        password_hash=hash_password(admin_password),
         is_subscribed=True,
         subscription_type="free"
     )
@@ -1851,6 +5778,8 @@ def admin_login():
 
         user = User.query.filter_by(email=email).first()
         if user and user.check_password(password) and user.email == os.getenv("ADMIN_EMAIL"):
+            if upgrade_password_hash(user, password):
+                db.session.commit()
             login_user(user)
             flash("Welcome, Admin!", "success")
             return redirect(url_for("admin_page"))  # goes to your admin.html
@@ -1883,7 +5812,11 @@ def set_password(token):
             return redirect(request.url)
 
         # Update password and activate user
-        user.set_password(password)
+        password_hash = hash_password(password)
+        if not consume_token(token, "setup"):
+            flash("⚠️ This setup link has already been used.", "error")
+            return redirect(url_for("login"))
+        user.password_hash = password_hash
         user.is_subscribed = True
         user.subscription_type = "free" if user.subscription_type == "pending" else user.subscription_type
         user.status = "Active"
@@ -1908,23 +5841,21 @@ def add_user():
     user = User.query.filter_by(email=email).first()
     if not user:
         # Create new user in PENDING state
-        user = User(email=email)
-        user.set_password(os.urandom(8).hex())  # temp password
+        user = User(email=email, password_hash=UNUSABLE_PASSWORD)  # set via the setup link
         user.is_subscribed = False
         user.subscription_type = "pending"
         user.status = "Pending"
         db.session.add(user)
+        record_stat("signups", 1, "admin")
         db.session.commit()
 
     # Generate setup link
     token = generate_setup_token(user.email)
     link = url_for("set_password", token=token, _external=True)
 
-    # Send setup email
-    msg = Message("TheraLink Free Access - Set Your Password",
-                  sender="support@theralinkapp.com",
-                  recipients=[user.email])
-    msg.body = f"""
+    # Queue setup email
+    subject = "TheraLink Free Access - Set Your Password"
+    body = f"""
 Hello,
 
 You've been granted access to TheraLink. Please set your password using the link below:
@@ -1936,7 +5867,7 @@ This link will expire in 1 hour.
 Best regards,
 TheraLink Support
 """
-    mail.send(msg)
+    enqueue_email(user.email, subject, body)
 
     flash(f"✅ Setup link sent to {user.email}", "success")
     return redirect(url_for("admin_page"))
@@ -1967,12 +5898,385 @@ def delete_user(user_id):
         flash("❌ You cannot delete the primary admin.", "error")
         return redirect(url_for("admin_page"))
 
-    db.session.delete(user)
-    db.session.commit()
+    email = user.email
+    purge_users([user.id])
 
-    flash(f"🗑️ {user.email} has been deleted", "info")
+    flash(f"🗑️ {email} has been deleted", "info")
     return redirect(url_for("admin_page"))
 
+# ========================================================================
+# QUERY PLAN AUDIT
+# ========================================================================
+# `flask explain-queries` seeds a scratch database at production scale, drives
+# the user, session, admin and webhook paths through the test client, records
+# every statement they issue and asks the planner about each one. A full table
+# scan fails the audit unless EXPLAIN_ALLOWED_SCANS says why it is fine; an
+# index that only covers part of the WHERE clause is reported as a warning.
+EXPLAIN_PASSWORD = "audit-password"
+EXPLAIN_ALLOWED_SCANS = {
+    r"GROUP BY (job|email_outbox|stripe_event)\.": "queue gauges; scraped, not per request",
+}
+
+
+def _seed_explain_db(users, sessions, batch=20000):
+    """Bulk-insert `users` users and `sessions` sessions spread evenly across them."""
+    password_hash = generate_password_hash(EXPLAIN_PASSWORD)
+    kinds = ("chat", "call", "trial_chat", "trial_call")
+    messages = [{"role": "user", "content": "hello"}, {"role": "assistant", "content": "hi"}]
+    for start in range(0, users, batch):
+        db.session.execute(User.__table__.insert(), [{
+            "email": f"user{i}@example.test",
+            "password_hash": password_hash,
+            "is_subscribed": i % 10 != 0,
+            "stripe_customer_id": f"cus_{i}" if i % 5 else None,
+            "subscription_type": "group" if i % 5 == 0 else "stripe",
+            "group_id": f"group-{i % 50}" if i % 5 == 0 else None,
+        } for i in range(start, min(start + batch, users))])
+        db.session.commit()
+    for start in range(0, sessions, batch):
+        db.session.execute(UserSession.__table__.insert(), [{
+            "user_id": i % users + 1,
+            "session_id": f"s{i}",
+            "name": "Session",
+            "messages": messages,
+            "kind": kinds[(i // users) % len(kinds)],
+        } for i in range(start, min(start + batch, sessions))])
+        db.session.commit()
+    db.session.add(User(email=PRIMARY_ADMIN_EMAIL, password_hash=password_hash,
+                        is_subscribed=True, subscription_type="free"))
+    db.session.commit()
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
+
+
+def _explain_workload(users):
+    """Hit every user/session/admin path once; yields a label before each step."""
+    probe = db.session.get(User, users // 2 + 2)   # subscribed, has a Stripe customer
+    admin = User.query.filter_by(email=PRIMARY_ADMIN_EMAIL).first()
+    probe_email, customer_id, admin_id = probe.email, probe.stripe_customer_id, admin.id
+    db.session.rollback()
+
+    def hit(client, method, path, **kwargs):
+        with app.app_context():   # fresh `g`, so Flask-Login doesn't reuse the previous user
+            return client.open(path, method=method, **kwargs)
+
+    client = app.test_client()
+    yield "login"
+    hit(client, "POST", "/login", data={"email": probe_email, "password": EXPLAIN_PASSWORD})
+    for path in ("/dashboard", "/session_status", "/sessions", "/sessions/chat", "/sessions/call"):
+        yield path
+        hit(client, "GET", path)
+    for step in ("create", "update"):
+        yield f"/sessions/save ({step})"
+        hit(client, "POST", "/sessions/save", json={"session_id": "audit", "kind": "chat", "name": "Audit",
+                                                   "messages": [{"role": "user", "content": step}]})
+    for query in ({"q": "hello"}, {"q": "hel", "kind": "chat"}, {"q": "hello", "page": 2}):
+        yield f"/sessions/search {query}"
+        hit(client, "GET", "/sessions/search", query_string=query)
+    yield "/account/export"
+    hit(client, "GET", "/account/export").get_data()
+    yield "/sessions/delete"
+    hit(client, "POST", "/sessions/delete", json={"session_id": "audit"})
+    yield "/reset-password"
+    hit(client, "POST", "/reset-password", data={"email": probe_email})
+    yield "/reset-password/<token>"
+    hit(client, "GET", f"/reset-password/{generate_reset_token(probe_email)}")
+
+    admin_client = app.test_client()
+    with admin_client.session_transaction() as s:
+        s["_user_id"] = str(admin_id)
+    yield "/admin"
+    hit(admin_client, "GET", "/admin")
+    yield "/admin/analytics"
+    hit(admin_client, "GET", "/admin/analytics", query_string={"days": 90})
+    for sort in ADMIN_SORT_COLUMNS:
+        for direction in ("asc", "desc"):
+            cursor = None
+            for page in (1, 2):
+                yield f"/admin/api/users ({sort} {direction} p{page})"
+                query = {"sort": sort, "dir": direction, **({"cursor": cursor} if cursor else {})}
+                cursor = hit(admin_client, "GET", "/admin/api/users", query_string=query).get_json()["next_cursor"]
+    for search in ({"q": "user12"}, {"group": "group-7"}, {"type": "group"}, {"group": "group-7", "sort": "type"}):
+        yield f"/admin/api/users {search}"
+        hit(admin_client, "GET", "/admin/api/users", query_string=search)
+    yield "/admin/api/users/bulk"
+    hit(admin_client, "POST", "/admin/api/users/bulk", json={"action": "deactivate", "ids": [3, 4, 5]})
+
+    event = {"id": "evt_audit", "type": "customer.subscription.deleted", "created": int(time.time()),
+             "data": {"object": {"customer": customer_id}}}
+    yield "webhook ledger"
+    record_stripe_event(event, enqueue_processing=False)
+    yield "customer.subscription.deleted"
+    process_customer_events(stripe_customer_key(event))
+    yield "job + outbox claim"
+    claim_job("explain-queries")
+    claim_outbox("explain-queries")
+    yield "archive idle sessions"
+    archive_cold_sessions(limit=SESSION_ARCHIVE_BATCH)
+    yield "retention policies"
+    run_retention()
+
+
+def _explain_statement(conn, statement, parameters):
+    """Planner output for one captured statement, one line per plan node."""
+    if conn.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+        return [row[-1] for row in rows]
+    return [row[0] for row in conn.exec_driver_sql("EXPLAIN " + statement, parameters).fetchall()]
+
+
+def _classify_plan(statement, plan):
+    """Return ("scan" | "partial" | "ok", table) for a plan from _explain_statement.
+
+    An index or the rowid walked in ORDER BY order under a LIMIT (keyset pages,
+    "newest N") is not a scan, nor is an FTS5 table answering a MATCH.
+    """
+    bounded = "LIMIT" in statement and not any("TEMP B-TREE" in line for line in plan)
+    for line in plan:
+        if re.match(r"SCAN \w+ VIRTUAL TABLE INDEX \d+:\S*M", line):
+            continue   # full-text index lookup (FTS5 idxStr "M" = MATCH constraint)
+        walk = re.match(r"SCAN (\w+)(?: USING (?:COVERING )?INDEX|$)", line)
+        if bounded and walk and (" USING " in line or re.search(rf"ORDER BY \"?{walk.group(1)}\"?\.id\b", statement)):
+            continue   # index (or rowid) walked in ORDER BY order, stopping at LIMIT
+        scan = re.match(r"\s*(?:->\s*)?(?:SCAN (?:TABLE )?|Seq Scan on )\"?(\w+)\"?(?! \(subquery)", line)
+        if scan and scan.group(1) not in ("CONSTANT", "subquery"):
+            return "scan", scan.group(1)
+        search = re.match(r"SEARCH (?:TABLE )?(\w+) USING (?:COVERING )?INDEX \w+ \((.+)\)", line)
+        if search:
+            table = search.group(1)
+            used = set(re.findall(r"(\w+)[=<>]", search.group(2)))
+            wanted = set(re.findall(rf"\"?{table}\"?\.(\w+) (?:= \?|IN \()", statement))
+            if wanted - used:
+                return "partial", table
+    return "ok", None
+
+
+@app.cli.command("explain-queries")
+@click.option("--users", default=100000, show_default=True)
+@click.option("--sessions", default=1000000, show_default=True)
+@click.option("--keep", is_flag=True, help="Keep the scratch database and print its path")
+def explain_queries_command(users, sessions, keep):
+    """EXPLAIN every statement the hot paths issue against a seeded scratch database; fail on full scans."""
+    if not os.environ.get(SCRATCH_DB_ENV):
+        if rerun_in_scratch_database(["explain-queries", "--users", str(users), "--sessions", str(sessions)], keep):
+            raise click.ClickException("query plan audit failed")
+        return
+
+    db.create_all()
+    started = time.perf_counter()
+    _seed_explain_db(users, sessions)
+    click.echo(f"seeded {users} users / {sessions} sessions in {time.perf_counter() - started:.0f}s")
+
+    captured = {}   # statement -> {"step", "params", "ms"}
+    step = {"label": "setup"}
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        conn.info["explain_started"] = time.perf_counter()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        ms = (time.perf_counter() - conn.info.pop("explain_started")) * 1000
+        if not re.match(r"\s*(SELECT|UPDATE|DELETE)\b", statement, re.I):
+            return
+        entry = captured.setdefault(statement, {"step": step["label"], "params": None, "ms": 0.0})
+        entry["params"] = parameters[0] if executemany else parameters
+        entry["ms"] = max(entry["ms"], ms)
+
+    db_event.listen(db.engine, "before_cursor_execute", capture)
+    db_event.listen(db.engine, "after_cursor_execute", record)
+    try:
+        for step["label"] in _explain_workload(users):
+            pass
+    finally:
+        db_event.remove(db.engine, "before_cursor_execute", capture)
+        db_event.remove(db.engine, "after_cursor_execute", record)
+        db.session.rollback()
+
+    failures = []
+    with db.engine.connect() as conn:
+        for statement, entry in captured.items():
+            plan = _explain_statement(conn, statement, entry["params"])
+            status, table = _classify_plan(statement, plan)
+            flat = " ".join(statement.split())
+            allowed = next((why for pattern, why in EXPLAIN_ALLOWED_SCANS.items()
+                            if re.search(pattern, flat)), None)
+            mark = {"ok": "✅", "partial": "⚠️ ", "scan": "❌"}[status]
+            if status == "scan" and allowed:
+                mark = "➖"
+            click.echo(f"{mark} {entry['ms']:8.2f} ms  [{entry['step']}] {flat[:110]}")
+            for line in plan:
+                click.echo(f"      {line}")
+            if status == "scan":
+                if allowed:
+                    click.echo(f"      allowed: {allowed}")
+                else:
+                    failures.append(f"[{entry['step']}] full scan of {table}: {flat[:160]}")
+            elif status == "partial":
+                click.echo(f"      index covers only part of the filter on {table}")
+
+    click.echo(f"{len(captured)} distinct statements, {len(failures)} unexpected full scans")
+    if failures:
+        for failure in failures:
+            click.echo(f"❌ {failure}", err=True)
+        raise click.ClickException("full table scans on hot paths")
+
+
+# ========================================================================
+# WARM-UP + HEALTH
+# ========================================================================
+# Before a worker takes traffic: compile every template, open a DB connection,
+# resolve ffmpeg once and (WARMUP_UPSTREAMS=1) open TLS connections to Groq and
+# Stripe. /healthz is liveness only; /readyz answers 503 until this process is
+# warm, so the load balancer only routes to warm instances.
+WARMUP_UPSTREAMS = os.getenv("WARMUP_UPSTREAMS", "0") == "1"
+WARMUP = {"ready": False, "checks": {}}
+_warmup_lock = threading.Lock()
+_ffmpeg_path = None
+
+
+def resolve_ffmpeg():
+    """Path to an ffmpeg binary (imageio-ffmpeg's bundled one, else $PATH); looked up once."""
+    global _ffmpeg_path
+    if _ffmpeg_path is None:
+        try:
+            import imageio_ffmpeg
+            _ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
+        except Exception:
+            _ffmpeg_path = shutil.which("ffmpeg") or ""
+    return _ffmpeg_path or None
+
+
+def _timed_check(name, fn, critical=True):
+    started = time.perf_counter()
+    try:
+        detail = fn()
+        result = {"ok": True}
+        if detail is not None:
+            result["detail"] = detail
+    except Exception as e:
+        result = {"ok": False, "error": str(e)[:200]}
+    result["ms"] = round((time.perf_counter() - started) * 1000, 1)
+    result["critical"] = critical
+    WARMUP["checks"][name] = result
+    return result
+
+
+def _compile_templates():
+    names = app.jinja_env.list_templates(extensions=["html"])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return f"{len(names)} templates"
+
+
+def _ping_database():
+    with app.app_context():
+        db.session.execute(db.text("SELECT 1"))
+        db.session.remove()
+
+
+def _resolve_ffmpeg_check():
+    path = resolve_ffmpeg()
+    if not path:
+        raise RuntimeError("ffmpeg not found")
+    return path
+
+
+def _open_groq():
+    client.models.list()
+
+
+def _open_stripe():
+    stripe.Balance.retrieve()
+
+
+def warm_up(connections=True):
+    """Prime cold paths. Templates and ffmpeg can run in the gunicorn master (shared
+    copy-on-write); connections are per process and run after fork."""
+    with _warmup_lock:
+        _timed_check("templates", _compile_templates)
+        _timed_check("ffmpeg", _resolve_ffmpeg_check, critical=False)
+        if connections:
+            _timed_check("database", _ping_database)
+            if WARMUP_UPSTREAMS:
+                _timed_check("groq", _open_groq, critical=False)
+                _timed_check("stripe", _open_stripe, critical=False)
+            WARMUP["ready"] = all(c["ok"] for c in WARMUP["checks"].values() if c["critical"])
+        for name, check in WARMUP["checks"].items():
+            if not check["ok"]:
+                app.logger.warning(f"⚠️ Warm-up {name} failed: {check['error']}")
+        app.logger.info(f"🔥 Warm-up done in {sum(c['ms'] for c in WARMUP['checks'].values()):.0f} ms")
+
+
+@app.route("/healthz")
+def healthz():
+    return jsonify({"status": "ok"})
+
+
+@app.route("/readyz")
+def readyz():
+    if "database" not in WARMUP["checks"]:
+        warm_up()  # e.g. started without the gunicorn hooks: the first probe warms this worker
+    else:
+        _timed_check("database", _ping_database)  # live latency on every probe
+    WARMUP["ready"] = all(c["ok"] for c in WARMUP["checks"].values() if c["critical"])
+    body = {"status": "ready" if WARMUP["ready"] else "unavailable", "pid": os.getpid(), "checks": WARMUP["checks"]}
+    return jsonify(body), 200 if WARMUP["ready"] else 503
+
+
+# ========================================================================
+# APP SETUP
+# ========================================================================
+# There is one module-level app: routes and extensions are registered on it at
+# import, and service clients are built lazily (see LAZY SERVICE CLIENTS).
+# gunicorn preloads `app:app` in the master and gunicorn.conf.py calls
+# init_app() there, so workers share the warmed app copy-on-write.
+IMPORT_BUDGET_MS = int(os.getenv("IMPORT_BUDGET_MS", "1000"))
+# Must not be imported by `import app` on the web path
+DEFERRED_MODULES = ("groq", "stripe", "authlib", "libretranslatepy", "langdetect", "whisper", "flask_mail", "alembic")
+
+
+def init_app(config=None, warm=True):
+    """Apply config overrides to the module-level app, warm it, and return it (not a factory).
+
+    Warms the fork-safe parts here (templates, ffmpeg); gunicorn.conf.py opens
+    connections in each worker.
+    """
+    if config:
+        app.config.update(config)
+    if warm and os.getenv("WARMUP", "1") != "0":
+        warm_up(connections=False)
+    return app
+
+
+@app.cli.command("import-budget")
+@click.option("--budget-ms", default=IMPORT_BUDGET_MS, show_default=True, type=int)
+@click.option("--runs", default=3, show_default=True, help="Fresh interpreters; the fastest run is compared")
+def import_budget_command(budget_ms, runs):
+    """Fail if a cold `import app` (as a web worker sees it) is over budget or pulls in deferred modules."""
+    import subprocess
+    probe = (
+        "import json, sys, time\n"
+        "t = time.perf_counter()\n"
+        "import app\n"
+        "ms = (time.perf_counter() - t) * 1000\n"
+        f"print(json.dumps({{'ms': ms, 'loaded': [m for m in {DEFERRED_MODULES!r} if m in sys.modules]}}))\n"
+    )
+    env = {k: v for k, v in os.environ.items() if k != "FLASK_RUN_FROM_CLI"}
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", probe], cwd=app.root_path, env=env,
+                             capture_output=True, text=True, check=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    best = min(r["ms"] for r in results)
+    loaded = sorted({m for r in results for m in r["loaded"]})
+    click.echo(f"import app: {best:.0f} ms (budget {budget_ms} ms, best of {runs})")
+    if loaded:
+        raise click.ClickException(f"deferred modules imported at startup: {', '.join(loaded)}")
+    if best > budget_ms:
+        raise click.ClickException(f"import took {best:.0f} ms, over the {budget_ms} ms budget")
+    click.echo("✅ within budget")
+
+
 # ========================================================================
 # RUN
 # ========================================================================
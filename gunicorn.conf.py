@@ -0,0 +1,37 @@
+# gunicorn settings for Render (picked up automatically from the working directory)
+# (bind and workers keep gunicorn's defaults: $PORT and $WEB_CONCURRENCY)
+import gc
+import shutil
+
+# Import the app once in the master; workers inherit it copy-on-write
+preload_app = True
+
+
+def on_starting(server):
+    from app import METRICS_DIR, init_app
+
+    # Snapshots from a previous run would be merged into /metrics. Files of workers
+    # that exit during this run stay, so merged counters never go backwards.
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+
+    # Warm the preloaded app (templates, ffmpeg) once, before workers fork
+    init_app()
+
+
+def pre_fork(server, worker):
+    # Keep the preloaded objects out of the collector's generations so GC passes
+    # in the workers don't touch (and un-share) their pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from app import app, db, client, lt, stripe, warm_up
+
+    # Connections opened in the master must not be shared across processes
+    with app.app_context():
+        db.engine.dispose()
+    for proxy in (client, lt, stripe):
+        proxy.reset()
+
+    # Open this worker's DB (and optionally upstream) connections before it accepts requests
+    warm_up(connections=True)
@@ -0,0 +1,553 @@
+"""
+End-to-end load test for TheraLink.
+
+Boots the app under gunicorn (plus the background worker) against local fake
+Groq, Stripe, LibreTranslate and SMTP servers with configurable latency and
+error injection, replays a weighted mix of traffic and reports throughput and
+p50/p95/p99 per route. Results are written to loadtest-results/ as JSON
+(tagged with the git commit) and compared with the previous run.
+
+    python loadtest.py --duration 60 --concurrency 32 --groq-ms 400 --error-rate 0.01
+    python loadtest.py --mix chat=5,sessions_list=3 --compare loadtest-results/<file>.json
+
+Nothing here talks to a real third party or touches instance/therapy.db.
+"""
+import argparse
+import hashlib
+import hmac
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import wave
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(ROOT, "loadtest-results")
+PASSWORD = "loadtest!1"
+WEBHOOK_SECRET = "whsec_loadtest"
+
+DEFAULT_MIX = {
+    "chat": 25,
+    "call": 20,
+    "transcribe": 10,
+    "sessions_save": 10,
+    "sessions_list": 10,
+    "landing": 8,
+    "trial_page": 5,
+    "trial_chat": 5,
+    "checkout": 3,
+    "webhook": 3,
+    "reset_request": 1,
+}
+
+CHAT_LINES = [
+    "I've been feeling overwhelmed at work lately.",
+    "I can't sleep well and my mind keeps racing.",
+    "My sister and I had an argument and I feel guilty.",
+    "Some days I just don't have the energy to do anything.",
+]
+
+
+# ========================================================================
+# FAKE UPSTREAMS
+# ========================================================================
+class Fault:
+    """Latency (uniform ms ± jitter) and error-rate injection shared by every fake."""
+
+    def __init__(self, latency_ms, error_rate, jitter=0.25):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.jitter = jitter
+
+    def apply(self):
+        """Sleep for the injected latency; True when this call should fail."""
+        if self.latency_ms:
+            spread = self.latency_ms * self.jitter
+            time.sleep(max(0.0, random.uniform(self.latency_ms - spread, self.latency_ms + spread)) / 1000)
+        return random.random() < self.error_rate
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fault = None
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        body = self._body()
+        if self.fault.apply():
+            return self._send(500, {"error": {"message": "injected failure", "type": "api_error"}})
+        return self._send(200, self.respond(body))
+
+    do_GET = do_POST = do_DELETE = _handle
+
+
+class FakeGroq(FakeHandler):
+    def respond(self, body):
+        if self.path.endswith("/audio/transcriptions"):
+            return {"text": random.choice(CHAT_LINES)}
+        if self.path.endswith("/models"):
+            return {"object": "list", "data": []}
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "llama-3.3-70b-versatile",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "That sounds hard. What feels heaviest right now?"},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 120, "completion_tokens": 14, "total_tokens": 134},
+        }
+
+
+class FakeStripe(FakeHandler):
+    def respond(self, body):
+        parts = [p for p in self.path.split("?")[0].split("/") if p and p != "v1"]
+        obj = parts[-1] if parts else "object"
+        if obj.startswith(("cs_", "cus_", "sub_", "in_", "evt_")):
+            obj_id, obj = obj, parts[-2]
+        else:
+            obj_id = f"{obj[:3]}_{uuid.uuid4().hex[:14]}"
+        return {
+            "id": obj_id,
+            "object": obj.rstrip("s").replace("checkout/", ""),
+            "url": f"http://127.0.0.1/checkout/{obj_id}",
+            "status": "open",
+            "expires_at": int(time.time()) + 3600,
+            "customer": "cus_load_0",
+            "livemode": False,
+        }
+
+
+class FakeTranslate(FakeHandler):
+    def respond(self, body):
+        try:
+            text = json.loads(body or b"{}").get("q", "")
+        except ValueError:
+            from urllib.parse import parse_qs
+            text = (parse_qs(body.decode()).get("q") or [""])[0]
+        return {"translatedText": text}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_fake(handler, fault):
+    server = ThreadingHTTPServer(("127.0.0.1", free_port()), type(handler.__name__, (handler,), {"fault": fault}))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def start_fake_smtp(fault):
+    """aiosmtpd (requirements-dev.txt) when available; otherwise mail goes to a closed port and fails."""
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        return None, free_port()
+
+    class Sink:
+        async def handle_DATA(self, server, session, envelope):
+            import asyncio
+            if fault.latency_ms:
+                await asyncio.sleep(fault.latency_ms / 1000)
+            if random.random() < fault.error_rate:
+                return "451 Injected failure"
+            return "250 OK"
+
+    controller = Controller(Sink(), hostname="127.0.0.1", port=free_port())
+    controller.start()
+    return controller, controller.port
+
+
+# ========================================================================
+# APP UNDER TEST
+# ========================================================================
+SEED = """
+from app import app, db, User
+from werkzeug.security import generate_password_hash
+with app.app_context():
+    db.create_all()
+    pw = generate_password_hash({password!r})
+    db.session.add_all([
+        User(email=f"load{{i}}@loadtest.invalid", password_hash=pw, is_subscribed=True,
+             stripe_customer_id=f"cus_load_{{i}}")
+        for i in range({users})
+    ])
+    db.session.commit()
+"""
+
+
+def app_env(args, workdir, groq, stripe_url, translate, smtp_port):
+    env = dict(os.environ)
+    env.pop("FLASK_RUN_FROM_CLI", None)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        "GROQ_API_KEY": "gsk_loadtest",
+        "GROQ_BASE_URL": groq,
+        "STRIPE_SECRET_KEY": "sk_test_loadtest",
+        "STRIPE_API_BASE": stripe_url,
+        "STRIPE_WEBHOOK_SECRET": WEBHOOK_SECRET,
+        "LIBRETRANSLATE_URL": translate + "/",
+        "MAIL_SERVER": "127.0.0.1",
+        "MAIL_PORT": str(smtp_port),
+        "MAIL_USE_SSL": "false",
+        "MAIL_USE_TLS": "false",
+        "MAIL_USERNAME": "",
+        "METRICS_DIR": os.path.join(workdir, "metrics"),
+        "LOG_LEVEL": "WARNING",
+        "WARMUP_UPSTREAMS": "0",
+        "SECRET_KEY": "loadtest",
+    })
+    return env
+
+
+def start_app(args, env, workdir, port):
+    logs = open(os.path.join(workdir, "server.log"), "w")
+    if shutil.which("gunicorn"):
+        cmd = ["gunicorn", "app:app", "-w", str(args.workers), "-b", f"127.0.0.1:{port}",
+               "--threads", str(args.threads)]
+    else:
+        print("gunicorn not found; using the Flask dev server (numbers are not representative)")
+        cmd = [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port), "--with-threads"]
+    procs = [subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=logs, stderr=subprocess.STDOUT)]
+    if args.worker:
+        procs.append(subprocess.Popen([sys.executable, "-m", "flask", "--app", "app", "worker", "--poll-interval", "0.2"],
+                                      cwd=ROOT, env=env, stdout=logs, stderr=subprocess.STDOUT))
+
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if requests.get(base + "/readyz", timeout=2).status_code == 200:
+                return procs, base
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    stop_procs(procs)
+    raise SystemExit(f"App did not become ready; see {logs.name}")
+
+
+def stop_procs(procs):
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        try:
+            p.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            p.kill()
+
+
+# ========================================================================
+# TRAFFIC
+# ========================================================================
+def silent_wav(seconds=1.0, rate=16000):
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\x00\x00" * int(seconds * rate))
+    return buf.getvalue()
+
+
+WAV = silent_wav()
+
+
+def signed_webhook(customer):
+    event = {
+        "id": f"evt_{uuid.uuid4().hex[:20]}",
+        "object": "event",
+        "type": "invoice.paid",
+        "created": int(time.time()),
+        "data": {"object": {"object": "invoice", "id": f"in_{uuid.uuid4().hex[:14]}", "customer": customer}},
+    }
+    payload = json.dumps(event)
+    ts = int(time.time())
+    sig = hmac.new(WEBHOOK_SECRET.encode(), f"{ts}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return payload, {"Stripe-Signature": f"t={ts},v1={sig}", "Content-Type": "application/json"}
+
+
+class VirtualUser:
+    def __init__(self, base, index):
+        self.base = base
+        self.index = index
+        self.email = f"load{index}@loadtest.invalid"
+        self.http = requests.Session()
+        self.anon = requests.Session()
+        self.session_id = f"load-{index}-{uuid.uuid4().hex[:8]}"
+        self.messages = []
+
+    def login(self):
+        r = self.http.post(self.base + "/login", data={"email": self.email, "password": PASSWORD},
+                           allow_redirects=False, timeout=30)
+        if r.status_code != 302 or "dashboard" not in r.headers.get("Location", ""):
+            raise SystemExit(f"Login failed for {self.email}: {r.status_code}")
+
+    def fresh_anon(self):
+        self.anon.cookies.clear()
+        return self.anon
+
+    # Each scenario returns the response; the route label is the scenario name
+    def chat(self):
+        lang = "es" if random.random() < 0.2 else "en"
+        return self.http.post(self.base + "/chat", json={
+            "user_id": str(self.index), "session_id": self.session_id,
+            "message": random.choice(CHAT_LINES), "language": lang})
+
+    def call(self):
+        return self.http.post(self.base + "/call", json={
+            "user_id": str(self.index), "session_id": self.session_id, "message": random.choice(CHAT_LINES)})
+
+    def transcribe(self):
+        return self.http.post(self.base + "/transcribe", files={"audio": ("clip.wav", WAV, "audio/wav")})
+
+    def sessions_save(self):
+        self.messages = (self.messages + [
+            {"role": "user", "content": random.choice(CHAT_LINES)},
+            {"role": "assistant", "content": "What feels heaviest right now?"},
+        ])[-60:]
+        return self.http.post(self.base + "/sessions/save", json={
+            "session_id": self.session_id, "kind": "chat", "name": "Load test", "messages": self.messages})
+
+    def sessions_list(self):
+        return self.http.get(self.base + "/sessions/chat")
+
+    def landing(self):
+        return self.fresh_anon().get(self.base + "/")
+
+    def trial_page(self):
+        return self.fresh_anon().get(self.base + "/trial_chat")
+
+    def trial_chat(self):
+        return self.fresh_anon().post(self.base + "/trial_chat_message", json={"message": random.choice(CHAT_LINES)})
+
+    def checkout(self):
+        return self.http.post(self.base + "/create-checkout-session")
+
+    def webhook(self):
+        payload, headers = signed_webhook(f"cus_load_{self.index}")
+        return self.fresh_anon().post(self.base + "/webhook", data=payload, headers=headers)
+
+    def reset_request(self):
+        return self.fresh_anon().post(self.base + "/reset-password", data={"email": self.email}, allow_redirects=False)
+
+
+def run_load(base, args, mix):
+    names, weights = zip(*mix.items())
+    results = {name: [] for name in names}   # (latency seconds, ok)
+    lock = threading.Lock()
+    users = [VirtualUser(base, i) for i in range(args.concurrency)]
+    for vu in users:
+        vu.login()
+
+    started = time.time()
+    measure_from = started + args.warmup
+    stop_at = measure_from + args.duration
+
+    def loop(vu):
+        rng = random.Random(vu.index)
+        while time.time() < stop_at:
+            name = rng.choices(names, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                ok = getattr(vu, name)().status_code < 400
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - t0
+            if time.time() >= measure_from:
+                with lock:
+                    results[name].append((elapsed, ok))
+            if args.think_ms:
+                time.sleep(rng.expovariate(1000 / args.think_ms))
+
+    threads = [threading.Thread(target=loop, args=(vu,), daemon=True) for vu in users]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+# ========================================================================
+# REPORTING
+# ========================================================================
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def summarize(samples, duration):
+    latencies = sorted(s for s, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        "requests": len(samples),
+        "rps": round(len(samples) / duration, 2),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round((latencies[-1] if latencies else 0) * 1000, 1),
+    }
+
+
+def git_revision():
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return sha or "unknown", dirty
+    except OSError:
+        return "unknown", False
+
+
+def print_table(report, baseline=None):
+    header = f"{'route':<16}{'reqs':>7}{'rps':>9}{'err%':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    if baseline:
+        header += f"{'Δp95':>9}{'Δrps':>9}"
+    print(header)
+    rows = sorted(report["routes"].items()) + [("TOTAL", report["total"])]
+    for name, r in rows:
+        line = (f"{name:<16}{r['requests']:>7}{r['rps']:>9.1f}{r['error_rate'] * 100:>7.1f}"
+                f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['max_ms']:>9.1f}")
+        base = (baseline["routes"].get(name) if name != "TOTAL" else baseline["total"]) if baseline else None
+        if base and base["p95_ms"] and base["rps"]:
+            dp95 = (r["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100
+            drps = (r["rps"] - base["rps"]) / base["rps"] * 100
+            flag = "  ⚠️" if dp95 > 10 or drps < -10 else ""
+            line += f"{dp95:>+8.0f}%{drps:>+8.0f}%{flag}"
+        print(line)
+
+
+def previous_result(exclude):
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    files = sorted(f for f in os.listdir(RESULTS_DIR) if f.endswith(".json") and f != os.path.basename(exclude))
+    return os.path.join(RESULTS_DIR, files[-1]) if files else None
+
+
+def parse_mix(text):
+    if not text:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise SystemExit(f"Unknown scenario {name!r}; choose from {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of traffic excluded from stats")
+    parser.add_argument("--concurrency", type=int, default=16, help="virtual users (one logged-in account each)")
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between a user's requests")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=1, help="gunicorn threads per worker")
+    parser.add_argument("--no-worker", dest="worker", action="store_false", help="don't run the background job worker")
+    parser.add_argument("--mix", help="scenario weights, e.g. chat=5,call=3,transcribe=1")
+    parser.add_argument("--groq-ms", type=float, default=300)
+    parser.add_argument("--stripe-ms", type=float, default=150)
+    parser.add_argument("--translate-ms", type=float, default=100)
+    parser.add_argument("--smtp-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls that fail")
+    parser.add_argument("--compare", help="baseline result file (default: the latest in loadtest-results/)")
+    parser.add_argument("--label", default="", help="free-form note stored with the result")
+    args = parser.parse_args(argv)
+    mix = parse_mix(args.mix)
+
+    workdir = tempfile.mkdtemp(prefix="theralink-loadtest-")
+    fakes = []
+    procs = []
+    smtp = None
+    try:
+        groq_srv, groq = start_fake(FakeGroq, Fault(args.groq_ms, args.error_rate))
+        stripe_srv, stripe_url = start_fake(FakeStripe, Fault(args.stripe_ms, args.error_rate))
+        lt_srv, translate = start_fake(FakeTranslate, Fault(args.translate_ms, args.error_rate))
+        smtp, smtp_port = start_fake_smtp(Fault(args.smtp_ms, args.error_rate))
+        fakes = [groq_srv, stripe_srv, lt_srv]
+
+        env = app_env(args, workdir, groq, stripe_url, translate, smtp_port)
+        subprocess.run([sys.executable, "-c", SEED.format(password=PASSWORD, users=args.concurrency)],
+                       cwd=ROOT, env=env, check=True, capture_output=True)
+        procs, base = start_app(args, env, workdir, free_port())
+
+        print(f"Running {args.concurrency} users for {args.warmup:.0f}s warm-up + {args.duration:.0f}s "
+              f"(groq {args.groq_ms:.0f}ms, stripe {args.stripe_ms:.0f}ms, translate {args.translate_ms:.0f}ms, "
+              f"errors {args.error_rate:.1%})")
+        results = run_load(base, args, mix)
+    finally:
+        stop_procs(procs)
+        for srv in fakes:
+            srv.shutdown()
+        if smtp is not None:
+            smtp.stop()
+
+    sha, dirty = git_revision()
+    all_samples = [s for samples in results.values() for s in samples]
+    report = {
+        "format": 1,
+        "git": sha,
+        "dirty": dirty,
+        "label": args.label,
+        "finished_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "config": {k: v for k, v in vars(args).items() if k not in ("compare", "label")} | {"mix": mix},
+        "machine": {"python": sys.version.split()[0], "cpus": os.cpu_count()},
+        "routes": {name: summarize(samples, args.duration) for name, samples in results.items() if samples},
+        "total": summarize(all_samples, args.duration),
+    }
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out = os.path.join(RESULTS_DIR, f"{datetime.utcnow():%Y%m%dT%H%M%S}-{sha}{'-dirty' if dirty else ''}.json")
+    baseline_path = args.compare or previous_result(out)
+    baseline = None
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline.get("config", {}).get("mix") != mix:
+            print(f"(baseline {os.path.basename(baseline_path)} used a different mix; deltas are indicative only)")
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_table(report, baseline)
+    print(f"\nSaved {os.path.relpath(out, ROOT)}" + (f"; compared with {os.path.basename(baseline_path)}" if baseline else ""))
+    print(f"Server log: {os.path.join(workdir, 'server.log')}")
+
+
+if __name__ == "__main__":
+    main()
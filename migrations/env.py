@@ -45,6 +45,15 @@ target_db = current_app.extensions['migrate'].db
 # ... etc.
 
 
+# The session search index is built by raw SQL in c5e9a2d4b816 and is not in
+# the models: the SQLite FTS5 table session_fts (plus its session_fts_*
+# shadow tables) and the Postgres session_search table with its tsvector
+# index. Without this filter autogenerate would emit drops for them.
+def include_object(object, name, type_, reflected, compare_to):
+    table = name if type_ == "table" else getattr(getattr(object, "table", None), "name", "")
+    return not (table.startswith("session_fts") or table == "session_search")
+
+
 def get_metadata():
     if hasattr(target_db, 'metadatas'):
         return target_db.metadatas[None]
@@ -65,7 +74,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -93,6 +103,7 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    conf_args.setdefault("include_object", include_object)
 
     connectable = get_engine()
 
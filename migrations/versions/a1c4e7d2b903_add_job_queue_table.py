@@ -0,0 +1,46 @@
+"""Add job queue table
+
+Revision ID: a1c4e7d2b903
+Revises: 0dc02aadc659
+Create Date: 2026-10-19 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1c4e7d2b903'
+down_revision = '0dc02aadc659'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'job',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=64), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=True),
+        sa.Column('dedupe_key', sa.String(length=255), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('max_attempts', sa.Integer(), nullable=False),
+        sa.Column('run_at', sa.DateTime(), nullable=False),
+        sa.Column('locked_until', sa.DateTime(), nullable=True),
+        sa.Column('locked_by', sa.String(length=64), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('dedupe_key')
+    )
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.create_index('ix_job_status_run_at', ['status', 'run_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.drop_index('ix_job_status_run_at')
+
+    op.drop_table('job')
@@ -0,0 +1,31 @@
+"""Add admin user search indexes
+
+Revision ID: a4e1b6c8d925
+Revises: f2c9d4a7b613
+Create Date: 2026-10-19 18:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e1b6c8d925'
+down_revision = 'f2c9d4a7b613'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        # (group_id, email) also serves every lookup the single-column index did
+        batch_op.drop_index(batch_op.f('ix_user_group_id'))
+        batch_op.create_index('ix_user_group_id_email', ['group_id', 'email'], unique=False)
+        batch_op.create_index('ix_user_subscription_type_email', ['subscription_type', 'email'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_subscription_type_email')
+        batch_op.drop_index('ix_user_group_id_email')
+        batch_op.create_index(batch_op.f('ix_user_group_id'), ['group_id'], unique=False)
@@ -0,0 +1,48 @@
+"""Add email outbox table
+
+Revision ID: b7e2f19c4d05
+Revises: a1c4e7d2b903
+Create Date: 2026-10-19 13:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2f19c4d05'
+down_revision = 'a1c4e7d2b903'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'email_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('recipient', sa.String(length=255), nullable=False),
+        sa.Column('domain', sa.String(length=255), nullable=False),
+        sa.Column('sender', sa.String(length=255), nullable=True),
+        sa.Column('subject', sa.String(length=255), nullable=False),
+        sa.Column('body', sa.Text(), nullable=True),
+        sa.Column('html', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('locked_by', sa.String(length=64), nullable=True),
+        sa.Column('locked_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.create_index('ix_email_outbox_status_id', ['status', 'id'], unique=False)
+        batch_op.create_index('ix_email_outbox_recipient', ['recipient'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.drop_index('ix_email_outbox_recipient')
+        batch_op.drop_index('ix_email_outbox_status_id')
+
+    op.drop_table('email_outbox')
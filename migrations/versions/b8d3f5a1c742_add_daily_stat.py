@@ -0,0 +1,33 @@
+"""Add daily_stat analytics rollups
+
+Revision ID: b8d3f5a1c742
+Revises: a4e1b6c8d925
+Create Date: 2026-10-19 19:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d3f5a1c742'
+down_revision = 'a4e1b6c8d925'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'daily_stat',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('metric', sa.String(length=64), nullable=False),
+        sa.Column('dimension', sa.String(length=64), nullable=False),
+        sa.Column('value', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('day', 'metric', 'dimension', name='uq_daily_stat')
+    )
+
+
+def downgrade():
+    op.drop_table('daily_stat')
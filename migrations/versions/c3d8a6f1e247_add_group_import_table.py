@@ -0,0 +1,37 @@
+"""Add group import table
+
+Revision ID: c3d8a6f1e247
+Revises: b7e2f19c4d05
+Create Date: 2026-10-19 13:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3d8a6f1e247'
+down_revision = 'b7e2f19c4d05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'group_import',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('group_name', sa.String(length=120), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=False),
+        sa.Column('processed', sa.Integer(), nullable=False),
+        sa.Column('created', sa.Integer(), nullable=False),
+        sa.Column('updated', sa.Integer(), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('group_import')
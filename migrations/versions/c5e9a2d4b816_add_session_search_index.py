@@ -0,0 +1,104 @@
+"""Add the session full-text search index
+
+SQLite: an FTS5 table (rowid = user_session.id) kept current by triggers.
+Postgres: session_search with a generated tsvector + GIN index, kept current
+by a trigger (deletes cascade). Existing sessions are indexed here.
+
+Revision ID: c5e9a2d4b816
+Revises: b8d3f5a1c742
+Create Date: 2026-10-19 20:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e9a2d4b816'
+down_revision = 'b8d3f5a1c742'
+branch_labels = None
+depends_on = None
+
+
+SQLITE_TEXT = (
+    "coalesce((SELECT group_concat(coalesce(json_extract(value, '$.text'), json_extract(value, '$.content')), char(10))"
+    " FROM json_each(CASE WHEN json_valid({row}.messages) AND json_type({row}.messages) = 'array'"
+    " THEN {row}.messages ELSE '[]' END) WHERE type = 'object'), '')"
+)
+SQLITE_ROW = "'u' || {row}.user_id || ' k' || replace({row}.kind, '_', ''), coalesce({row}.name, ''), " + SQLITE_TEXT
+POSTGRES_TEXT = (
+    "coalesce((SELECT string_agg(coalesce(m ->> 'text', m ->> 'content'), E'\\n')"
+    " FROM json_array_elements(CASE WHEN json_typeof({row}.messages) = 'array'"
+    " THEN {row}.messages ELSE '[]'::json END) AS m WHERE json_typeof(m) = 'object'), '')"
+)
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "CREATE TABLE session_search ("
+            " session_pk INTEGER PRIMARY KEY REFERENCES user_session (id) ON DELETE CASCADE,"
+            " user_id INTEGER NOT NULL,"
+            " kind VARCHAR(20) NOT NULL,"
+            " name TEXT NOT NULL DEFAULT '',"
+            " body TEXT NOT NULL DEFAULT '',"
+            " document tsvector GENERATED ALWAYS AS (to_tsvector('simple', name || ' ' || body)) STORED)"
+        )
+        op.execute("CREATE INDEX ix_session_search_document ON session_search USING gin (document)")
+        op.execute("CREATE INDEX ix_session_search_user_kind ON session_search (user_id, kind)")
+        op.execute(
+            "CREATE OR REPLACE FUNCTION session_search_sync() RETURNS trigger AS $$ BEGIN "
+            "INSERT INTO session_search (session_pk, user_id, kind, name, body) "
+            "VALUES (NEW.id, NEW.user_id, NEW.kind, coalesce(NEW.name, ''), " + POSTGRES_TEXT.format(row="NEW") + ") "
+            "ON CONFLICT (session_pk) DO UPDATE SET user_id = EXCLUDED.user_id, kind = EXCLUDED.kind, "
+            "name = EXCLUDED.name, body = EXCLUDED.body; "
+            "RETURN NULL; END $$ LANGUAGE plpgsql"
+        )
+        op.execute(
+            "CREATE TRIGGER user_session_search AFTER INSERT OR UPDATE OF user_id, kind, name, messages "
+            "ON user_session FOR EACH ROW EXECUTE FUNCTION session_search_sync()"
+        )
+        op.execute(
+            "INSERT INTO session_search (session_pk, user_id, kind, name, body) "
+            "SELECT user_session.id, user_session.user_id, user_session.kind, coalesce(user_session.name, ''), "
+            + POSTGRES_TEXT.format(row="user_session") + " FROM user_session"
+        )
+        return
+
+    op.execute(
+        "CREATE VIRTUAL TABLE session_fts USING fts5("
+        "owner, name, body, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    op.execute(
+        "CREATE TRIGGER user_session_fts_insert AFTER INSERT ON user_session BEGIN "
+        "INSERT INTO session_fts (rowid, owner, name, body) VALUES (NEW.id, " + SQLITE_ROW.format(row="NEW") + "); "
+        "END"
+    )
+    op.execute(
+        "CREATE TRIGGER user_session_fts_update AFTER UPDATE OF user_id, kind, name, messages "
+        "ON user_session BEGIN "
+        "DELETE FROM session_fts WHERE rowid = OLD.id; "
+        "INSERT INTO session_fts (rowid, owner, name, body) VALUES (NEW.id, " + SQLITE_ROW.format(row="NEW") + "); "
+        "END"
+    )
+    op.execute(
+        "CREATE TRIGGER user_session_fts_delete AFTER DELETE ON user_session BEGIN "
+        "DELETE FROM session_fts WHERE rowid = OLD.id; "
+        "END"
+    )
+    op.execute(
+        "INSERT INTO session_fts (rowid, owner, name, body) "
+        "SELECT user_session.id, " + SQLITE_ROW.format(row="user_session") + " FROM user_session"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP TRIGGER IF EXISTS user_session_search ON user_session")
+        op.execute("DROP FUNCTION IF EXISTS session_search_sync()")
+        op.execute("DROP TABLE IF EXISTS session_search")
+        return
+
+    for trigger in ('user_session_fts_insert', 'user_session_fts_update', 'user_session_fts_delete'):
+        op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    op.execute("DROP TABLE IF EXISTS session_fts")
@@ -0,0 +1,42 @@
+"""Add Stripe event ledger
+
+Revision ID: d5f1b8e3a962
+Revises: c3d8a6f1e247
+Create Date: 2026-10-19 14:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5f1b8e3a962'
+down_revision = 'c3d8a6f1e247'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'stripe_event',
+        sa.Column('id', sa.String(length=255), nullable=False),
+        sa.Column('type', sa.String(length=120), nullable=False),
+        sa.Column('customer_key', sa.String(length=255), nullable=False),
+        sa.Column('stripe_created', sa.Integer(), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('received_at', sa.DateTime(), nullable=False),
+        sa.Column('processed_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('stripe_event', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_stripe_event_customer_key'), ['customer_key'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('stripe_event', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_stripe_event_customer_key'))
+
+    op.drop_table('stripe_event')
@@ -0,0 +1,125 @@
+"""Add the compressed session archive (cold tier)
+
+user_session gains updated_at/archived_at; archived transcripts move to
+session_archive. The search triggers now keep the indexed text of a session
+when its messages are archived (set to NULL).
+
+Revision ID: d7a4c1e9f253
+Revises: c5e9a2d4b816
+Create Date: 2026-10-19 21:30:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a4c1e9f253'
+down_revision = 'c5e9a2d4b816'
+branch_labels = None
+depends_on = None
+
+
+SQLITE_TEXT = (
+    "coalesce((SELECT group_concat(coalesce(json_extract(value, '$.text'), json_extract(value, '$.content')), char(10))"
+    " FROM json_each(CASE WHEN json_valid(NEW.messages) AND json_type(NEW.messages) = 'array'"
+    " THEN NEW.messages ELSE '[]' END) WHERE type = 'object'), '')"
+)
+SQLITE_ROW = "'u' || NEW.user_id || ' k' || replace(NEW.kind, '_', ''), coalesce(NEW.name, ''), " + SQLITE_TEXT
+POSTGRES_TEXT = (
+    "coalesce((SELECT string_agg(coalesce(m ->> 'text', m ->> 'content'), E'\\n')"
+    " FROM json_array_elements(CASE WHEN json_typeof(NEW.messages) = 'array'"
+    " THEN NEW.messages ELSE '[]'::json END) AS m WHERE json_typeof(m) = 'object'), '')"
+)
+
+
+def postgres_sync_function(keep_archived_body):
+    body = ("CASE WHEN NEW.archived_at IS NULL THEN EXCLUDED.body ELSE session_search.body END"
+            if keep_archived_body else "EXCLUDED.body")
+    return (
+        "CREATE OR REPLACE FUNCTION session_search_sync() RETURNS trigger AS $$ BEGIN "
+        "INSERT INTO session_search (session_pk, user_id, kind, name, body) "
+        "VALUES (NEW.id, NEW.user_id, NEW.kind, coalesce(NEW.name, ''), " + POSTGRES_TEXT + ") "
+        "ON CONFLICT (session_pk) DO UPDATE SET user_id = EXCLUDED.user_id, kind = EXCLUDED.kind, "
+        "name = EXCLUDED.name, body = " + body + "; "
+        "RETURN NULL; END $$ LANGUAGE plpgsql"
+    )
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    # Plain ADD COLUMN on both backends: rebuilding user_session would drop the search triggers
+    op.add_column('user_session', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.add_column('user_session', sa.Column('archived_at', sa.DateTime(), nullable=True))
+    # Bound as a DateTime so SQLite stores the same text format the app writes and compares
+    op.execute(sa.text("UPDATE user_session SET updated_at = :now")
+               .bindparams(sa.bindparam('now', datetime.utcnow(), type_=sa.DateTime())))
+    op.create_index('ix_user_session_archived_at_updated_at', 'user_session', ['archived_at', 'updated_at'],
+                    unique=False)
+
+    op.create_table(
+        'session_archive',
+        sa.Column('session_pk', sa.Integer(), nullable=False),
+        sa.Column('codec', sa.String(length=16), nullable=False),
+        sa.Column('payload', sa.LargeBinary(), nullable=False),
+        sa.Column('raw_bytes', sa.Integer(), nullable=False),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['session_pk'], ['user_session.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('session_pk'),
+    )
+
+    if dialect == 'postgresql':
+        op.execute(postgres_sync_function(keep_archived_body=True))
+        return
+
+    op.execute(
+        "CREATE TRIGGER user_session_archive_delete AFTER DELETE ON user_session BEGIN "
+        "DELETE FROM session_archive WHERE session_pk = OLD.id; "
+        "END"
+    )
+    op.execute("DROP TRIGGER IF EXISTS user_session_fts_update")
+    op.execute(
+        "CREATE TRIGGER user_session_fts_update AFTER UPDATE OF user_id, kind, name, messages "
+        "ON user_session BEGIN "
+        "UPDATE session_fts SET owner = 'u' || NEW.user_id || ' k' || replace(NEW.kind, '_', ''), "
+        "name = coalesce(NEW.name, ''), body = CASE WHEN NEW.archived_at IS NULL THEN "
+        + SQLITE_TEXT + " ELSE body END WHERE rowid = NEW.id; "
+        "END"
+    )
+
+
+def downgrade():
+    # Archived transcripts go back inline before the archive is dropped
+    # (zstd rows need the zstandard package).
+    import gzip
+
+    bind = op.get_bind()
+    archives = bind.execute(sa.text("SELECT session_pk, codec, payload FROM session_archive")).all()
+    for session_pk, codec, payload in archives:
+        if codec == 'zstd':
+            import zstandard
+            raw = zstandard.ZstdDecompressor().decompress(payload)
+        else:
+            raw = gzip.decompress(payload)
+        bind.execute(sa.text("UPDATE user_session SET messages = :messages, archived_at = NULL WHERE id = :pk"),
+                     {"pk": session_pk, "messages": raw.decode('utf-8')})
+
+    if bind.dialect.name == 'postgresql':
+        op.execute(postgres_sync_function(keep_archived_body=False))
+    else:
+        op.execute("DROP TRIGGER IF EXISTS user_session_archive_delete")
+        op.execute("DROP TRIGGER IF EXISTS user_session_fts_update")
+        op.execute(
+            "CREATE TRIGGER user_session_fts_update AFTER UPDATE OF user_id, kind, name, messages "
+            "ON user_session BEGIN "
+            "DELETE FROM session_fts WHERE rowid = OLD.id; "
+            "INSERT INTO session_fts (rowid, owner, name, body) VALUES (NEW.id, " + SQLITE_ROW + "); "
+            "END"
+        )
+
+    op.drop_table('session_archive')
+    op.drop_index('ix_user_session_archived_at_updated_at', table_name='user_session')
+    op.drop_column('user_session', 'archived_at')
+    op.drop_column('user_session', 'updated_at')
@@ -0,0 +1,26 @@
+"""Add the session retention index
+
+Revision ID: e3b9f6d2a418
+Revises: d7a4c1e9f253
+Create Date: 2026-10-19 22:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3b9f6d2a418'
+down_revision = 'd7a4c1e9f253'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user_session', schema=None) as batch_op:
+        batch_op.create_index('ix_user_session_kind_updated_at', ['kind', 'updated_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user_session', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_session_kind_updated_at')
@@ -0,0 +1,39 @@
+"""Add checkout session cache
+
+Revision ID: e8a4c2d7f310
+Revises: d5f1b8e3a962
+Create Date: 2026-10-19 14:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8a4c2d7f310'
+down_revision = 'd5f1b8e3a962'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'checkout_session_cache',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('email', sa.String(length=120), nullable=False),
+        sa.Column('purpose', sa.String(length=20), nullable=False),
+        sa.Column('stripe_session_id', sa.String(length=255), nullable=False),
+        sa.Column('url', sa.Text(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email', 'purpose', name='uq_checkout_email_purpose')
+    )
+    with op.batch_alter_table('checkout_session_cache', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_checkout_session_cache_stripe_session_id'), ['stripe_session_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('checkout_session_cache', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_checkout_session_cache_stripe_session_id'))
+
+    op.drop_table('checkout_session_cache')
@@ -0,0 +1,34 @@
+"""Add user and session lookup indexes
+
+Revision ID: f2c9d4a7b613
+Revises: e8a4c2d7f310
+Create Date: 2026-10-19 16:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c9d4a7b613'
+down_revision = 'e8a4c2d7f310'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_stripe_customer_id'), ['stripe_customer_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_user_group_id'), ['group_id'], unique=False)
+
+    with op.batch_alter_table('user_session', schema=None) as batch_op:
+        batch_op.create_index('ix_user_session_user_kind', ['user_id', 'kind'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user_session', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_session_user_kind')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_group_id'))
+        batch_op.drop_index(batch_op.f('ix_user_stripe_customer_id'))
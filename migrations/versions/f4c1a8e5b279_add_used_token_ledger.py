@@ -0,0 +1,35 @@
+"""Add the used_token ledger for single-use setup/reset links
+
+Revision ID: f4c1a8e5b279
+Revises: e3b9f6d2a418
+Create Date: 2026-10-19 22:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4c1a8e5b279'
+down_revision = 'e3b9f6d2a418'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'used_token',
+        sa.Column('digest', sa.String(length=64), nullable=False),
+        sa.Column('purpose', sa.String(length=20), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('digest')
+    )
+    with op.batch_alter_table('used_token', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_used_token_expires_at'), ['expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('used_token', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_used_token_expires_at'))
+
+    op.drop_table('used_token')
@@ -7,4 +7,7 @@ echo "🚀 Starting Render build..."
 pip install --upgrade pip
 pip install -r requirements.txt
 
+# Fingerprint + precompress static assets
+flask --app app build-assets
+
 echo "✅ Build complete!"
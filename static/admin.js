@@ -0,0 +1,175 @@
+// Admin console: user table paged from /admin/api/users, bulk actions on the server.
+
+// ---------------- 📋 State ----------------
+const usersTable = document.getElementById("users-table");
+const usersBody = document.getElementById("users-body");
+const searchForm = document.getElementById("user-search");
+const selectPage = document.getElementById("select-page");
+const selectAllMatching = document.getElementById("select-all-matching");
+const selectionCount = document.getElementById("selection-count");
+const prevButton = document.getElementById("page-prev");
+const nextButton = document.getElementById("page-next");
+const pageLabel = document.getElementById("page-label");
+
+const userQuery = { sort: "email", dir: "asc", q: "", group: "", type: "" };
+let cursors = [null];      // cursors[i] loads page i; null is the first page
+let nextCursor = null;
+const selected = new Set();
+
+// ---------------- 🔎 Loading ----------------
+function apiParams(cursor) {
+  const params = new URLSearchParams({ sort: userQuery.sort, dir: userQuery.dir, limit: usersTable.dataset.pageSize });
+  for (const key of ["q", "group", "type"]) {
+    if (userQuery[key]) params.set(key, userQuery[key]);
+  }
+  if (cursor) params.set("cursor", cursor);
+  return params;
+}
+
+async function loadUsers() {
+  const res = await fetch(`/admin/api/users?${apiParams(cursors[cursors.length - 1])}`);
+  const data = await res.json();
+  if (!data.success) {
+    alert(data.message || "Could not load users");
+    return;
+  }
+  nextCursor = data.next_cursor;
+  renderUsers(data.users);
+}
+
+function statusBadge(status) {
+  const span = document.createElement("span");
+  span.className = status === "Active" ? "status-active" : "status-pending";
+  span.textContent = status;
+  return span;
+}
+
+function renderUsers(users) {
+  usersBody.innerHTML = "";
+  users.forEach((user) => {
+    const tr = document.createElement("tr");
+
+    const check = document.createElement("input");
+    check.type = "checkbox";
+    check.checked = selected.has(user.id);
+    check.onchange = () => {
+      check.checked ? selected.add(user.id) : selected.delete(user.id);
+      updateSelection();
+    };
+
+    const cells = [check, user.email, user.group_id || "—", user.subscription_type || "—", statusBadge(user.status)];
+    cells.forEach((value) => {
+      const td = document.createElement("td");
+      td.append(value);
+      tr.appendChild(td);
+    });
+
+    const actions = document.createElement("td");
+    actions.className = "actions";
+    for (const [action, label] of [["grant_free", "Grant Free"], ["delete", "Delete"]]) {
+      const button = document.createElement("button");
+      button.className = "btn";
+      button.textContent = label;
+      button.onclick = () => runBulk(action, [user.id]);
+      actions.appendChild(button);
+    }
+    tr.appendChild(actions);
+    usersBody.appendChild(tr);
+  });
+
+  selectPage.checked = users.length > 0 && users.every((u) => selected.has(u.id));
+  prevButton.disabled = cursors.length === 1;
+  nextButton.disabled = !nextCursor;
+  pageLabel.textContent = `Page ${cursors.length}`;
+  usersTable.querySelectorAll("th.sortable").forEach((th) => {
+    th.dataset.dir = th.dataset.sort === userQuery.sort ? userQuery.dir : "";
+  });
+}
+
+function resetPaging() {
+  cursors = [null];
+  selected.clear();
+  selectAllMatching.checked = false;
+  updateSelection();
+  loadUsers();
+}
+
+// ---------------- ✅ Selection + bulk actions ----------------
+function updateSelection() {
+  selectionCount.textContent = selectAllMatching.checked
+    ? "All matching users selected"
+    : `${selected.size} selected`;
+}
+
+async function runBulk(action, ids) {
+  const all = !ids && selectAllMatching.checked;
+  ids = ids || [...selected];
+  if (!all && ids.length === 0) return;
+
+  const target = all ? "every user matching this search" : `${ids.length} user(s)`;
+  if (!confirm(`Apply "${action.replace("_", " ")}" to ${target}?`)) return;
+
+  const body = all
+    ? { action, all: true, filters: { q: userQuery.q, group: userQuery.group, type: userQuery.type } }
+    : { action, ids };
+  const res = await fetch("/admin/api/users/bulk", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(body)
+  });
+  const data = await res.json();
+  if (!data.success) {
+    alert(data.message || "Bulk action failed");
+    return;
+  }
+  if (data.queued) alert("⏳ Queued; the worker applies it to every matching user.");
+  selected.clear();
+  selectAllMatching.checked = false;
+  updateSelection();
+  loadUsers();
+}
+
+// ---------------- 🎛️ Events ----------------
+searchForm.addEventListener("submit", (e) => {
+  e.preventDefault();
+  const form = new FormData(searchForm);
+  for (const key of ["q", "group", "type"]) userQuery[key] = (form.get(key) || "").trim();
+  resetPaging();
+});
+
+usersTable.querySelectorAll("th.sortable").forEach((th) => {
+  th.addEventListener("click", () => {
+    if (userQuery.sort === th.dataset.sort) {
+      userQuery.dir = userQuery.dir === "asc" ? "desc" : "asc";
+    } else {
+      userQuery.sort = th.dataset.sort;
+      userQuery.dir = "asc";
+    }
+    resetPaging();
+  });
+});
+
+selectPage.addEventListener("change", () => {
+  usersBody.querySelectorAll("input[type=checkbox]").forEach((check) => {
+    check.checked = selectPage.checked;
+    check.dispatchEvent(new Event("change"));
+  });
+});
+
+selectAllMatching.addEventListener("change", updateSelection);
+
+document.querySelectorAll("[data-bulk]").forEach((button) => {
+  button.addEventListener("click", () => runBulk(button.dataset.bulk));
+});
+
+prevButton.addEventListener("click", () => {
+  cursors.pop();
+  loadUsers();
+});
+
+nextButton.addEventListener("click", () => {
+  cursors.push(nextCursor);
+  loadUsers();
+});
+
+loadUsers();
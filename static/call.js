@@ -28,184 +28,6 @@ let audioProcessor = null;
 let mediaStream = null;
 
 
-// 🔹 Calls always in English for speech + model
-const CALL_LANG_CODE = "en-US";
-
-// Preferred voices for English
-const preferredVoices = {
-  "en-US": {
-    female: ["Samantha", "Google US English", "Microsoft Aria Online (Natural) - English (United States)"],
-    male: ["Alex", "David", "Daniel", "Google US English"]
-  }
-};
-
-// ---------------- 🌍 Load UI Translations ----------------
-async function loadTranslations(lang) {
-  try {
-    const res = await fetch(`/static/lang/${lang}.json`);
-    translations = await res.json();
-    applyTranslations();
-  } catch (e) {
-    console.warn("Could not load language file:", lang, e);
-  }
-}
-
-
-function getQueryParam(name) {
-  const params = new URLSearchParams(window.location.search);
-  return params.get(name);
-}
-
-// --- save to DB
-function persistCallToDB(id) {
-  try {
-    const s = callSessions[id];
-    if (!s) return;
-    fetch("/sessions/save", {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      credentials: "include",
-      body: JSON.stringify({
-        session_id: id,
-        name: s.name || "Session",
-        messages: s.messages || [],
-        kind: "call"
-      })
-    }).catch(() => {});
-  } catch (_) {}
-}
-
-function applyTranslations() {
-  callStatus.innerText = !currentCallSessionId
-    ? (translations["call_status_placeholder"] || "Please create a new session to begin.")
-    : (translations["call_not_started"] || "Call not started.");
-
-  const placeholder = transcriptBox.querySelector(".transcript-placeholder");
-  if (placeholder) {
-    placeholder.innerText = translations["transcript_placeholder"] || "Transcript will appear here once the session begins.";
-  }
-
-  startCallBtn.innerText = translations["start_call"] || "Start Call";
-  endCallBtn.innerText = translations["end_call"] || "End Call";
-  newCallSessionBtn.innerText = translations["new_call_session"] || "New Session";
-  continueBtn.innerText = translations["continue"] || "Continue";
-  if (therapistGenderSelect && therapistGenderSelect.options.length >= 2) {
-    therapistGenderSelect.options[0].text = translations["female"] || "Female";
-    therapistGenderSelect.options[1].text = translations["male"] || "Male";
-  }
-}
-
-// ---------------- 💾 State ----------------
-function saveCallState() {
-  localStorage.setItem("callSessions", JSON.stringify(callSessions));
-  localStorage.setItem("currentCallSessionId", currentCallSessionId);
-  localStorage.setItem("therapistVoice", voiceGender);
-}
-
-function renderCallSessions() {
-  sessionList.innerHTML = "";
-  Object.entries(callSessions).forEach(([id, session]) => {
-    const li = document.createElement("li");
-    li.className = currentCallSessionId === id ? "active" : "";
-    li.innerHTML = `
-      <span class="session-title">${session.name || "Call Session"}</span>
-      <div class="session-actions">
-        <button onclick="renameCallSession('${id}')">✏️</button>
-        <button onclick="deleteCallSession('${id}')">🗑️</button>
-      </div>
-    `;
-    li.onclick = () => loadCallSession(id);
-    sessionList.appendChild(li);
-  });
-}
-
-function loadCallSession(id) {
-  currentCallSessionId = id;
-  renderTranscript(callSessions[id]);
-  updateButtonStates();
-  saveCallState();
-  applyTranslations();
-}
-
-function updateButtonStates() {
-  const disabled = !currentCallSessionId || !callSessions[currentCallSessionId];
-  startCallBtn.disabled = disabled;
-  endCallBtn.disabled = true;
-
-  callStatus.innerText = disabled
-    ? (translations["call_status_placeholder"] || "Please create a new session to begin.")
-    : (translations["call_not_started"] || "Call not started.");
-
-  if (disabled) {
-    transcriptBox.innerHTML = `<p class="transcript-placeholder">${translations["transcript_placeholder"] || "Transcript will appear here once the session begins."}</p>`;
-  }
-}
-
-// ---------------- 🎙️ TTS ----------------
-function ensureVoicesLoaded(timeoutMs = 1500) {
-  return new Promise(resolve => {
-    const t0 = performance.now();
-    const tick = () => {
-      const voices = speechSynthesis.getVoices();
-      if (voices.length) return resolve(voices);
-      if (performance.now() - t0 > timeoutMs) return resolve([]);
-      requestAnimationFrame(tick);
-    };
-    tick();
-  });
-}
-
-function pickVoice(langCode, gender) {
-  const voices = speechSynthesis.getVoices();
-  let candidates = voices.filter(v => v.lang.toLowerCase() === langCode.toLowerCase());
-
-  if (!candidates.length) {
-    const base2 = langCode.split("-")[0];
-    candidates = voices.filter(v => v.lang.toLowerCase().startsWith(base2));
-  }
-
-  const prefs = (preferredVoices[langCode] && preferredVoices[langCode][gender]) || [];
-  for (const name of prefs) {
-    const hit = candidates.find(v => v.name.toLowerCase() === name.toLowerCase());
-    if (hit) return hit;
-  }
-
-  const genderRegex = gender === "female"
-    ? /(female|aria|samantha|zira|eva)/i
-    : /(male|david|daniel|alex)/i;
-
-  return candidates.find(v => genderRegex.test(v.name)) || candidates[0] || voices[0] || null;
-}
-
-async function initVoices() {
-  await ensureVoicesLoaded();
-  selectedVoice = pickVoice(CALL_LANG_CODE, voiceGender);
-  if (!selectedVoice) {
-    console.warn("No matching voice found, using default.");
-    const voices = speechSynthesis.getVoices();
-    selectedVoice = voices[0] || null; // fallback voice
-  }
-}
-
-
-
-function playTurnSound() {
-  console.log("🔔 playTurnSound() called!");
-  const audio = new Audio("/static/sounds/turn.mp3");
-  audio.play().catch(err => console.warn("❌ Ding blocked:", err));
-}
-
-
-function showUserTurn() {
-  callStatus.innerText = "Your turn to speak...";
-  callStatus.style.color = "limegreen";
-}
-
-function hideUserTurn() {
-  callStatus.innerText = translations["call_in_progress"] || "Call in progress...";
-  callStatus.style.color = "";
-}
-
 function speakText(text) {
   const synth = window.speechSynthesis;
   synth.cancel();
@@ -313,135 +135,6 @@ function sendToTherapist(message) {
     });
 }
 
-function autoRenameCallSession() {
-  const session = callSessions[currentCallSessionId];
-  const messages = session.messages.slice(-6);
-
-  fetch("/call/rename_session", {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ messages, language: "en" })
-  })
-    .then(res => res.json())
-    .then(data => {
-      if (data.name) {
-        callSessions[currentCallSessionId].name = data.name;
-        titleGenerated = true;
-        renderCallSessions();
-        saveCallState();
-        persistCallToDB(currentCallSessionId);
-      }
-    });
-}
-
-function startListening() {
-  // ✅ iOS Safari fallback — use manual mic button
-  if (/iPhone|iPad|iPod/i.test(navigator.userAgent)) {
-    console.warn("iOS Safari detected — falling back to manual mic mode.");
-    callStatus.innerText = "🎤 Tap the mic button below to speak.";
-    return;
-  }
-
-  // ✅ Check browser support
-  if (!("webkitSpeechRecognition" in window)) {
-    console.warn("Speech recognition not supported in this browser.");
-    callStatus.innerText = "⚠️ Speech recognition not supported. Please use Chrome or Edge.";
-    return;
-  }
-
-  // ✅ Prevent overlap while therapist is talking
-  if (isTherapistSpeaking) return;
-
-  // Reset previous recognition if running
-  stopListening();
-
-  // Initialize recognition
-  recognition = new webkitSpeechRecognition();
-  recognition.continuous = true;
-  recognition.interimResults = true;
-  recognition.lang = CALL_LANG_CODE;
-  fullTranscript = "";
-
-  recognition.onstart = () => {
-    recognizing = true;
-    console.log("🎤 Listening started...");
-  };
-
-  recognition.onresult = (event) => {
-    if (isTherapistSpeaking) return;
-
-    // Reset silence timers on every new word
-    clearTimeout(silenceTimer);
-    clearTimeout(longSilenceTimer);
-
-    const result = Array.from(event.results)
-      .map(r => r[0].transcript)
-      .join(" ")
-      .trim();
-
-    if (result.length > 0) {
-      fullTranscript = result;
-
-      // ✅ Show live transcript
-      let live = transcriptBox.querySelector(".msg.user.speaking");
-      if (!live) {
-        const div = document.createElement("div");
-        div.className = "msg user speaking";
-        div.innerHTML = `<strong>${translations["you_speaking"] || "You (speaking)"}:</strong> 
-                         <span class="live-text">${fullTranscript}</span>`;
-        transcriptBox.appendChild(div);
-      } else {
-        live.querySelector(".live-text").innerText = fullTranscript;
-      }
-
-      transcriptBox.scrollTop = transcriptBox.scrollHeight;
-
-      // ✅ Short pause (~4.5s) → finalize and send to therapist
-      silenceTimer = setTimeout(() => {
-        recognition.stop();
-        recognizing = false;
-        sendToTherapist(fullTranscript);
-        fullTranscript = "";
-      }, 4500);
-    }
-
-    // ✅ Long silence (~10s) → stop listening, show Continue button
-    longSilenceTimer = setTimeout(() => {
-      if (!isTherapistSpeaking && fullTranscript === "") {
-        recognition.stop();
-        showUserTurn();
-        playTurnSound();
-        continueBtn.style.display = "inline-block";
-      }
-    }, 10000);
-  };
-
-  recognition.onerror = (e) => {
-    console.error("Recognition error:", e.error);
-    callStatus.innerText = "⚠️ Speech recognition error. Try again.";
-  };
-
-  recognition.onend = () => {
-    recognizing = false;
-    console.log("🎤 Listening ended.");
-  };
-
-  recognition.start();
-}
-
-function stopListening() {
-  if (recognition) {
-    try {
-      recognition.stop();
-    } catch (e) {
-      console.warn("Tried to stop recognition that wasn’t running.");
-    }
-  }
-  recognizing = false;
-  clearTimeout(silenceTimer);
-  clearTimeout(longSilenceTimer);
-}
-
 
 // ---------------- Sessions ----------------
 function addNewCallSession() {
@@ -460,81 +153,6 @@ function addNewCallSession() {
 }
 
 
-function renameCallSession(id) {
-  const newName = prompt(translations["rename_prompt"] || "Enter new session name:");
-  if (newName) {
-    callSessions[id].name = newName;
-    renderCallSessions();
-    saveCallState();
-  }
-}
-
-async function deleteCallSession(id) {
-  if (!confirm(translations["delete_confirm"] || "Delete this session?")) return;
-
-  // 🔹 Remove from memory
-  delete callSessions[id];
-
-  // 🔹 If active, reset UI
-  if (id === currentCallSessionId) {
-    currentCallSessionId = null;
-    transcriptBox.innerHTML = `<p class="transcript-placeholder">${
-      translations["transcript_placeholder"] || "Transcript will appear here once the session begins."
-    }</p>`;
-    callStatus.innerText = translations["call_status_placeholder"] || "Please create a new session to begin.";
-    startCallBtn.disabled = true;
-    endCallBtn.disabled = true;
-  }
-
-  renderCallSessions();
-  updateButtonStates();
-  saveCallState();
-
-  // 🔹 Delete globally in DB
-  try {
-    await fetch("/sessions/delete", {
-      method: "POST",
-      credentials: "include",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ session_id: id })
-    });
-
-    // 🔹 Notify dashboard if open
-    if (window.opener && !window.opener.closed) {
-      try {
-        window.opener.postMessage({ type: "refreshSessions" }, "*");
-      } catch (_) {
-        console.warn("Could not notify dashboard to refresh sessions");
-      }
-    }
-
-  } catch (err) {
-    console.error("Failed to delete from DB:", err);
-  }
-}
-
-
-function renderTranscript(session) {
-  transcriptBox.innerHTML = "";
-  if (!session || session.messages.length === 0) {
-    transcriptBox.innerHTML = `<p class="transcript-placeholder">${translations["transcript_placeholder"] || "Transcript will appear here once the session begins."}</p>`;
-    return;
-  }
-
-  session.messages.forEach(msg => {
-    if (msg.text === "__init__") return;
-    const msgDiv = document.createElement("div");
-    msgDiv.className = `msg ${msg.sender}`;
-    const label = msg.sender === "user"
-      ? (translations["you"] || "You")
-      : (translations["therapist"] || "Therapist");
-    msgDiv.innerHTML = `<strong>${label}:</strong> ${msg.text}`;
-    transcriptBox.appendChild(msgDiv);
-  });
-
-  transcriptBox.scrollTop = transcriptBox.scrollHeight;
-}
-
 // ---------------- Init ----------------
 therapistGenderSelect.value = voiceGender;
 therapistGenderSelect.onchange = async () => {
@@ -703,22 +321,12 @@ continueBtn.addEventListener("click", async () => {
 })();
 
 
-
 // ---------------- 🎤 Mic Button (iOS + Desktop) ----------------
 const micBtn = document.getElementById("micBtn");
 let mediaRecorder, audioChunks = [];
 let isRecording = false;
 
 
-// 🔴 Blink effect when auto-listening
-function setMicBlinking(active) {
-  if (active) {
-    micBtn.classList.add("blinking");
-  } else {
-    micBtn.classList.remove("blinking");
-  }
-}
-
 // ✅ Start recording (manual or auto)
 // ✅ Start recording (manual or auto) — fixed MIME/ext + safe cleanup
 async function startRecording(auto = false) {
@@ -829,16 +437,6 @@ async function startRecording(auto = false) {
 }
 
 
-
-// ✅ Silence detection (auto stop after 6s pause)
-function resetSilenceTimer() {
-  clearTimeout(silenceTimer);
-  silenceTimer = setTimeout(() => {
-    console.log("⏹ Auto stop: silence detected");
-    stopRecording();
-  }, 6000);
-}
-
 // ✅ Update mic button handler for iOS
 micBtn.onclick = () => {
   if (isIOS) {
@@ -879,8 +477,6 @@ function onTherapistFinished() {
 }
 
 
-
-
 // ---------------- 🎤 iOS Live Recording (Improved) ----------------
 
 let audioContext = null;
@@ -950,8 +546,6 @@ async function startIOSRecording() {
 }
 
 
-
-
 async function stopIOSRecording() {
   if (!isRecording) return;
   isRecording = false;
@@ -1058,7 +652,6 @@ function encodeWAV(samples, sampleRate) {
 }
 
 
-
 // ✅ Send audio to server
 async function sendAudioToServer(audioBlob) {
   console.log("📦 Audio blob size:", audioBlob.size, "type:", audioBlob.type);
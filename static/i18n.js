@@ -17,7 +17,7 @@
 
   async function loadTranslations(lang) {
     try {
-      const res = await fetch(`/static/lang/${lang}.json`);
+      const res = await fetchI18n(lang);
       if (!res.ok) throw new Error("Could not load translations");
       translations = await res.json();
 
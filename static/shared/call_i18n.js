@@ -0,0 +1,37 @@
+// Shared UI translation loading for call pages.
+
+function getQueryParam(name) {
+  const params = new URLSearchParams(window.location.search);
+  return params.get(name);
+}
+
+// ---------------- 🌍 Load UI Translations ----------------
+async function loadTranslations(lang) {
+  try {
+    const res = await fetchI18n(lang);
+    translations = await res.json();
+    applyTranslations();
+  } catch (e) {
+    console.warn("Could not load language file:", lang, e);
+  }
+}
+
+function applyTranslations() {
+  callStatus.innerText = !currentCallSessionId
+    ? (translations["call_status_placeholder"] || "Please create a new session to begin.")
+    : (translations["call_not_started"] || "Call not started.");
+
+  const placeholder = transcriptBox.querySelector(".transcript-placeholder");
+  if (placeholder) {
+    placeholder.innerText = translations["transcript_placeholder"] || "Transcript will appear here once the session begins.";
+  }
+
+  startCallBtn.innerText = translations["start_call"] || "Start Call";
+  endCallBtn.innerText = translations["end_call"] || "End Call";
+  newCallSessionBtn.innerText = translations["new_call_session"] || "New Session";
+  continueBtn.innerText = translations["continue"] || "Continue";
+  if (therapistGenderSelect && therapistGenderSelect.options.length >= 2) {
+    therapistGenderSelect.options[0].text = translations["female"] || "Female";
+    therapistGenderSelect.options[1].text = translations["male"] || "Male";
+  }
+}
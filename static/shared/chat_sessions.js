@@ -0,0 +1,98 @@
+// Shared chat-session helpers for chat.js / trial_chat.js.
+
+function uid() {
+  return "chat-" + Math.random().toString(36).slice(2, 9) + "-" + Date.now().toString(36);
+}
+
+// ===== Transcript render =====
+function setStatus(text) {
+  chatStatus.textContent = text || "";
+  chatStatus.style.display = text ? "block" : "none";
+}
+
+function renderTranscript() {
+  transcriptBox.innerHTML = "";
+
+  if (!currentChatSessionId || !chatSessions[currentChatSessionId]) {
+    const p = document.createElement("p");
+    p.className = "transcript-placeholder";
+    p.textContent =
+      translations["chat_transcript_placeholder"] ||
+      "Messages will appear here once the session begins.";
+    transcriptBox.appendChild(p);
+    return;
+  }
+
+  const msgs = chatSessions[currentChatSessionId].messages || [];
+  if (msgs.length === 0) {
+    const p = document.createElement("p");
+    p.className = "transcript-placeholder";
+    p.textContent =
+      translations["chat_start_placeholder"] ||
+      "Welcome — start your conversation when you’re ready.";
+    transcriptBox.appendChild(p);
+  } else {
+    msgs.forEach((m) => {
+      const div = document.createElement("div");
+      div.className = `msg ${m.sender}`;
+      const label =
+        m.sender === "user"
+          ? translations["you_label"] || "You"
+          : translations["therapist_label"] || "Therapist";
+      div.innerHTML = `<strong>${label}:</strong> ${m.text}`;
+      transcriptBox.appendChild(div);
+    });
+    transcriptBox.scrollTop = transcriptBox.scrollHeight;
+  }
+}
+
+// ===== Manual Rename =====
+function manualRenameSession(id) {
+  const session = chatSessions[id];
+  if (!session) return;
+
+  const newName =
+    prompt(translations["rename_prompt"] || "Enter new session name:") || "";
+  if (!newName) return;
+
+  if (!session.name || typeof session.name !== "object") {
+    session.name = {};
+  }
+  session.name[activeLang] = newName;
+  saveState();
+  renderSessions();
+}
+
+// ===== Auto-rename =====
+async function autoRenameCurrentSession(sampleText) {
+  try {
+    const res = await fetch("/chat/rename_session", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({
+        message: sampleText || "Therapy session",
+        language: activeLang,
+        session_id: currentChatSessionId,
+        kind: "chat",
+      }),
+    });
+    const data = await res.json();
+    // These sessions live in localStorage; only a session the server has saved is titled in the background
+    if (data && data.queued) return;
+    const newName =
+      (data && data.name) || translations["session_default"] || "Session";
+    if (currentChatSessionId && chatSessions[currentChatSessionId]) {
+      if (
+        !chatSessions[currentChatSessionId].name ||
+        typeof chatSessions[currentChatSessionId].name !== "object"
+      ) {
+        chatSessions[currentChatSessionId].name = {};
+      }
+      chatSessions[currentChatSessionId].name[activeLang] = newName;
+      saveState();
+      renderSessions();
+    }
+  } catch (e) {
+    console.error("Rename error:", e);
+  }
+}
@@ -0,0 +1,127 @@
+// Shared speech-recognition loop and silence handling for call pages.
+
+function startListening() {
+  // ✅ iOS Safari fallback — use manual mic button
+  if (/iPhone|iPad|iPod/i.test(navigator.userAgent)) {
+    console.warn("iOS Safari detected — falling back to manual mic mode.");
+    callStatus.innerText = "🎤 Tap the mic button below to speak.";
+    return;
+  }
+
+  // ✅ Check browser support
+  if (!("webkitSpeechRecognition" in window)) {
+    console.warn("Speech recognition not supported in this browser.");
+    callStatus.innerText = "⚠️ Speech recognition not supported. Please use Chrome or Edge.";
+    return;
+  }
+
+  // ✅ Prevent overlap while therapist is talking
+  if (isTherapistSpeaking) return;
+
+  // Reset previous recognition if running
+  stopListening();
+
+  // Initialize recognition
+  recognition = new webkitSpeechRecognition();
+  recognition.continuous = true;
+  recognition.interimResults = true;
+  recognition.lang = CALL_LANG_CODE;
+  fullTranscript = "";
+
+  recognition.onstart = () => {
+    recognizing = true;
+    console.log("🎤 Listening started...");
+  };
+
+  recognition.onresult = (event) => {
+    if (isTherapistSpeaking) return;
+
+    // Reset silence timers on every new word
+    clearTimeout(silenceTimer);
+    clearTimeout(longSilenceTimer);
+
+    const result = Array.from(event.results)
+      .map(r => r[0].transcript)
+      .join(" ")
+      .trim();
+
+    if (result.length > 0) {
+      fullTranscript = result;
+
+      // ✅ Show live transcript
+      let live = transcriptBox.querySelector(".msg.user.speaking");
+      if (!live) {
+        const div = document.createElement("div");
+        div.className = "msg user speaking";
+        div.innerHTML = `<strong>${translations["you_speaking"] || "You (speaking)"}:</strong> 
+                         <span class="live-text">${fullTranscript}</span>`;
+        transcriptBox.appendChild(div);
+      } else {
+        live.querySelector(".live-text").innerText = fullTranscript;
+      }
+
+      transcriptBox.scrollTop = transcriptBox.scrollHeight;
+
+      // ✅ Short pause (~4.5s) → finalize and send to therapist
+      silenceTimer = setTimeout(() => {
+        recognition.stop();
+        recognizing = false;
+        sendToTherapist(fullTranscript);
+        fullTranscript = "";
+      }, 4500);
+    }
+
+    // ✅ Long silence (~10s) → stop listening, show Continue button
+    longSilenceTimer = setTimeout(() => {
+      if (!isTherapistSpeaking && fullTranscript === "") {
+        recognition.stop();
+        showUserTurn();
+        playTurnSound();
+        continueBtn.style.display = "inline-block";
+      }
+    }, 10000);
+  };
+
+  recognition.onerror = (e) => {
+    console.error("Recognition error:", e.error);
+    callStatus.innerText = "⚠️ Speech recognition error. Try again.";
+  };
+
+  recognition.onend = () => {
+    recognizing = false;
+    console.log("🎤 Listening ended.");
+  };
+
+  recognition.start();
+}
+
+function stopListening() {
+  if (recognition) {
+    try {
+      recognition.stop();
+    } catch (e) {
+      console.warn("Tried to stop recognition that wasn’t running.");
+    }
+  }
+  recognizing = false;
+  clearTimeout(silenceTimer);
+  clearTimeout(longSilenceTimer);
+}
+
+// ✅ Silence detection (auto stop after 6s pause)
+function resetSilenceTimer() {
+  clearTimeout(silenceTimer);
+  silenceTimer = setTimeout(() => {
+    console.log("⏹ Auto stop: silence detected");
+    stopRecording();
+  }, 6000);
+}
+
+// 🔴 Blink effect when auto-listening
+function setMicBlinking(active) {
+  if (active) {
+    micBtn.classList.add("blinking");
+  } else {
+    micBtn.classList.remove("blinking");
+  }
+}
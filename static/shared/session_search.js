@@ -0,0 +1,77 @@
+// Sidebar search over the user's saved sessions (GET /sessions/search).
+// The page provides <input id="sessionSearch" data-kind data-page> and
+// <ul id="sessionSearchResults">; while a query is typed the results replace
+// the session list. Snippet HTML is escaped server-side; only <mark> is added.
+
+(function () {
+  const input = document.getElementById("sessionSearch");
+  const resultsList = document.getElementById("sessionSearchResults");
+  if (!input || !resultsList) return;
+  const sessionList = document.querySelector(".sidebar .session-list:not(#sessionSearchResults)");
+
+  let timer = null;
+  let page = 1;
+  let lastQuery = "";
+
+  function t(key, fallback) {
+    return (typeof translations !== "undefined" && translations[key]) || fallback;
+  }
+
+  function showResults(visible) {
+    resultsList.hidden = !visible;
+    if (sessionList) sessionList.hidden = visible;
+  }
+
+  function renderResult(result) {
+    const li = document.createElement("li");
+    li.className = "search-result";
+    li.innerHTML = `<span class="session-title">${result.name_html}</span>` +
+      `<span class="search-snippet">${result.snippet_html}</span>`;
+    li.onclick = () => {
+      window.location.href = `${input.dataset.page}?sid=${encodeURIComponent(result.session_id)}`;
+    };
+    return li;
+  }
+
+  async function search(query, nextPage) {
+    const params = new URLSearchParams({ q: query, page: nextPage });
+    if (input.dataset.kind) params.set("kind", input.dataset.kind);
+    const res = await fetch(`/sessions/search?${params}`, { credentials: "include" });
+    const data = await res.json();
+    if (query !== lastQuery) return;   // a newer query is in flight
+
+    if (nextPage === 1) resultsList.innerHTML = "";
+    resultsList.querySelector(".search-more")?.remove();
+    if (!data.success || (nextPage === 1 && data.results.length === 0)) {
+      const li = document.createElement("li");
+      li.className = "search-empty";
+      li.textContent = data.success ? t("search_no_results", "No matching sessions.") : (data.message || "Search failed");
+      resultsList.appendChild(li);
+      return;
+    }
+    data.results.forEach((r) => resultsList.appendChild(renderResult(r)));
+    if (data.has_more) {
+      const more = document.createElement("li");
+      more.className = "search-more";
+      more.textContent = t("search_more", "Show more");
+      more.onclick = () => search(query, ++page);
+      resultsList.appendChild(more);
+    }
+  }
+
+  input.addEventListener("input", () => {
+    clearTimeout(timer);
+    const query = input.value.trim();
+    if (!query) {
+      lastQuery = "";
+      showResults(false);
+      return;
+    }
+    timer = setTimeout(() => {
+      lastQuery = query;
+      page = 1;
+      showResults(true);
+      search(query, page).catch((e) => console.error("Session search failed:", e));
+    }, 250);
+  });
+})();
@@ -0,0 +1,176 @@
+// Shared call-session storage: localStorage state, sidebar list and DB sync.
+
+// ---------------- 💾 State ----------------
+function saveCallState() {
+  localStorage.setItem("callSessions", JSON.stringify(callSessions));
+  localStorage.setItem("currentCallSessionId", currentCallSessionId);
+  localStorage.setItem("therapistVoice", voiceGender);
+}
+
+function renderCallSessions() {
+  sessionList.innerHTML = "";
+  Object.entries(callSessions).forEach(([id, session]) => {
+    const li = document.createElement("li");
+    li.className = currentCallSessionId === id ? "active" : "";
+    li.innerHTML = `
+      <span class="session-title">${session.name || "Call Session"}</span>
+      <div class="session-actions">
+        <button onclick="renameCallSession('${id}')">✏️</button>
+        <button onclick="deleteCallSession('${id}')">🗑️</button>
+      </div>
+    `;
+    li.onclick = () => loadCallSession(id);
+    sessionList.appendChild(li);
+  });
+}
+
+function loadCallSession(id) {
+  currentCallSessionId = id;
+  renderTranscript(callSessions[id]);
+  updateButtonStates();
+  saveCallState();
+  applyTranslations();
+}
+
+function renameCallSession(id) {
+  const newName = prompt(translations["rename_prompt"] || "Enter new session name:");
+  if (newName) {
+    callSessions[id].name = newName;
+    renderCallSessions();
+    saveCallState();
+  }
+}
+
+async function deleteCallSession(id) {
+  if (!confirm(translations["delete_confirm"] || "Delete this session?")) return;
+
+  // 🔹 Remove from memory
+  delete callSessions[id];
+
+  // 🔹 If active, reset UI
+  if (id === currentCallSessionId) {
+    currentCallSessionId = null;
+    transcriptBox.innerHTML = `<p class="transcript-placeholder">${
+      translations["transcript_placeholder"] || "Transcript will appear here once the session begins."
+    }</p>`;
+    callStatus.innerText = translations["call_status_placeholder"] || "Please create a new session to begin.";
+    startCallBtn.disabled = true;
+    endCallBtn.disabled = true;
+  }
+
+  renderCallSessions();
+  updateButtonStates();
+  saveCallState();
+
+  // 🔹 Delete globally in DB
+  try {
+    await fetch("/sessions/delete", {
+      method: "POST",
+      credentials: "include",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ session_id: id, kind: "call" })
+    });
+
+    // 🔹 Notify dashboard if open
+    if (window.opener && !window.opener.closed) {
+      try {
+        window.opener.postMessage({ type: "refreshSessions" }, "*");
+      } catch (_) {
+        console.warn("Could not notify dashboard to refresh sessions");
+      }
+    }
+
+  } catch (err) {
+    console.error("Failed to delete from DB:", err);
+  }
+}
+
+function renderTranscript(session) {
+  transcriptBox.innerHTML = "";
+  if (!session || session.messages.length === 0) {
+    transcriptBox.innerHTML = `<p class="transcript-placeholder">${translations["transcript_placeholder"] || "Transcript will appear here once the session begins."}</p>`;
+    return;
+  }
+
+  session.messages.forEach(msg => {
+    if (msg.text === "__init__") return;
+    const msgDiv = document.createElement("div");
+    msgDiv.className = `msg ${msg.sender}`;
+    const label = msg.sender === "user"
+      ? (translations["you"] || "You")
+      : (translations["therapist"] || "Therapist");
+    msgDiv.innerHTML = `<strong>${label}:</strong> ${msg.text}`;
+    transcriptBox.appendChild(msgDiv);
+  });
+
+  transcriptBox.scrollTop = transcriptBox.scrollHeight;
+}
+
+// --- save to DB
+function persistCallToDB(id) {
+  try {
+    const s = callSessions[id];
+    if (!s) return;
+    fetch("/sessions/save", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      credentials: "include",
+      body: JSON.stringify({
+        session_id: id,
+        // While the server is titling the session, leave its name alone
+        name: s.titlePending ? undefined : (s.name || "Session"),
+        messages: s.messages || [],
+        kind: "call"
+      })
+    })
+      .then(res => res.json())
+      .then(data => {
+        if (!s.titlePending || !data.success) return;
+        if (data.name) s.name = data.name;
+        if (!data.title_pending) delete s.titlePending;
+        renderCallSessions();
+        saveCallState();
+      })
+      .catch(() => {});
+  } catch (_) {}
+}
+
+function autoRenameCallSession() {
+  const id = currentCallSessionId;
+  const session = callSessions[id];
+  const messages = session.messages.slice(-6);
+
+  fetch("/call/rename_session", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ messages, language: "en", session_id: id, kind: "call" })
+  })
+    .then(res => res.json())
+    .then(data => {
+      if (data.queued) {
+        session.titlePending = true;   // the worker names it; picked up on the next save
+        titleGenerated = true;
+        saveCallState();
+      } else if (data.name) {
+        session.name = data.name;
+        titleGenerated = true;
+        renderCallSessions();
+        saveCallState();
+        persistCallToDB(id);
+      }
+    });
+}
+
+function updateButtonStates() {
+  const disabled = !currentCallSessionId || !callSessions[currentCallSessionId];
+  startCallBtn.disabled = disabled;
+  endCallBtn.disabled = true;
+
+  callStatus.innerText = disabled
+    ? (translations["call_status_placeholder"] || "Please create a new session to begin.")
+    : (translations["call_not_started"] || "Call not started.");
+
+  if (disabled) {
+    transcriptBox.innerHTML = `<p class="transcript-placeholder">${translations["transcript_placeholder"] || "Transcript will appear here once the session begins."}</p>`;
+  }
+}
@@ -0,0 +1,75 @@
+// Shared speech-synthesis helpers (voice selection, turn cues).
+// Loaded before call.js / trial.js; relies on their page globals.
+
+// 🔹 Calls always in English for speech + model
+const CALL_LANG_CODE = "en-US";
+
+// Preferred voices for English
+const preferredVoices = {
+  "en-US": {
+    female: ["Samantha", "Google US English", "Microsoft Aria Online (Natural) - English (United States)"],
+    male: ["Alex", "David", "Daniel", "Google US English"]
+  }
+};
+
+// ---------------- 🎙️ TTS ----------------
+function ensureVoicesLoaded(timeoutMs = 1500) {
+  return new Promise(resolve => {
+    const t0 = performance.now();
+    const tick = () => {
+      const voices = speechSynthesis.getVoices();
+      if (voices.length) return resolve(voices);
+      if (performance.now() - t0 > timeoutMs) return resolve([]);
+      requestAnimationFrame(tick);
+    };
+    tick();
+  });
+}
+
+function pickVoice(langCode, gender) {
+  const voices = speechSynthesis.getVoices();
+  let candidates = voices.filter(v => v.lang.toLowerCase() === langCode.toLowerCase());
+
+  if (!candidates.length) {
+    const base2 = langCode.split("-")[0];
+    candidates = voices.filter(v => v.lang.toLowerCase().startsWith(base2));
+  }
+
+  const prefs = (preferredVoices[langCode] && preferredVoices[langCode][gender]) || [];
+  for (const name of prefs) {
+    const hit = candidates.find(v => v.name.toLowerCase() === name.toLowerCase());
+    if (hit) return hit;
+  }
+
+  const genderRegex = gender === "female"
+    ? /(female|aria|samantha|zira|eva)/i
+    : /(male|david|daniel|alex)/i;
+
+  return candidates.find(v => genderRegex.test(v.name)) || candidates[0] || voices[0] || null;
+}
+
+async function initVoices() {
+  await ensureVoicesLoaded();
+  selectedVoice = pickVoice(CALL_LANG_CODE, voiceGender);
+  if (!selectedVoice) {
+    console.warn("No matching voice found, using default.");
+    const voices = speechSynthesis.getVoices();
+    selectedVoice = voices[0] || null; // fallback voice
+  }
+}
+
+function playTurnSound() {
+  console.log("🔔 playTurnSound() called!");
+  const audio = new Audio("/static/sounds/turn.mp3");
+  audio.play().catch(err => console.warn("❌ Ding blocked:", err));
+}
+
+function showUserTurn() {
+  callStatus.innerText = "Your turn to speak...";
+  callStatus.style.color = "limegreen";
+}
+
+function hideUserTurn() {
+  callStatus.innerText = translations["call_in_progress"] || "Call in progress...";
+  callStatus.style.color = "";
+}
@@ -32,9 +32,6 @@ function saveState() {
   localStorage.setItem("trialChatSessionsLeft", sessionsLeft);
 }
 
-function uid() {
-  return "chat-" + Math.random().toString(36).slice(2, 9) + "-" + Date.now().toString(36);
-}
 
 // ===== Banner =====
 function updateBanner() {
@@ -124,22 +121,6 @@ function renderSessions() {
   });
 }
 
-// ===== Manual Rename =====
-function manualRenameSession(id) {
-  const session = chatSessions[id];
-  if (!session) return;
-
-  const newName =
-    prompt(translations["rename_prompt"] || "Enter new session name:") || "";
-  if (!newName) return;
-
-  if (!session.name || typeof session.name !== "object") {
-    session.name = {};
-  }
-  session.name[activeLang] = newName;
-  saveState();
-  renderSessions();
-}
 
 // ===== Session lifecycle =====
 function addNewSession() {
@@ -195,47 +176,6 @@ function activateSession(id) {
   setStatus(""); // clear
 }
 
-// ===== Transcript render =====
-function setStatus(text) {
-  chatStatus.textContent = text || "";
-  chatStatus.style.display = text ? "block" : "none";
-}
-
-function renderTranscript() {
-  transcriptBox.innerHTML = "";
-
-  if (!currentChatSessionId || !chatSessions[currentChatSessionId]) {
-    const p = document.createElement("p");
-    p.className = "transcript-placeholder";
-    p.textContent =
-      translations["chat_transcript_placeholder"] ||
-      "Messages will appear here once the session begins.";
-    transcriptBox.appendChild(p);
-    return;
-  }
-
-  const msgs = chatSessions[currentChatSessionId].messages || [];
-  if (msgs.length === 0) {
-    const p = document.createElement("p");
-    p.className = "transcript-placeholder";
-    p.textContent =
-      translations["chat_start_placeholder"] ||
-      "Welcome — start your conversation when you’re ready.";
-    transcriptBox.appendChild(p);
-  } else {
-    msgs.forEach((m) => {
-      const div = document.createElement("div");
-      div.className = `msg ${m.sender}`;
-      const label =
-        m.sender === "user"
-          ? translations["you_label"] || "You"
-          : translations["therapist_label"] || "Therapist";
-      div.innerHTML = `<strong>${label}:</strong> ${m.text}`;
-      transcriptBox.appendChild(div);
-    });
-    transcriptBox.scrollTop = transcriptBox.scrollHeight;
-  }
-}
 
 // ===== Sending flow =====
 async function sendMessage() {
@@ -309,40 +249,11 @@ async function sendMessage() {
   }
 }
 
-// ===== Auto-rename (multi-language) =====
-async function autoRenameCurrentSession(sampleText) {
-  try {
-    const res = await fetch("/chat/rename_session", {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({
-        message: sampleText || "Therapy session",
-        language: activeLang,
-      }),
-    });
-    const data = await res.json();
-    const newName =
-      (data && data.name) || translations["session_default"] || "Session";
-    if (currentChatSessionId && chatSessions[currentChatSessionId]) {
-      if (
-        !chatSessions[currentChatSessionId].name ||
-        typeof chatSessions[currentChatSessionId].name !== "object"
-      ) {
-        chatSessions[currentChatSessionId].name = {};
-      }
-      chatSessions[currentChatSessionId].name[activeLang] = newName;
-      saveState();
-      renderSessions();
-    }
-  } catch (e) {
-    console.error("Rename error:", e);
-  }
-}
 
 // ===== Language handling =====
 async function loadTranslations(lang) {
   try {
-    const res = await fetch(`/static/lang/${lang}.json`);
+    const res = await fetchI18n(lang);
     if (!res.ok) throw new Error("Could not load translations");
     const dict = await res.json();
 